@@ -0,0 +1,447 @@
+"""
+Columnar index over transcripts/, for the questions that used to need a one-off script
+("how long does section 4 take in CIRCLE rooms?", "hand raises per session by mode?").
+
+    python analytics.py                          # update the index, per-mode summary
+    python analytics.py sections --mode CIRCLE   # per-section durations
+    python analytics.py rooms                    # per-room aggregates
+    python analytics.py --rebuild                # re-parse everything
+
+Transcripts are parsed once, line by line, into three tables of NumPy columns kept in a
+single .npz: sessions (one row per transcript), sections (one row per section a session
+reached) and events (one row per transcript line). Files whose size and mtime haven't
+changed since the last run are not read again; a session still being written is simply
+re-parsed next time. Queries are group-bys over the columns, no Python loop per row.
+
+Sections come from the "Section N/M started" / "Material completed" System lines the
+tutor writes on every transition, and "Resumed at section N/M" when a session was
+restored from a snapshot (its first, partial section is left out of section timings).
+Older transcripts don't have them and count as a single section of unknown total.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import datetime
+import logging
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("philosophy-tutor")
+
+TRANSCRIPT_DIR = "transcripts"
+STORE_PATH = "metrics/transcripts.npz"
+STORE_VERSION = 2
+
+SPEAKERS = ("Agent", "User", "System")
+SPEAKER_OTHER = len(SPEAKERS)
+
+# event kinds
+LINE, HAND_RAISE, SECTION_START, COMPLETED = range(4)
+
+# same mapping as main.get_mode_from_roomname, so rooms can be filtered by shape
+SHAPE_MODES = {"SQUARE": "user_led", "CIRCLE": "agent_led", "TRIANGLE": "hand_raise"}
+
+_TEXT_LINE = re.compile(r"^\[(\d\d):(\d\d):(\d\d)\] ([^:]+): (.*)$")
+_SECTION_LINE = re.compile(r"^(?:Section (\d+)/(\d+) started|Resumed at section (\d+)/(\d+))$")
+
+SESSION_COLUMNS = {
+    "path": str, "room": str, "mode": str, "mtime_ns": np.int64, "size": np.int64,
+    "started": np.float64, "duration": np.float32, "lines": np.int32, "agent_words": np.int32,
+    "hand_raises": np.int16, "sections_reached": np.int16,
+    "sections_total": np.int16, "completed": np.bool_, "resumed": np.bool_,
+}
+SECTION_COLUMNS = {
+    "session": np.int32, "section": np.int16, "start": np.float32, "duration": np.float32,
+    "closed": np.bool_, "partial": np.bool_, "agent_words": np.int32, "hand_raises": np.int16,
+}
+EVENT_COLUMNS = {
+    "session": np.int32, "t": np.float32, "speaker": np.int8, "kind": np.int8, "section": np.int16, "words": np.int32,
+}
+
+
+# --- parsing ---------------------------------------------------------------------------
+
+def _read_text(f) -> Tuple[dict, Iterator[Tuple[float, str, str]]]:
+    header = {}
+    for line in f:
+        line = line.rstrip("\n")
+        if line.startswith("-----"):
+            break
+        key, _, value = line.partition(": ")
+        header[key] = value
+    started = datetime.datetime.strptime(header["Date"], "%Y-%m-%d %H:%M:%S")
+    meta = {"room": header.get("Transcript for room", ""), "mode": header.get("Mode", ""), "started": started.timestamp()}
+
+    def lines():
+        base = started.hour * 3600 + started.minute * 60 + started.second
+        days = 0
+        last = 0.0
+        for line in f:
+            match = _TEXT_LINE.match(line.rstrip("\n"))
+            if match is None:
+                continue # continuation of a multi-line message or the blank line after the header
+            h, m, s, speaker, text = match.groups()
+            t = int(h) * 3600 + int(m) * 60 + int(s) - base + days * 86400
+            if t < last - 43200: # wall clock went past midnight
+                days += 1
+                t += 86400
+            last = t
+            yield float(t), speaker, text
+
+    return meta, lines()
+
+
+def _read_jsonl(f) -> Tuple[dict, Iterator[Tuple[float, str, str]]]:
+    header = json.loads(next(f))
+    started = datetime.datetime.fromisoformat(header["date"]).timestamp()
+    meta = {"room": header.get("room", ""), "mode": header.get("mode", ""), "started": started}
+
+    def lines():
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield float(record["t"]), record["speaker"], record["text"]
+
+    return meta, lines()
+
+
+def parse_transcript(path: str) -> Tuple[dict, List[dict], Dict[str, list]]:
+    """ One transcript file, streamed: its session row, section rows and event columns """
+    events = {name: [] for name in EVENT_COLUMNS if name != "session"}
+    section = 0
+    total = -1
+    completed = False
+    resumed = False
+    section_starts = [(0, 0.0)] # (section, start)
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        meta, lines = (_read_jsonl if path.endswith(".jsonl") else _read_text)(f)
+        for t, speaker, text in lines:
+            kind = LINE
+            if speaker == "System":
+                if text == "User raised hand":
+                    kind = HAND_RAISE
+                elif text == "Material completed":
+                    kind = COMPLETED
+                    completed = True
+                    section_starts.append((section + 1, t)) # closes the last section
+                else:
+                    match = _SECTION_LINE.match(text)
+                    if match is not None:
+                        kind = SECTION_START
+                        number, total = (int(g) for g in (match.group(1, 2) if match.group(1) else match.group(3, 4)))
+                        section = number - 1
+                        if match.group(1) is None and len(section_starts) == 1:
+                            # a session restored from a snapshot (see snapshots.py) starts mid-lesson
+                            resumed = True
+                            section_starts = [(section, t)]
+                        else:
+                            section_starts.append((section, t))
+            events["t"].append(t)
+            events["speaker"].append(SPEAKERS.index(speaker) if speaker in SPEAKERS else SPEAKER_OTHER)
+            events["kind"].append(kind)
+            events["section"].append(section)
+            events["words"].append(len(text.split()))
+
+    t = np.asarray(events["t"], dtype=np.float32)
+    speaker = np.asarray(events["speaker"], dtype=np.int8)
+    kind = np.asarray(events["kind"], dtype=np.int8)
+    words = np.asarray(events["words"], dtype=np.int32)
+    sections = np.asarray(events["section"], dtype=np.int16)
+    duration = float(t[-1]) if len(t) else 0.0
+    stat = os.stat(path)
+
+    session = {
+        **meta,
+        "path": path,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "duration": duration,
+        "lines": len(t),
+        "agent_words": int(words[speaker == 0].sum()),
+        "hand_raises": int((kind == HAND_RAISE).sum()),
+        "sections_reached": section_starts[-1][0] + (0 if completed else 1),
+        "sections_total": total,
+        "completed": completed,
+        "resumed": resumed,
+    }
+
+    # a section runs until the next one starts; the last one only closes if the material was completed
+    section_rows = []
+    ends = [start for _, start in section_starts[1:]] + [duration]
+    for position, ((index, start), end) in enumerate(zip(section_starts, ends)):
+        if completed and position == len(section_starts) - 1:
+            break # the "Material completed" line starts nothing
+        in_section = sections == index
+        section_rows.append({
+            "section": index,
+            "start": start,
+            "duration": end - start,
+            "closed": position < len(section_starts) - 1,
+            "partial": resumed and position == 0, # the first part was taught before the reconnect
+            "agent_words": int(words[in_section & (speaker == 0)].sum()),
+            "hand_raises": int((in_section & (kind == HAND_RAISE)).sum()),
+        })
+    return session, section_rows, events
+
+
+def find_transcripts(root: str = TRANSCRIPT_DIR) -> List[str]:
+    """ Every session's transcript; with TRANSCRIPT_FORMAT=both the .jsonl (exact timestamps) wins """
+    found = {}
+    if not os.path.isdir(root):
+        return []
+    for room in os.scandir(root):
+        if not room.is_dir():
+            continue
+        for entry in os.scandir(room.path):
+            stem, ext = os.path.splitext(entry.name)
+            if not entry.name.startswith("transcript_") or ext not in (".txt", ".jsonl"):
+                continue
+            if ext == ".jsonl" or stem not in found:
+                found[os.path.join(room.path, stem)] = entry.path
+    return sorted(found.values())
+
+
+# --- the store -------------------------------------------------------------------------
+
+def _empty(columns: dict) -> Dict[str, np.ndarray]:
+    return {name: np.array([], dtype=dtype) for name, dtype in columns.items()}
+
+
+def _columns(rows: List[dict], columns: dict) -> Dict[str, np.ndarray]:
+    return {name: np.array([row[name] for row in rows], dtype=dtype) for name, dtype in columns.items()}
+
+
+def _take(table: Dict[str, np.ndarray], mask: np.ndarray) -> Dict[str, np.ndarray]:
+    return {name: column[mask] for name, column in table.items()}
+
+
+def _concat(tables: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+
+class TranscriptStore:
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self.sessions = _empty(SESSION_COLUMNS)
+        self.sections = _empty(SECTION_COLUMNS)
+        self.events = _empty(EVENT_COLUMNS)
+
+    @classmethod
+    def load(cls, path: str = STORE_PATH) -> "TranscriptStore":
+        store = cls(path)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data["version"]) != STORE_VERSION:
+                    logger.info(f"Transcript index {path} is from another version, rebuilding")
+                    return store
+                for prefix, table in (("sessions", store.sessions), ("sections", store.sections), ("events", store.events)):
+                    for name in table:
+                        table[name] = data[f"{prefix}.{name}"]
+        except FileNotFoundError:
+            pass
+        return store
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        arrays = {"version": np.array(STORE_VERSION)}
+        for prefix, table in (("sessions", self.sessions), ("sections", self.sections), ("events", self.events)):
+            arrays.update({f"{prefix}.{name}": column for name, column in table.items()})
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def __len__(self) -> int:
+        return len(self.sessions["path"])
+
+    def update(self, root: str = TRANSCRIPT_DIR) -> dict:
+        """ Drops rows of transcripts that changed or disappeared, parses the new ones """
+        paths = find_transcripts(root)
+        current = {}
+        for path in paths:
+            stat = os.stat(path)
+            current[path] = (stat.st_mtime_ns, stat.st_size)
+
+        known = self.sessions
+        keep = np.array([current.get(path) == (int(mtime), int(size))
+                         for path, mtime, size in zip(known["path"], known["mtime_ns"], known["size"])], dtype=bool)
+        unchanged = set(known["path"][keep].tolist())
+        dropped = len(keep) - int(keep.sum())
+
+        if dropped:
+            # renumber the surviving sessions so the session column stays a row index
+            remap = np.cumsum(keep) - 1
+            self.sessions = _take(known, keep)
+            for table in ("sections", "events"):
+                rows = getattr(self, table)
+                rows = _take(rows, keep[rows["session"]])
+                rows["session"] = remap[rows["session"]].astype(np.int32)
+                setattr(self, table, rows)
+
+        new_sessions, new_sections, new_events = [], [], []
+        failed = 0
+        for path in paths:
+            if path in unchanged:
+                continue
+            try:
+                session, sections, events = parse_transcript(path)
+            except (OSError, ValueError, KeyError, StopIteration) as e:
+                logger.warning(f"Skipping unreadable transcript {path}: {e!r}")
+                failed += 1
+                continue
+            index = len(self) + len(new_sessions)
+            new_sessions.append(session)
+            new_sections.extend({**row, "session": index} for row in sections)
+            events["session"] = [index] * len(events["t"])
+            new_events.append(_columns_from_lists(events))
+
+        if new_sessions:
+            self.sessions = _concat([self.sessions, _columns(new_sessions, SESSION_COLUMNS)])
+            self.sections = _concat([self.sections, _columns(new_sections, SECTION_COLUMNS)])
+            self.events = _concat([self.events] + new_events)
+        return {"sessions": len(self), "parsed": len(new_sessions), "dropped": dropped, "failed": failed}
+
+    # --- queries ---------------------------------------------------------------------
+
+    def session_mask(self, mode: Optional[str] = None, room: Optional[str] = None) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if mode is not None:
+            mask &= self.sessions["mode"] == SHAPE_MODES.get(mode.upper(), mode)
+        if room is not None:
+            mask &= np.char.find(self.sessions["room"], room) >= 0
+        return mask
+
+    def by_mode(self) -> List[dict]:
+        s = self.sessions
+        return aggregate([s["mode"]], ("mode",), {
+            "sessions": (s["duration"], "count"),
+            "completed": (s["completed"], "mean"),
+            "resumed": (s["resumed"], "mean"),
+            "duration_s": (s["duration"], "mean"),
+            "duration_p50_s": (s["duration"], "p50"),
+            "hand_raises": (s["hand_raises"], "mean"),
+            "sections_reached": (s["sections_reached"], "mean"),
+        })
+
+    def by_section(self, mode: Optional[str] = None, room: Optional[str] = None) -> List[dict]:
+        sections = self.sections
+        sections = _take(sections, self.session_mask(mode, room)[sections["session"]] & sections["closed"] & ~sections["partial"])
+        mode_column = self.sessions["mode"][sections["session"]]
+        return aggregate([mode_column, sections["section"] + 1], ("mode", "section"), {
+            "sessions": (sections["duration"], "count"),
+            "duration_s": (sections["duration"], "mean"),
+            "duration_p50_s": (sections["duration"], "p50"),
+            "duration_p95_s": (sections["duration"], "p95"),
+            "agent_words": (sections["agent_words"], "mean"),
+            "hand_raises": (sections["hand_raises"], "mean"),
+        })
+
+    def by_room(self, mode: Optional[str] = None) -> List[dict]:
+        s = _take(self.sessions, self.session_mask(mode))
+        return aggregate([s["room"], s["mode"]], ("room", "mode"), {
+            "sessions": (s["duration"], "count"),
+            "completed": (s["completed"], "mean"),
+            "duration_s": (s["duration"], "mean"),
+            "hand_raises": (s["hand_raises"], "sum"),
+            "last_started": (s["started"], "max"),
+        })
+
+
+def _columns_from_lists(events: Dict[str, list]) -> Dict[str, np.ndarray]:
+    return {name: np.asarray(events[name], dtype=dtype) for name, dtype in EVENT_COLUMNS.items()}
+
+
+def aggregate(keys: Sequence[np.ndarray], key_names: Sequence[str], values: Dict[str, Tuple[np.ndarray, str]]) -> List[dict]:
+    """
+    Group-by over columns: `keys` are equal-length arrays, `values` maps an output name to
+    (column, "count" | "sum" | "mean" | "max" | "p50" | "p95"). One row per key combination.
+    """
+    if not len(keys[0]):
+        return []
+    uniques, codes = zip(*(np.unique(key, return_inverse=True) for key in keys))
+    group = np.ravel_multi_index([c.ravel() for c in codes], [len(u) for u in uniques]) if len(keys) > 1 else codes[0].ravel()
+    groups, group = np.unique(group, return_inverse=True)
+    counts = np.bincount(group)
+
+    columns = {}
+    for name, (column, stat) in values.items():
+        column = column.astype(np.float64)
+        if stat == "count":
+            columns[name] = counts
+        elif stat == "sum":
+            columns[name] = np.bincount(group, weights=column)
+        elif stat == "mean":
+            columns[name] = np.bincount(group, weights=column) / counts
+        elif stat == "max":
+            result = np.full(len(groups), -np.inf)
+            np.maximum.at(result, group, column)
+            columns[name] = result
+        elif stat in ("p50", "p95"):
+            # nearest rank within each group, same as telemetry.Histogram
+            order = np.lexsort((column, group))
+            starts = np.cumsum(counts) - counts
+            rank = np.round(int(stat[1:]) / 100 * (counts - 1)).astype(np.int64)
+            columns[name] = column[order][starts + rank]
+        else:
+            raise ValueError(f"Unknown aggregate {stat}")
+
+    key_columns = [u[i] for u, i in zip(uniques, np.unravel_index(groups, [len(u) for u in uniques]))]
+    rows = []
+    for row in range(len(groups)):
+        record = {key_name: key[row].item() for key_name, key in zip(key_names, key_columns)}
+        record.update({name: int(column[row]) if values[name][1] == "count" else round(float(column[row]), 2) for name, column in columns.items()})
+        rows.append(record)
+    return rows
+
+
+def print_table(rows: List[dict]):
+    if not rows:
+        print("(no data)")
+        return
+    names = list(rows[0])
+    widths = [max(len(name), *(len(str(row[name])) for row in rows)) for name in names]
+    print("  ".join(name.rjust(width) for name, width in zip(names, widths)))
+    for row in rows:
+        print("  ".join(str(row[name]).rjust(width) for name, width in zip(names, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregates over the session transcripts")
+    parser.add_argument("query", nargs="?", default="modes", choices=("modes", "sections", "rooms"))
+    parser.add_argument("--mode", help="user_led, agent_led, hand_raise, or the room shape (SQUARE, CIRCLE, TRIANGLE)")
+    parser.add_argument("--room", help="only rooms whose name contains this")
+    parser.add_argument("--transcripts", default=TRANSCRIPT_DIR)
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing index")
+    parser.add_argument("--json", action="store_true", help="print the rows as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    started = time.perf_counter()
+    store = TranscriptStore(args.store) if args.rebuild else TranscriptStore.load(args.store)
+    update = store.update(args.transcripts)
+    if update["parsed"] or update["dropped"]:
+        store.save()
+    indexed = time.perf_counter()
+
+    if args.query == "sections":
+        rows = store.by_section(args.mode, args.room)
+    elif args.query == "rooms":
+        rows = store.by_room(args.mode)
+    else:
+        rows = store.by_mode()
+    queried = time.perf_counter()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+    print(f"\n{update['sessions']} sessions ({update['parsed']} parsed, {update['dropped']} dropped, {update['failed']} failed) "
+          f"indexed in {(indexed - started) * 1000:.0f}ms, query took {(queried - indexed) * 1000:.1f}ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+Hot path microbenchmarks: what runs on every turn (_teaching_enrichment, the understanding
+check, progress_check, the speaking and data callbacks) and the summary parsing, against
+synthetic chat histories of 10 to 5000 messages and summaries of 5 to 500 sections.
+
+    python bench_hotpath.py                   # compare against metrics/hotpath_baseline.json
+    python bench_hotpath.py --save-baseline   # this machine's numbers become the baseline
+    python bench_hotpath.py --only enrichment --threshold 0.5
+
+Exits with status 1 if a case got slower than its baseline by more than --threshold
+(relative) and --min-delta-us (absolute, so sub-microsecond jitter doesn't fail the run).
+Baselines are per machine, they live in metrics/ and aren't committed.
+
+The callbacks are the real ones: main.entrypoint runs on the load test's fake room and
+plugins (see loadtest.py), only nobody plays the student, the benchmark calls them.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import asyncio
+import inspect
+import logging
+import argparse
+import statistics
+import tempfile
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+os.environ.setdefault("OPENAI_API_KEY", "bench") # the fake resource pool still builds a (never used) OpenAI client
+
+from livekit.agents import llm
+
+import main
+import loadtest
+import protocol
+from bench_startup import git_revision
+from prompts import chat_template
+from understanding import UnderstandingTracker
+
+logger = logging.getLogger("philosophy-tutor")
+
+BASELINE = "metrics/hotpath_baseline.json"
+HISTORY_SIZES = "10,100,1000,5000"
+SECTION_COUNTS = "5,20,100,500"
+
+USER_TURNS = (
+    "Why does ritual matter so much to Confucius?",
+    "So virtue is something you practice rather than something you have?",
+    "I learned that the sage's virtue comes from practice and ritual, not from birth.",
+    "<continue>",
+)
+
+
+# --- synthetic inputs ----------------------------------------------------------------
+
+def synthetic_sections(count: int) -> List[str]:
+    """ The real summary's sections, cycled, or the load test's synthetic ones """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "summary.md")
+    base = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            base = main.split_summary_into_sections(f.read())
+    if not base:
+        base = [
+            f"Section {i}: Confucius and the cultivation of virtue, part {i}. Keywords: ren, li, junzi. "
+            "People: Confucius, Mencius, Xunzi. Virtue is practiced in ritual, family and government."
+            for i in range(1, 7)
+        ]
+    return [base[i % len(base)] for i in range(count)]
+
+
+def synthetic_summary(count: int) -> str:
+    return "# Summary" + "".join(f"\n\n#### Section\n\n{part}" for part in synthetic_sections(count))
+
+
+def synthetic_history(size: int, mode: str = "agent_led") -> List[llm.ChatMessage]:
+    """
+    The system prompt, then alternating student/tutor turns up to `size` messages. No
+    section boundaries and no confirmation, so anything scanning back for them goes all
+    the way: the worst case, and what a long user-led session looks like.
+    """
+    sections = synthetic_sections(8)
+    messages = list(chat_template(mode).messages)
+    messages.append(llm.ChatMessage.create(text=f"Teaching Context: Begin discussing this topic now: {sections[0]}", role="system"))
+    i = 0
+    while len(messages) < size:
+        if i % 2 == 0:
+            messages.append(llm.ChatMessage.create(text=USER_TURNS[(i // 2) % len(USER_TURNS)], role="user"))
+        else:
+            words = sections[(i // 2) % len(sections)].split()
+            messages.append(llm.ChatMessage.create(text="Uh, so, " + " ".join(words[:60]) + ".", role="assistant"))
+        i += 1
+    return messages[:size]
+
+
+# --- timing --------------------------------------------------------------------------
+
+class Case:
+    """ call() is timed, reset() (untimed) puts the state back before every call """
+
+    def __init__(self, name: str, call: Callable, reset: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.call = call
+        self.reset = reset
+
+
+async def _run(case: Case, number: int) -> float:
+    total = 0.0
+    for _ in range(number):
+        if case.reset is not None:
+            case.reset()
+        started = time.perf_counter()
+        result = case.call()
+        if inspect.isawaitable(result):
+            await result
+        total += time.perf_counter() - started
+    return total
+
+
+async def measure(case: Case, repeat: int, round_time: float) -> Dict:
+    """ Like timeit: calls per round grow until a round takes `round_time`, then `repeat` rounds """
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while number < 1_000_000:
+            if await _run(case, number) >= round_time:
+                break
+            number *= 2
+        rounds = [await _run(case, number) / number * 1e6 for _ in range(repeat)]
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {"median_us": round(statistics.median(rounds), 3), "min_us": round(min(rounds), 3), "number": number}
+
+
+# --- cases ---------------------------------------------------------------------------
+
+class _SayStub:
+    """ agent.say as progress_check and _teaching_enrichment see it, minus the speech """
+
+    def __init__(self, chat_ctx: llm.ChatContext):
+        self.chat_ctx = chat_ctx
+        self.said = 0
+
+    async def say(self, text: str, *, allow_interruptions: bool = True, add_to_chat_ctx: bool = True):
+        self.said += 1
+
+
+def parsing_cases(section_counts: List[int]) -> List[Case]:
+    cases = []
+    for count in section_counts:
+        text = synthetic_summary(count)
+        cases.append(Case(f"split_summary_into_sections[{count} sections]", lambda text=text: main.split_summary_into_sections(text)))
+    return cases
+
+
+def understanding_cases(sizes: List[int]) -> List[Case]:
+    cases = []
+    sections = synthetic_sections(8)
+    for size in sizes:
+        chat_ctx = llm.ChatContext(messages=synthetic_history(size))
+        tracker = UnderstandingTracker()
+        cases.append(Case(
+            f"UnderstandingTracker.evaluate[{size} msgs]",
+            lambda chat_ctx=chat_ctx, tracker=tracker: tracker.evaluate(chat_ctx, 0, sections),
+        ))
+    return cases
+
+
+def progress_cases(ctx, section_counts: List[int]) -> List[Case]:
+    cases = []
+    for count in section_counts:
+        tutor = main.PhilosophyTutor(main.TeachingMode.AGENT_LED, ctx, tuple(synthetic_sections(count)))
+        agent = _SayStub(llm.ChatContext())
+        # at a third of the way, the branch that speaks
+        tutor.current_section = count // 3
+        cases.append(Case(f"progress_check[{count} sections]", lambda agent=agent, tutor=tutor: main.progress_check(agent, tutor)))
+    return cases
+
+
+def enrichment_cases(ctx, sizes: List[int], sections: int) -> List[Case]:
+    """
+    A student answering the check in agent-led mode, in the middle of the material: once
+    right after the tutor confirmed (the section advances), once not yet (nothing does).
+    """
+    cases = []
+    for size in sizes:
+        for outcome, tutor_line in (("advance", loadtest.CONFIRMATION), ("pending", loadtest.QUESTION)):
+            history = synthetic_history(max(3, size - 2))
+            history.append(llm.ChatMessage.create(text=tutor_line, role="assistant"))
+            history.append(llm.ChatMessage.create(text=USER_TURNS[2], role="user"))
+            committed = llm.ChatContext(messages=list(history[:-1]))
+            chat_ctx = llm.ChatContext(messages=list(history)) # the reply's copy, like before_llm_cb gets
+            agent = _SayStub(committed)
+            tutor = main.PhilosophyTutor(main.TeachingMode.AGENT_LED, ctx, tuple(synthetic_sections(sections)))
+            tutor.tasks = ctx.proc.userdata["tutor"].tasks
+
+            def reset(tutor=tutor, committed=committed, chat_ctx=chat_ctx, n=len(history)):
+                del committed.messages[n - 1:]
+                del chat_ctx.messages[n:]
+                tutor.current_section = sections // 2
+                tutor.pending_check = True
+                tutor.understanding.mark_section_boundary()
+
+            cases.append(Case(
+                f"_teaching_enrichment[{outcome}, {size} msgs]",
+                lambda agent=agent, chat_ctx=chat_ctx, tutor=tutor: main._teaching_enrichment(agent, chat_ctx, tutor, ctx),
+                reset,
+            ))
+    return cases
+
+
+def callback_cases(agent, sizes: List[int]) -> List[Case]:
+    """ Every handler the session registered for the event, as the agent would emit it """
+    events = (
+        ("agent_started_speaking", ()),
+        ("agent_stopped_speaking", ()),
+        ("user_started_speaking", ()),
+        ("user_stopped_speaking", ()),
+        ("agent_speech_committed", (llm.ChatMessage.create(text="Uh, so, ren is the virtue of humaneness.", role="assistant"),)),
+    )
+    cases = []
+    for size in sizes:
+        history = synthetic_history(size, "user_led")
+
+        def use_history(history=history):
+            if agent.chat_ctx.messages is not history:
+                agent.chat_ctx.messages = history
+
+        for event, args in events:
+            handlers = list(agent._handlers.get(event, []))
+
+            def emit(handlers=handlers, args=args):
+                for handler in handlers:
+                    handler(*args)
+
+            cases.append(Case(f"{event}[{size} msgs]", emit, use_history))
+
+    handlers = list(agent.room._handlers.get("data_received", []))
+    packets = (
+        ("HAND_RAISED", SimpleNamespace(data=b"HAND_RAISED", topic=protocol.LEGACY_TOPIC, participant=None, kind=None)),
+        ("hand v1", SimpleNamespace(data=protocol.encode([("hand", {"raised": True})]), topic=protocol.TOPIC, participant=None, kind=None)),
+    )
+    for label, packet in packets:
+        def data_received(handlers=handlers, packet=packet):
+            for handler in handlers:
+                handler(packet)
+
+        cases.append(Case(f"data_received[{label}]", data_received))
+    return cases
+
+
+class _IdleAgent(loadtest.FakeAgent):
+    """ The load test's agent without the scripted student and the playout loop """
+
+    def start(self, room, participant=None):
+        self.stats = room.stats
+        self.room = room
+        room.agent = self
+
+
+async def run(args) -> Dict[str, Dict]:
+    sizes = [int(n) for n in args.sizes.split(",")]
+    section_counts = [int(n) for n in args.sections.split(",")]
+
+    config = loadtest.LoadConfig(loadtest.build_parser().parse_args(["--sections", "12"]))
+    stats = loadtest.Stats()
+    main.VoicePipelineAgent = _IdleAgent
+    userdata = {
+        "resources": loadtest.FakeResourcePool(config),
+        "latency": main.WorkerLatency(main.LATENCY_LOG_PATH),
+        "materials": main.MaterialRegistry(),
+        "snapshots": main.SnapshotStore(),
+        "health": main.WorkerHealth(main.HEALTH_LOG_PATH),
+    }
+    userdata["resources"].prewarm()
+    userdata["materials"].preload()
+
+    # user-led, so agent_stopped_speaking goes through the continuation scheduling too
+    room = loadtest.FakeRoom("SQUARE-bench-0", "user_led", config, stats)
+    ctx = loadtest.FakeJobContext(room, dict(userdata))
+    await loadtest._start_job(ctx) # sets the job context, as the worker does
+
+    cases = parsing_cases(section_counts) + understanding_cases(sizes) + progress_cases(ctx, section_counts) \
+        + enrichment_cases(ctx, sizes, 12) + callback_cases(room.agent, sizes)
+    if args.only:
+        cases = [case for case in cases if any(part in case.name for part in args.only.split(","))]
+
+    results = {}
+    try:
+        for case in cases:
+            results[case.name] = await measure(case, args.repeat, args.round_time)
+            print(f"{case.name:<58} {results[case.name]['median_us']:>12.2f} us", file=sys.stderr)
+            await asyncio.sleep(0) # let whatever the case spawned (prefetches, packets) run outside the timing
+    finally:
+        await loadtest._leave(room, ctx, "benchmark finished")
+    return results
+
+
+def load_baseline(path: str) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict, threshold: float, min_delta_us: float) -> List[str]:
+    """ Prints the table, returns the cases that regressed """
+    regressed = []
+    cases = baseline.get("cases", {})
+    print(f"{'case':<58} {'median us':>12} {'min us':>12} {'baseline':>12} {'change':>8}")
+    for name, result in results.items():
+        line = f"{name:<58} {result['median_us']:>12.2f} {result['min_us']:>12.2f}"
+        base = cases.get(name)
+        if base:
+            change = result["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+            line += f" {base['median_us']:>12.2f} {change:>+8.1%}"
+            if change > threshold and result["median_us"] - base["median_us"] > min_delta_us:
+                regressed.append(name)
+                line += "  REGRESSED"
+        print(line)
+    return regressed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the per-turn callbacks")
+    parser.add_argument("--sizes", default=HISTORY_SIZES, help="chat history lengths, comma separated")
+    parser.add_argument("--sections", default=SECTION_COUNTS, help="summary section counts, comma separated")
+    parser.add_argument("--only", help="run the cases whose name contains one of these, comma separated")
+    parser.add_argument("--repeat", type=int, default=7, help="timed rounds per case, the median is reported")
+    parser.add_argument("--round-time", type=float, default=0.02, help="calls per round grow until a round takes this long, seconds")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.3, help="relative slowdown that fails the run")
+    parser.add_argument("--min-delta-us", type=float, default=1.0, help="absolute slowdown below which it doesn't")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline instead of comparing")
+    parser.add_argument("--json", help="also write the results here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.WARNING) # main sets INFO on import, and the callbacks log a lot
+
+    baseline_path = os.path.abspath(args.baseline)
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix="tutor-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir) # the session's transcript, metrics and tts cache land here
+    try:
+        loadtest.write_material("summary.md", 12)
+        results = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {"ts": time.time(), "rev": git_revision(), "python": sys.version.split()[0], "cases": results}
+    if json_path:
+        os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+
+    if args.save_baseline:
+        # merged, so a --only run updates just its own cases
+        baseline = load_baseline(baseline_path)
+        record["cases"] = {**baseline.get("cases", {}), **results}
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        compare(results, {}, args.threshold, args.min_delta_us)
+        print(f"\nbaseline saved to {args.baseline}")
+        return
+
+    baseline = load_baseline(baseline_path)
+    if not baseline:
+        print(f"no baseline at {args.baseline}, run with --save-baseline first\n", file=sys.stderr)
+    regressed = compare(results, baseline, args.threshold, args.min_delta_us)
+    if baseline:
+        print(f"\nbaseline from {baseline.get('rev') or 'unknown revision'}, {time.strftime('%Y-%m-%d %H:%M', time.localtime(baseline.get('ts', 0)))}")
+    if regressed:
+        print(f"{len(regressed)} cases regressed by more than {args.threshold:.0%}: {regressed}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
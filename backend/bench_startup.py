@@ -0,0 +1,131 @@
+"""
+Worker startup benchmark: how long a freshly spawned job process takes from exec to
+ready-for-job (import main + prewarm), tracked over time in a JSONL history.
+
+    python bench_startup.py                 # 5 cold runs, appended to metrics/startup.jsonl
+    python bench_startup.py --runs 10 --no-prewarm
+    python bench_startup.py --top 15        # also list the slowest imports
+
+Each run is a new interpreter, like a job process the worker spawns. Prewarm loads the
+silero weights from the plugin package, it doesn't need the network.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+from telemetry import append_jsonl
+
+HISTORY = "metrics/startup.jsonl"
+
+# runs inside the child, prints one JSON line with its own split of the time
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+prewarm_ms = None
+if {prewarm}:
+    from types import SimpleNamespace
+    main.prewarm(SimpleNamespace(userdata={{}}))
+    prewarm_ms = (time.perf_counter() - imported) * 1000
+print(json.dumps({{"import_ms": (imported - started) * 1000, "prewarm_ms": prewarm_ms, "modules": len(sys.modules)}}))
+"""
+
+
+def run_once(prewarm: bool, importtime: bool = False) -> Dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench") # prewarm builds an OpenAI TTS for the cache key, nothing is sent
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", _CHILD.format(prewarm=prewarm)]
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    total_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["spawn_to_ready_ms"] = total_ms
+    if importtime:
+        result["importtime"] = proc.stderr
+    return result
+
+
+def slowest_imports(importtime_log: str, top: int) -> List[tuple]:
+    """ main.py and what it imports directly, by cumulative import time, from python -X importtime """
+    totals = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2 # two more spaces per level of nesting
+        if cumulative.strip().isdigit() and depth <= 1:
+            totals[name.strip()] = int(cumulative) / 1000
+    return sorted(totals.items(), key=lambda item: -item[1])[:top]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def last_record(path: str, prewarm: bool) -> Dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return {}
+    records = [record for record in records if record.get("prewarm") == prewarm]
+    return records[-1] if records else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold worker startup benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-prewarm", action="store_true", help="only time the import of main.py")
+    parser.add_argument("--history", default=HISTORY, help="JSONL file the result is appended to")
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest top-level imports")
+    parser.add_argument("--no-record", action="store_true", help="don't append to the history")
+    args = parser.parse_args()
+    prewarm = not args.no_prewarm
+
+    run_once(prewarm) # warm the OS page cache, the first run after a pip install is always an outlier
+    runs = [run_once(prewarm) for _ in range(args.runs)]
+
+    record = {
+        "ts": time.time(),
+        "rev": git_revision(),
+        "python": sys.version.split()[0],
+        "prewarm": prewarm,
+        "runs": args.runs,
+        "modules": runs[-1]["modules"],
+    }
+    for name in ("spawn_to_ready_ms", "import_ms", "prewarm_ms"):
+        values = [run[name] for run in runs if run[name] is not None]
+        if values:
+            record[name] = round(statistics.median(values), 1)
+            record[f"{name}_min"] = round(min(values), 1)
+
+    previous = last_record(args.history, prewarm)
+    for name in ("spawn_to_ready_ms", "import_ms", "prewarm_ms"):
+        if name not in record:
+            continue
+        delta = f" ({record[name] - previous[name]:+.1f} vs {previous.get('rev') or 'previous'})" if name in previous else ""
+        print(f"{name:>18}: {record[name]:8.1f} median, {record[name + '_min']:8.1f} min{delta}")
+    print(f"{'modules':>18}: {record['modules']}")
+
+    if args.top:
+        print("\nslowest imports (cumulative ms):")
+        for name, ms in slowest_imports(run_once(prewarm, importtime=True)["importtime"], args.top):
+            print(f"  {ms:8.1f}  {name}")
+
+    if not args.no_record:
+        append_jsonl(args.history, [record])
+
+
+if __name__ == "__main__":
+    main()
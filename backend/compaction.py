@@ -0,0 +1,114 @@
+import re
+import logging
+from typing import List, Optional, Sequence
+
+from livekit.agents import llm
+
+from tokens import message_text, message_tokens
+
+logger = logging.getLogger("philosophy-tutor")
+
+TEACHING_CONTEXT_PREFIX = "Teaching Context:"
+SECTION_COMPLETED = "Section Completed"
+
+_FIRST_SENTENCE = re.compile(r"(.+?[.!?])(\s|$)", re.S)
+
+
+def summarize_section(section: str, max_chars: int = 200) -> str:
+    """ Cheap one-liner for a finished section: its first sentence, clipped """
+    section = " ".join(section.split())
+    match = _FIRST_SENTENCE.match(section)
+    sentence = match.group(1) if match else section
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+    return sentence
+
+
+def build_rolling_summary(sections: Sequence[str], completed: int, max_chars: int = 200) -> Optional[str]:
+    if completed <= 0:
+        return None
+    lines = [f"{i + 1}. {summarize_section(section, max_chars)}" for i, section in enumerate(sections[:completed])]
+    return "Sections already covered (do not repeat them, refer back only if asked):\n" + "\n".join(lines)
+
+
+class ContextCompactor:
+    """
+    Runs on the copied ChatContext right before every LLM call. Keeps the system prompt,
+    the current section's Teaching Context, one copy of each instruction block and a short
+    rolling summary of finished sections, then fills what is left of `max_tokens` with the
+    most recent conversation. The summary (and a Teaching Context brought back) go last,
+    before the student's turn, so the system prompt and conversation stay a stable prefix.
+    agent.chat_ctx itself is never touched.
+    """
+
+    def __init__(self, max_tokens: int = 4000, summary_chars: int = 200):
+        self.max_tokens = max_tokens
+        self.summary_chars = summary_chars
+        self.prompt_tokens: List[int] = [] # per turn, after compaction
+        self.dropped_messages = 0
+
+    def compact(self, chat_ctx: llm.ChatContext, sections: Sequence[str], current_section: int) -> int:
+        msgs = chat_ctx.messages
+        tokens_before = sum(message_tokens(m) for m in msgs)
+        keep = [False] * len(msgs)
+
+        # system prompt
+        has_system_prompt = bool(msgs) and msgs[0].role == "system"
+        keep[:1] = [has_system_prompt]
+
+        # only the newest Teaching Context, and only the last copy of any other repeated system block
+        last_teaching = None
+        seen_system = set()
+        for i in range(len(msgs) - 1, 0, -1):
+            if msgs[i].role != "system":
+                continue
+            text = message_text(msgs[i])
+            if text.startswith(TEACHING_CONTEXT_PREFIX):
+                if last_teaching is None:
+                    last_teaching = i
+                    keep[i] = True
+            elif text != SECTION_COMPLETED and text not in seen_system:
+                seen_system.add(text)
+                keep[i] = True
+
+        extra: List[llm.ChatMessage] = []
+        summary = build_rolling_summary(sections, min(current_section, len(sections)), self.summary_chars)
+        if summary:
+            extra.append(llm.ChatMessage.create(text=summary, role="system"))
+        if last_teaching is None and current_section < len(sections):
+            # agent-led transitions only put the Teaching Context into that one LLM call, bring it back
+            extra.append(llm.ChatMessage.create(text=f"{TEACHING_CONTEXT_PREFIX} The current section's podcast outline (keep teaching it): {sections[current_section]}", role="system"))
+
+        budget = self.max_tokens
+        budget -= sum(message_tokens(m) for m in extra)
+        budget -= sum(message_tokens(m) for i, m in enumerate(msgs) if keep[i])
+
+        # newest conversation first, as a contiguous tail; the last message always stays
+        first_kept = None
+        for i in range(len(msgs) - 1, -1, -1):
+            if msgs[i].role == "system":
+                continue
+            cost = message_tokens(msgs[i])
+            if cost > budget and first_kept is not None:
+                break
+            keep[i] = True
+            budget -= cost
+            first_kept = i
+        # a tool result without its tool call is rejected by the API
+        while first_kept is not None and first_kept < len(msgs) and msgs[first_kept].role == "tool":
+            keep[first_kept] = False
+            first_kept = next((j for j in range(first_kept + 1, len(msgs)) if keep[j] and msgs[j].role != "system"), None)
+
+        compacted = [m for i, m in enumerate(msgs) if keep[i]]
+        # right before the turn being answered, like the per-reply reminders: the summary changes every
+        # section, anything after it would miss the provider's prefix cache
+        insert_at = max(len(compacted) - 1, 1 if has_system_prompt else 0)
+        compacted[insert_at:insert_at] = extra
+
+        self.dropped_messages += len(msgs) - sum(keep)
+        msgs[:] = compacted
+
+        tokens_after = sum(message_tokens(m) for m in msgs)
+        self.prompt_tokens.append(tokens_after)
+        logger.info(f"Prompt tokens (turn {len(self.prompt_tokens)}, section {current_section}): {tokens_before} -> {tokens_after}")
+        return tokens_after
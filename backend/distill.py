@@ -1,11 +1,45 @@
 import os
-from openai import OpenAI
+import json
+import time
+import random
+import hashlib
+import asyncio
+import argparse
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from materials import split_summary_into_sections
+from outline import OUTLINE_FILE, build_outline, compress_extractive, extract_keywords, extract_names
+from retrieval import INDEX_DIR, HashingEmbedder, OpenAIEmbedder, build_index
+from tokens import estimate_tokens
 
 # oops lol
 api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable not set")
-client = OpenAI(api_key=api_key)
+if api_key:
+    client = OpenAI(api_key=api_key)
+    # retries are handled by distill_section so the backoff is ours, not the SDK's
+    aclient = AsyncOpenAI(api_key=api_key, max_retries=0)
+else:
+    client = aclient = None # only `--index-only --embedder hashing` works without a key
+
+
+def require_client():
+    if client is None:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+
+MODEL = "gpt-4-turbo"
+TEMPERATURE = 0.3
+CHECKPOINT_PATH = "summary.checkpoint.json"
+CACHE_DIR = ".distill_cache"
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# errors worth retrying, everything else (bad request, auth) fails the run immediately
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
 
 
 def get_raw_data(material_path):
@@ -17,54 +51,355 @@ def get_raw_data(material_path):
     else:
         return Exception(f"Could not find path {material_path}")
 
-def generate_summary(material_path):
-    content = get_raw_data(material_path) # lol
-    print("Distilling from raw data...")
 
+LEARNING_OBJECTIVES = [
+    "Identify sages (early philosophers) across historical traditions.",
+    "Explain the connection between ancient philosophy and the origin of the sciences.",
+    "Describe philosophy as a discipline that makes coherent sense of a whole.",
+    "Summarize the broad and diverse origins of philosophy."
+]
+
+REVIEW_QUESTIONS = [
+    "What are some common characteristics of ancient sages in the Greek, Indian, and Chinese traditions?",
+    "What characteristics are essential for being identified as a “sage”?",
+    "What is the connection between sages and philosophers?",
+    "Provide one example of an ancient philosopher or sage who was doing something like natural science. What made this philosopher's activity scientific?",
+    "What does it mean for philosophy to “have an eye on the whole”? How is this different from other disciplines?",
+    "Why is it necessary for philosophers to discard suppositions or assumptions that may be acceptable in other disciplines?"
+]
+
+SYSTEM_PROMPT = (
+    "You are a philosophy professor creating part of a podcast (should be a short paragraph in length) from a paragraph of the material. "
+    # "specifically focused specifically on these learning objectives:\n" +
+    # "\n".join(f"- {obj}" for obj in LEARNING_OBJECTIVES) +
+    # "\n\nThese should serve to guide your summary making but do not mention them explitly."
+)
 
-    LEARNING_OBJECTIVES = [
-        "Identify sages (early philosophers) across historical traditions.",
-        "Explain the connection between ancient philosophy and the origin of the sciences.",
-        "Describe philosophy as a discipline that makes coherent sense of a whole.",
-        "Summarize the broad and diverse origins of philosophy."
+
+COMPRESS_PROMPT = (
+    "You are editing part of a podcast outline. Shorten the paragraph you are given, keeping every example, "
+    "keyword and person it mentions. Drop repetition and filler, not content. Reply with the paragraph only."
+)
+
+
+def build_messages(section):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Here is the paragraph:\n\n{section}\n\nDo not include an intro or outro, this content will be part of the middle of the podcast."}
     ]
 
-    REVIEW_QUESTIONS = [
-        "What are some common characteristics of ancient sages in the Greek, Indian, and Chinese traditions?",
-        "What characteristics are essential for being identified as a “sage”?",
-        "What is the connection between sages and philosophers?",
-        "Provide one example of an ancient philosopher or sage who was doing something like natural science. What made this philosopher's activity scientific?",
-        "What does it mean for philosophy to “have an eye on the whole”? How is this different from other disciplines?",
-        "Why is it necessary for philosophers to discard suppositions or assumptions that may be acceptable in other disciplines?"
+
+def build_compress_messages(section, budget, terms):
+    must_mention = f" It must still mention: {', '.join(terms)}." if terms else ""
+    return [
+        {"role": "system", "content": COMPRESS_PROMPT},
+        {"role": "user", "content": f"Here is the paragraph:\n\n{section}\n\nShorten it to at most {budget} tokens (about {budget * 3 // 4} words).{must_mention}"}
     ]
-    system_prompt = (
-        "You are a philosophy professor creating part of a podcast (should be a short paragraph in length) from a paragraph of the material. "
-        # "specifically focused specifically on these learning objectives:\n" + 
-        # "\n".join(f"- {obj}" for obj in LEARNING_OBJECTIVES) + 
-        # "\n\nThese should serve to guide your summary making but do not mention them explitly."
-    )
 
 
-    with open("summary.md", "w", encoding="utf-8") as f:
+def write_summary(summaries, out_path="summary.md"):
+    with open(out_path, "w", encoding="utf-8") as f:
         f.write("### Philosophy\n\n")
-        for section in content:
+        for summary in summaries:
             f.write("#### Section\n\n")
-            
+            f.write(f"{summary}\n\n")
+
+
+def generate_summary_serial(material_path, out_path="summary.md"):
+    """ The original one-paragraph-at-a-time loop, kept around to benchmark against """
+    require_client()
+    content = get_raw_data(material_path) # lol
+    print("Distilling from raw data (serial)...")
+
+    summaries = []
+    for section in content:
+        response = client.chat.completions.create(
+            messages=build_messages(section),
+            model=MODEL,
+            temperature=TEMPERATURE,
+        )
+        summaries.append(response.choices[0].message.content)
+    write_summary(summaries, out_path)
+
+
+def _section_key(section):
+    # checkpoint and cache entries are only reused if the paragraph, prompt and model are unchanged
+    return hashlib.sha256(f"{MODEL}\0{TEMPERATURE}\0{SYSTEM_PROMPT}\0{section}".encode("utf-8")).hexdigest()
+
+
+def _compress_key(section, budget):
+    return hashlib.sha256(f"{MODEL}\0{TEMPERATURE}\0{COMPRESS_PROMPT}\0{budget}\0{section}".encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """ On-disk, content-addressed store of distilled sections (one file per _section_key) with LRU eviction by total size """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # kept up to date by put(), the directory is only listed again when it goes over max_bytes
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                summary = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path) # bump for LRU
+        self.hits += 1
+        return summary
+
+    def put(self, key, summary):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        self.total_bytes += os.path.getsize(path) - replaced
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".txt"):
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            self.evictions += 1
+        self.total_bytes = total
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), {self.evictions} evictions"
+
 
-            response = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Here is the paragraph:\n\n{section}\n\nDo not include an intro or outro, this content will be part of the middle of the podcast."}
-                ],
-                model="gpt-4-turbo",
-                temperature=0.3,
-            )
-            f.write(f"{response.choices[0].message.content}\n\n")
-    
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return {}
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint {checkpoint_path}: {e}")
+        return {}
+
+
+def save_checkpoint(checkpoint_path, done):
+    # write-then-rename so a kill mid-write never leaves a corrupt checkpoint
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(done, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+async def distill_section(section, semaphore, retries=5, backoff=1.0, max_backoff=30.0, messages=None):
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                response = await aclient.chat.completions.create(
+                    messages=messages or build_messages(section),
+                    model=MODEL,
+                    temperature=TEMPERATURE,
+                )
+                return response.choices[0].message.content
+            except RETRYABLE_ERRORS as e:
+                if attempt == retries:
+                    raise
+                # exponential backoff with full jitter
+                delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+                print(f"Retrying after {type(e).__name__} (attempt {attempt + 1}/{retries}, sleeping {delay:.1f}s)")
+                await asyncio.sleep(delay)
+
+
+async def distill_sections(content, concurrency=8, retries=5, checkpoint_path=CHECKPOINT_PATH, cache=None):
+    """ Distills every paragraph concurrently, returns the summaries in paragraph order """
+    keys = [_section_key(section) for section in content]
+    done = load_checkpoint(checkpoint_path)
+    summaries = [done.get(key) for key in keys]
+    if any(summary is not None for summary in summaries):
+        print(f"Resuming from checkpoint, {sum(s is not None for s in summaries)}/{len(content)} sections already done")
+
+    # only cache misses go to the model
+    if cache is not None:
+        for i, key in enumerate(keys):
+            if summaries[i] is None:
+                summaries[i] = cache.get(key)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index):
+        summaries[index] = await distill_section(content[index], semaphore, retries=retries)
+        if cache is not None:
+            cache.put(keys[index], summaries[index])
+        done[keys[index]] = summaries[index]
+        save_checkpoint(checkpoint_path, done)
+        print(f"Distilled section {index + 1}/{len(content)}")
+
+    await asyncio.gather(*(run(i) for i, summary in enumerate(summaries) if summary is None))
+    return summaries
+
+
+async def compress_sections(sections, budget, concurrency=8, retries=5, cache=None):
+    """
+    Sections over `budget` tokens rewritten to fit it, the rest as they are. The model does
+    the rewriting when there's a key, whole sentences are dropped when there isn't (or
+    when the model overshoots).
+    """
+    names = extract_names(sections)
+    keywords = extract_keywords(sections, names)
+    semaphore = asyncio.Semaphore(concurrency)
+    compressed = list(sections)
+
+    async def run(index):
+        section, terms = sections[index], names[index] + keywords[index]
+        text = None
+        if aclient is not None:
+            key = _compress_key(section, budget)
+            text = cache.get(key) if cache is not None else None
+            if text is None:
+                text = await distill_section(section, semaphore, retries=retries, messages=build_compress_messages(section, budget, terms))
+                if cache is not None:
+                    cache.put(key, text)
+        if text is None or estimate_tokens(text) > budget:
+            text = compress_extractive(text or section, budget, terms)
+        compressed[index] = text
+        print(f"Compressed section {index + 1}/{len(sections)}: {estimate_tokens(section)} -> {estimate_tokens(text)} tokens")
+
+    await asyncio.gather(*(run(i) for i, section in enumerate(sections) if estimate_tokens(section) > budget))
+    return compressed
+
+
+def write_outline(out_path, originals=None, budget=None):
+    """ outline.json next to the summary, built from the summary as written so its fingerprint matches what the tutor parses """
+    with open(out_path, "r", encoding="utf-8") as f:
+        sections = split_summary_into_sections(f.read())
+    outline = build_outline(sections, originals, budget)
+    path = os.path.join(os.path.dirname(out_path), OUTLINE_FILE)
+    outline.save(path)
+    low, high = outline.token_range()
+    compressed = sum(info.compressed for info in outline.sections)
+    print(f"Outlined {len(sections)} sections into {path} ({low}-{high} tokens each, {compressed} compressed)")
+
+
+def generate_summary(material_path, out_path="summary.md", concurrency=8, retries=5, checkpoint_path=CHECKPOINT_PATH, cache=None,
+                     section_budget=0, outline=True):
+    require_client()
+    content = get_raw_data(material_path) # lol
+    print(f"Distilling from raw data (concurrency {concurrency})...")
+
+    summaries = asyncio.run(distill_sections(content, concurrency=concurrency, retries=retries, checkpoint_path=checkpoint_path, cache=cache))
+    originals = [summary.strip() for summary in summaries]
+    if section_budget:
+        summaries = asyncio.run(compress_sections(originals, section_budget, concurrency=concurrency, retries=retries, cache=cache))
+    write_summary(summaries, out_path)
+    if outline:
+        write_outline(out_path, originals, section_budget or None)
+    if cache is not None:
+        print(cache.report())
+    # only a complete run clears the checkpoint
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def generate_outline(out_path="summary.md", section_budget=0, concurrency=8, retries=5, cache=None):
+    """ Outlines (and with a budget, compresses) an existing summary """
+    with open(out_path, "r", encoding="utf-8") as f:
+        sections = [section.strip() for section in split_summary_into_sections(f.read())]
+    if section_budget:
+        compressed = asyncio.run(compress_sections(sections, section_budget, concurrency=concurrency, retries=retries, cache=cache))
+        if compressed != sections:
+            write_summary(compressed, out_path)
+    write_outline(out_path, sections, section_budget or None)
+
+
+def generate_index(material_path, index_dir=INDEX_DIR, embedder_name="auto"):
+    """ Retrieval index over the raw paragraphs, chunk i of paragraph N maps to summary section N """
+    content = get_raw_data(material_path) # lol
+    if isinstance(content, Exception):
+        raise content
+
+    embedder = HashingEmbedder()
+    if embedder_name in ("openai", "auto") and client is not None:
+        embedder = OpenAIEmbedder(client=client)
+    elif embedder_name == "openai":
+        require_client()
+
+    print(f"Indexing raw paragraphs with {embedder.name} embeddings...")
+    try:
+        chunks = build_index(content, embedder, index_dir)
+    except RETRYABLE_ERRORS as e:
+        if embedder_name != "auto":
+            raise
+        print(f"Embeddings API unavailable ({type(e).__name__}), falling back to local hashing embeddings")
+        chunks = build_index(content, HashingEmbedder(), index_dir)
+    print(f"Indexed {chunks} chunks from {len(content)} paragraphs into {index_dir}/")
 
 
 def main():
-    generate_summary("material.md")
+    parser = argparse.ArgumentParser(description="Distill material.md into a podcast outline (summary.md)")
+    parser.add_argument("--material", default="material.md")
+    parser.add_argument("--out", default="summary.md")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight completions")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--serial", action="store_true", help="use the old serial loop (for benchmarking)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_BYTES / (1024 * 1024))
+    parser.add_argument("--no-cache", action="store_true", help="regenerate every section")
+    parser.add_argument("--index-dir", default=None, help="retrieval index location (default: index/ next to --out)")
+    parser.add_argument("--embedder", choices=["auto", "openai", "hashing"], default="auto",
+                        help="auto uses OpenAI embeddings when a key is set and reachable, local hashing otherwise")
+    parser.add_argument("--no-index", action="store_true", help="skip building the retrieval index")
+    parser.add_argument("--index-only", action="store_true", help="only (re)build the retrieval index")
+    parser.add_argument("--section-budget", type=int, default=0,
+                        help="compress sections longer than this many tokens (0 keeps them as distilled)")
+    parser.add_argument("--no-outline", action="store_true", help="skip writing the section outline (outline.json)")
+    parser.add_argument("--outline-only", action="store_true", help="only (re)build the outline of the existing summary, compressing it if --section-budget is set")
+    args = parser.parse_args()
+    index_dir = args.index_dir or os.path.join(os.path.dirname(args.out), INDEX_DIR)
+
+    start = time.perf_counter()
+    cache = None if args.no_cache or args.index_only or args.serial else SummaryCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+    if args.index_only:
+        generate_index(args.material, index_dir, args.embedder)
+    elif args.outline_only:
+        generate_outline(args.out, args.section_budget, concurrency=args.concurrency, retries=args.retries, cache=cache)
+    elif args.serial:
+        generate_summary_serial(args.material, args.out)
+        if not args.no_outline:
+            write_outline(args.out)
+    else:
+        generate_summary(args.material, args.out, concurrency=args.concurrency, retries=args.retries, checkpoint_path=args.checkpoint, cache=cache,
+                         section_budget=args.section_budget, outline=not args.no_outline)
+    if not args.index_only and not args.outline_only and not args.no_index:
+        generate_index(args.material, index_dir, args.embedder)
+    print(f"Done in {time.perf_counter() - start:.2f}s")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
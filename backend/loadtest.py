@@ -0,0 +1,833 @@
+"""
+Offline load harness for the tutor worker. Runs the real entrypoint (PhilosophyTutor,
+_teaching_enrichment, progress_check, strawberry_notice, the speaking callbacks, ...)
+for N simulated rooms in one process, with the room, the VoicePipelineAgent and the
+STT/LLM/TTS plugins swapped for local fakes with configurable latency. A scripted
+student answers questions, raises its hand over the data channel and interrupts, and
+with --disconnect-rate drops out halfway and rejoins, which has to resume from the
+session snapshot. The fake LLM sits behind a simulated provider prompt cache, so the
+report shows how much of each prompt would be a prefix hit.
+
+    python loadtest.py --rooms 20
+    python loadtest.py --rooms 50 --llm-ttft 0.8 --json metrics/loadtest.json
+
+Needs no network and no API keys. Everything the sessions write (transcripts, metrics,
+tts cache) goes to a temporary directory.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+os.environ.setdefault("OPENAI_API_KEY", "loadtest") # the pool builds a real (never used) OpenAI client
+
+from livekit.agents import APIConnectOptions, DEFAULT_API_CONNECT_OPTIONS, llm, metrics, tts, utils
+from livekit.agents.job import _JobContextVar
+
+import main
+import protocol
+from prompts import report_usage
+from resources import ResourcePool
+from outline import OUTLINE_FILE, build_outline
+from retrieval import HashingEmbedder, build_index
+from telemetry import HistogramSet
+from tokens import estimate_tokens, message_text, message_tokens
+from tts_cache import split_sentences
+from understanding import is_confirmation
+
+logger = logging.getLogger("philosophy-tutor")
+
+QUESTION = "What is the most important thing you've learned so far?"
+CONFIRMATION = "You seem to understand this section, shall we continue?"
+MODES = {"user_led": "SQUARE", "agent_led": "CIRCLE", "hand_raise": "TRIANGLE"}
+
+SAMPLE_RATE = 24000
+WORDS_PER_SECOND = 2.5 # 150 wpm
+
+
+class LoadConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.rooms = args.rooms
+        self.modes = args.modes.split(",")
+        self.sections = args.sections
+        self.stt_latency = args.stt_latency
+        self.llm_ttft = args.llm_ttft
+        self.llm_tokens_per_second = args.llm_tps
+        self.llm_prefill = args.llm_prefill
+        self.tts_ttfb = args.tts_ttfb
+        self.playback_speed = args.playback_speed
+        self.think_time = args.think_time
+        self.interrupt_rate = args.interrupt_rate
+        self.hand_raise_rate = args.hand_raise_rate
+        self.disconnect_rate = args.disconnect_rate
+        self.jitter = args.jitter
+
+    def latency(self, base: float) -> float:
+        return max(0.0, random.gauss(base, base * self.jitter))
+
+
+class Stats:
+    """ Everything the harness measures, shared by all simulated rooms """
+
+    def __init__(self):
+        self.histograms = HistogramSet() # milliseconds
+        self.replies = 0
+        self.user_turns = 0
+        self.sections = 0
+        self.packets_in = 0
+        self.packets_out = 0
+        self.lossy_packets_out = 0
+
+    def time_callbacks(self, event: str, callbacks: List[Callable], *args):
+        for callback in callbacks:
+            started = time.perf_counter()
+            callback(*args)
+            self.histograms.add(f"callback.{event}", (time.perf_counter() - started) * 1000)
+
+
+# --- plugins -------------------------------------------------------------------------
+
+class FakeSTT:
+    """ Transcription happens in FakeAgent, this only carries the latency """
+
+    def __init__(self, config: LoadConfig):
+        self.config = config
+
+
+class SimulatedPromptCache:
+    """
+    Provider-side prefix cache, roughly as OpenAI documents it: a prefix seen before (by
+    any session) is cached if it's at least 1024 tokens, rounded down to 128 token steps.
+    Prefixes are compared at message boundaries, so this undercounts a little.
+    """
+
+    MIN_TOKENS = 1024
+    STEP = 128
+
+    def __init__(self):
+        self._prefixes = set()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def lookup(self, chat_ctx: llm.ChatContext):
+        """ (prompt_tokens, cached_tokens) for a request with this context """
+        digest = hashlib.blake2b(digest_size=16)
+        prompt_tokens = 0
+        cached = 0
+        keys = []
+        for msg in chat_ctx.messages:
+            digest.update(f"{msg.role}\0{message_text(msg)}\x1e".encode("utf-8"))
+            prompt_tokens += message_tokens(msg)
+            key = digest.copy().digest()
+            if key in self._prefixes:
+                cached = prompt_tokens
+            keys.append(key)
+        self._prefixes.update(keys)
+        cached = cached // self.STEP * self.STEP if cached >= self.MIN_TOKENS else 0
+
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached
+        return prompt_tokens, cached
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_fraction": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+        }
+
+
+class FakeLLMStream(llm.LLMStream):
+    def __init__(self, llm_: "FakeLLM", *, chat_ctx: llm.ChatContext, conn_options: APIConnectOptions):
+        super().__init__(llm_, chat_ctx=chat_ctx, fnc_ctx=None, conn_options=conn_options)
+        self._config = llm_.config
+        self._prompt_cache = llm_.prompt_cache
+
+    async def _run(self) -> None:
+        text = scripted_reply(self._chat_ctx)
+        words = text.split(" ")
+        request_id = utils.shortuuid("fake_")
+        prompt_tokens, cached_tokens = self._prompt_cache.lookup(self._chat_ctx)
+        # only the uncached part of the prompt has to be prefilled
+        await asyncio.sleep(self._config.latency(self._config.llm_ttft) + (prompt_tokens - cached_tokens) / 1000 * self._config.llm_prefill)
+        for i in range(0, len(words), 8):
+            chunk = " ".join(words[i:i + 8]) + (" " if i + 8 < len(words) else "")
+            self._event_ch.send_nowait(llm.ChatChunk(request_id=request_id, choices=[llm.Choice(delta=llm.ChoiceDelta(role="assistant", content=chunk))]))
+            await asyncio.sleep(8 / self._config.llm_tokens_per_second)
+        completion_tokens = estimate_tokens(text)
+        report_usage(prompt_tokens, cached_tokens) # what the instrumented OpenAI client does with the usage chunk
+        self._event_ch.send_nowait(llm.ChatChunk(request_id=request_id, usage=llm.CompletionUsage(
+            completion_tokens=completion_tokens, prompt_tokens=prompt_tokens, total_tokens=prompt_tokens + completion_tokens)))
+
+
+class FakeLLM(llm.LLM):
+    def __init__(self, config: LoadConfig, prompt_cache: SimulatedPromptCache, model: str = "fake"):
+        super().__init__()
+        self.config = config
+        self.prompt_cache = prompt_cache
+        self.model = model
+
+    def chat(self, *, chat_ctx: llm.ChatContext, conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS, **kwargs) -> FakeLLMStream:
+        return FakeLLMStream(self, chat_ctx=chat_ctx, conn_options=conn_options)
+
+
+class FakeChunkedStream(tts.ChunkedStream):
+    async def _run(self):
+        config = self._tts.config
+        await asyncio.sleep(config.latency(config.tts_ttfb))
+        seconds = max(0.2, len(self._input_text.split()) / WORDS_PER_SECOND)
+        bstream = utils.audio.AudioByteStream(sample_rate=SAMPLE_RATE, num_channels=1, samples_per_channel=SAMPLE_RATE // 10)
+        request_id = utils.shortuuid("fake_")
+        for frame in bstream.write(bytes(int(seconds * SAMPLE_RATE) * 2)) + bstream.flush():
+            self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+
+
+class FakeTTS(tts.TTS):
+    def __init__(self, config: LoadConfig):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=SAMPLE_RATE, num_channels=1)
+        self.config = config
+        self._opts = SimpleNamespace(model="fake", voice="fake", speed=1.0)
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> FakeChunkedStream:
+        return FakeChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class FakeResourcePool(ResourcePool):
+    """ The real pool (refcounts, per-loop connection pools, shared audio cache) handing out fakes """
+
+    def __init__(self, config: LoadConfig, **kwargs):
+        super().__init__(**kwargs)
+        self.config = config
+        self.prompt_cache = SimulatedPromptCache() # the provider's, shared by every session
+
+    def _load_vad(self):
+        return object()
+
+    def _session_vad(self, shared):
+        return object()
+
+    def _make_turn_detector(self, inference_executor):
+        # the real factory, so a plugin upgrade that breaks it fails the run; only the model
+        # files may be missing here (livekit-agents download-files was never run)
+        try:
+            return super()._make_turn_detector(inference_executor)
+        except OSError as e:
+            logger.warning(f"turn detector model files not downloaded, running without it: {e}")
+            return object()
+
+    def _make_stt(self, clients):
+        return FakeSTT(self.config)
+
+    def _make_llm(self, clients):
+        return FakeLLM(self.config, self.prompt_cache, self.llm_model)
+
+    def _make_tts(self, clients):
+        return FakeTTS(self.config)
+
+
+def scripted_reply(chat_ctx: llm.ChatContext) -> str:
+    """ What a well-behaved tutor model would say next, following the prompts main.py sends """
+    msgs = chat_ctx.messages
+    system = [message_text(msg) for msg in msgs if msg.role == "system"]
+    checking = any(QUESTION in text for text in system)
+    user_text = message_text(msgs[-1]) if msgs and msgs[-1].role == "user" else ""
+    last_agent = next((message_text(msg) for msg in reversed(msgs) if msg.role == "assistant"), "")
+
+    if any("Your code is strawberry" in text for text in system[-2:]):
+        return main.COMPLETION_MSG
+    if checking and QUESTION in last_agent and user_text not in ("", "<continue>") and not user_text.endswith("?"):
+        return CONFIRMATION
+
+    context = next((text for text in reversed(system) if text.startswith("Teaching Context:")), "")
+    outline = context.split(":", 2)[-1].split()[:60]
+    reply = "Good question, uh, so basically " if user_text.endswith("?") else "Uh, so, "
+    reply += " ".join(outline) + "."
+    if checking:
+        reply += f" {QUESTION}"
+    return reply
+
+
+# --- room and agent ------------------------------------------------------------------
+
+class FakeLocalParticipant:
+    def __init__(self, room: "FakeRoom"):
+        self._room = room
+        self.published: List[bytes] = []
+
+    async def publish_data(self, payload, *, reliable: bool = True, topic: str = "", destination_identities=None):
+        data = payload.encode("utf-8") if isinstance(payload, str) else bytes(payload)
+        self.published.append(data)
+        self._room.stats.packets_out += 1
+        if not reliable:
+            self._room.stats.lossy_packets_out += 1
+        if topic == protocol.TOPIC and any(kind == "completed" for kind, _ in protocol.decode(data)):
+            self._room.completed.set()
+
+
+class FakeRoom:
+    def __init__(self, name: str, mode: str, config: LoadConfig, stats: Stats):
+        self.name = name
+        self.mode = mode
+        self.config = config
+        self.stats = stats
+        self.agent: Optional["FakeAgent"] = None
+        self.local_participant = FakeLocalParticipant(self)
+        self.completed = asyncio.Event()
+        self._handlers: Dict[str, List[Callable]] = {}
+
+    def on(self, event: str, callback: Optional[Callable] = None):
+        self._handlers.setdefault(event, []).append(callback)
+        return callback
+
+    def emit(self, event: str, *args):
+        self.stats.time_callbacks(event, self._handlers.get(event, []), *args)
+
+    def receive_command(self, command: str):
+        self.stats.packets_in += 1
+        self.emit("data_received", SimpleNamespace(data=command.encode("utf-8"), topic=protocol.LEGACY_TOPIC, participant=None, kind=None))
+
+    def receive_message(self, kind: str, **data):
+        self.stats.packets_in += 1
+        self.emit("data_received", SimpleNamespace(data=protocol.encode([(kind, data)]), topic=protocol.TOPIC, participant=None, kind=None))
+
+
+class FakeInferenceExecutor:
+    """ Stands in for the worker's inference process, every turn counts as finished """
+
+    async def do_inference(self, method: str, data: bytes) -> Optional[bytes]:
+        return json.dumps({"eou_probability": 1.0}).encode()
+
+
+class FakeJobContext:
+    def __init__(self, room: FakeRoom, userdata: dict):
+        self.room = room
+        self.proc = SimpleNamespace(userdata=userdata, pid=os.getpid())
+        self.inference_executor = FakeInferenceExecutor()
+        self._shutdown_callbacks: List[Callable] = []
+
+    async def connect(self, **kwargs):
+        pass
+
+    async def wait_for_participant(self, identity: Optional[str] = None):
+        return SimpleNamespace(identity=identity or "student")
+
+    def add_shutdown_callback(self, callback: Callable):
+        self._shutdown_callbacks.append(callback)
+
+    async def shutdown(self, reason: str = ""):
+        # same calling convention as JobContext: no arguments
+        for callback in self._shutdown_callbacks:
+            try:
+                await callback()
+            except Exception:
+                logger.exception("Shutdown callback failed")
+
+
+class _Speech:
+    def __init__(self, text: Optional[str] = None, reply: Optional[asyncio.Task] = None, add_to_chat_ctx: bool = True):
+        self.text = text
+        self.reply = reply
+        self.add_to_chat_ctx = add_to_chat_ctx
+        self.user_text = ""
+
+    @property
+    def is_reply(self) -> bool:
+        return self.reply is not None
+
+
+class FakeAgent:
+    """
+    Stands in for VoicePipelineAgent with the parts main.py touches: the events, say(),
+    _validate_reply_if_possible() with before_llm_cb, chat_ctx and a serial speech queue.
+    Replies commit the user message when they start playing, like the real pipeline.
+    """
+
+    def __init__(self, *, chat_ctx: llm.ChatContext, vad, stt: FakeSTT, llm: FakeLLM, tts: tts.TTS, before_llm_cb,
+                 turn_detector=None, allow_interruptions: bool = True, fnc_ctx=None, **kwargs):
+        self.chat_ctx = chat_ctx
+        self.llm = llm
+        self.tts = tts
+        self.config = stt.config
+        self._before_llm_cb = before_llm_cb
+        self._human_input = SimpleNamespace(speaking=False)
+        self._opts = SimpleNamespace(min_endpointing_delay=0.5)
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._queue: "asyncio.Queue[_Speech]" = asyncio.Queue()
+        self._pending_user_text = ""
+        self._pending_reply: Optional[_Speech] = None
+        self._playing_speech: Optional[_Speech] = None
+        self._interrupted = False
+        self.playing = False
+        self._closed = False
+        self.stats: Optional[Stats] = None
+        self._playout_task: Optional[asyncio.Task] = None
+
+    def on(self, event: str, callback: Optional[Callable] = None):
+        self._handlers.setdefault(event, []).append(callback)
+        return callback
+
+    def emit(self, event: str, *args):
+        self.stats.time_callbacks(event, self._handlers.get(event, []), *args)
+
+    def start(self, room: FakeRoom, participant=None):
+        self.stats = room.stats
+        room.agent = self
+        Student(room.mode, self, room, self.config)
+        self._playout_task = asyncio.create_task(self._playout(), name=f"playout-{room.name}")
+
+    async def say(self, text: str, *, allow_interruptions: bool = True, add_to_chat_ctx: bool = True):
+        self._queue.put_nowait(_Speech(text=text, add_to_chat_ctx=add_to_chat_ctx))
+
+    def _validate_reply_if_possible(self):
+        if self._pending_reply is not None and not self._pending_reply.reply.done():
+            self._pending_reply.reply.cancel()
+        user_text, self._pending_user_text = self._pending_user_text, ""
+        speech = _Speech()
+        speech.user_text = user_text
+        speech.reply = asyncio.create_task(self._generate_reply(user_text))
+        self._pending_reply = speech
+        self._queue.put_nowait(speech)
+
+    def interrupt(self):
+        if self.playing:
+            self._interrupted = True
+
+    def user_said(self, text: str):
+        self._pending_user_text = f"{self._pending_user_text} {text}".strip()
+
+    async def idle(self):
+        while self.playing or not self._queue.empty():
+            await asyncio.sleep(0.05)
+
+    async def aclose(self):
+        self._closed = True
+        if self._pending_reply is not None:
+            self._pending_reply.reply.cancel()
+        if self._playout_task is not None:
+            self._playout_task.cancel()
+            await asyncio.gather(self._playout_task, return_exceptions=True)
+
+    async def _generate_reply(self, user_text: str) -> str:
+        chat_ctx = self.chat_ctx.copy()
+        chat_ctx.messages.append(llm.ChatMessage.create(text=user_text or "<continue>", role="user"))
+
+        started = time.perf_counter()
+        stream = await self._before_llm_cb(self, chat_ctx)
+        self.stats.histograms.add("before_llm_cb", (time.perf_counter() - started) * 1000)
+        if stream is False:
+            return ""
+        if not isinstance(stream, llm.LLMStream):
+            stream = self.llm.chat(chat_ctx=chat_ctx)
+
+        started = time.perf_counter()
+        ttft = -1.0
+        parts = []
+        try:
+            async for chunk in stream:
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        if ttft < 0:
+                            ttft = time.perf_counter() - started
+                        parts.append(choice.delta.content)
+        finally:
+            await stream.aclose()
+        self.emit("metrics_collected", metrics.PipelineLLMMetrics(
+            request_id="", timestamp=time.time(), ttft=ttft, duration=time.perf_counter() - started, label="fake",
+            cancelled=False, completion_tokens=0, prompt_tokens=0, total_tokens=0, tokens_per_second=0.0,
+            error=None, sequence_id=""))
+        self.stats.replies += 1
+        return "".join(parts)
+
+    async def _playout(self):
+        while True:
+            speech = await self._queue.get()
+            try:
+                text = speech.text if speech.reply is None else await speech.reply
+            except asyncio.CancelledError:
+                if speech.reply is not None and speech.reply.cancelled() and not self._closed:
+                    continue # superseded by a newer reply
+                raise
+            except Exception:
+                logger.exception("Reply failed")
+                continue
+            if not text:
+                continue
+            if speech.reply is not None and speech.user_text:
+                self.chat_ctx.messages.append(llm.ChatMessage.create(text=speech.user_text, role="user"))
+                self.emit("user_speech_committed", self.chat_ctx.messages[-1])
+            self._playing_speech = speech
+            try:
+                await self._play(text, speech.add_to_chat_ctx)
+            finally:
+                self._playing_speech = None
+
+    async def _play(self, text: str, add_to_chat_ctx: bool):
+        self.playing = True
+        self._interrupted = False
+        spoken = []
+        started = time.perf_counter()
+        # the same split the pipeline's StreamAdapter does
+        for i, sentence in enumerate(split_sentences(text) or [text]):
+            stream = self.tts.synthesize(sentence)
+            seconds = 0.0
+            try:
+                async for audio in stream:
+                    if i == 0 and seconds == 0.0:
+                        self.emit("metrics_collected", metrics.PipelineTTSMetrics(
+                            request_id="", timestamp=time.time(), ttfb=time.perf_counter() - started, duration=0.0,
+                            audio_duration=0.0, cancelled=False, characters_count=len(text), label="fake",
+                            streamed=False, error=None, sequence_id=""))
+                        self.emit("agent_started_speaking")
+                    seconds += audio.frame.duration
+            finally:
+                await stream.aclose()
+            await asyncio.sleep(seconds * self.config.playback_speed)
+            spoken.append(sentence)
+            if self._interrupted:
+                break
+
+        msg = llm.ChatMessage.create(text=" ".join(spoken), role="assistant")
+        if add_to_chat_ctx:
+            self.chat_ctx.messages.append(msg)
+        self.playing = False
+        self.emit("agent_speech_interrupted" if self._interrupted else "agent_speech_committed", msg)
+        self.emit("agent_stopped_speaking")
+
+
+# --- student ---------------------------------------------------------------------------
+
+class Student:
+    """ Scripted participant: answers checks, confirms, raises its hand and interrupts """
+
+    def __init__(self, mode: str, agent: FakeAgent, room: FakeRoom, config: LoadConfig):
+        self.mode = mode
+        self.agent = agent
+        self.room = room
+        self.config = config
+        self._task: Optional[asyncio.Task] = None
+        self._asked = False
+        agent.on("agent_started_speaking", self._on_agent_started_speaking)
+        agent.on("agent_stopped_speaking", self._on_agent_stopped_speaking)
+
+    def _on_agent_started_speaking(self):
+        if self.mode == "hand_raise" and random.random() < self.config.hand_raise_rate:
+            self._act(self._raise_hand())
+        elif random.random() < self.config.interrupt_rate:
+            self._act(self._interrupt())
+
+    def _on_agent_stopped_speaking(self):
+        last = next((message_text(msg) for msg in reversed(self.agent.chat_ctx.messages) if msg.role == "assistant"), "")
+        if self.mode == "user_led":
+            return # the lecture carries on by itself
+        if QUESTION in last:
+            self._reply(self._speak("I learned that the sage's virtue comes from practice and ritual, not from birth."))
+        elif is_confirmation(last) or last.endswith("Shall we begin?"):
+            self._reply(self._speak("Yes, let's continue."))
+        elif last == main.HAND_RAISED_MSG:
+            self._reply(self._ask_question())
+
+    def _act(self, coro):
+        """ Something the student does unprompted, only if it isn't busy already """
+        if self._task is not None and not self._task.done():
+            coro.close()
+            return
+        self._task = asyncio.create_task(coro)
+
+    def _reply(self, coro):
+        """ Answering the tutor takes priority over a pending unprompted action """
+        if self._task is not None and not self._task.done():
+            if self.agent._human_input.speaking:
+                coro.close() # already talking, that turn gets its own reply
+                return
+            self._task.cancel()
+        self._task = asyncio.create_task(coro)
+
+    async def _raise_hand(self):
+        await asyncio.sleep(self.config.latency(self.config.think_time))
+        # half the students run the first frontend, which only knows the bare command
+        if random.random() < 0.5:
+            self.room.receive_command("HAND_RAISED")
+        else:
+            self.room.receive_message("hand", raised=True)
+
+    async def _ask_question(self):
+        await self._speak("Why does that matter for how we act today?")
+        self.room.receive_message("hand", raised=False)
+
+    async def _interrupt(self):
+        await asyncio.sleep(self.config.latency(self.config.think_time))
+        if self.agent.playing:
+            await self._speak("Sorry, can you explain that again?", interrupting=True)
+
+    async def _speak(self, text: str, interrupting: bool = False):
+        if not interrupting:
+            await asyncio.sleep(self.config.latency(self.config.think_time))
+        self.agent._human_input.speaking = True
+        self.agent.emit("user_started_speaking")
+        if interrupting:
+            self.agent.interrupt()
+        await asyncio.sleep(len(text.split()) / WORDS_PER_SECOND * self.config.playback_speed)
+        self.agent._human_input.speaking = False
+        self.agent.emit("user_stopped_speaking")
+
+        eou_delay = self.config.latency(self.config.stt_latency)
+        await asyncio.sleep(eou_delay)
+        self.agent.emit("metrics_collected", metrics.PipelineEOUMetrics(
+            sequence_id="", timestamp=time.time(), end_of_utterance_delay=eou_delay, transcription_delay=eou_delay))
+        self.agent.stats.user_turns += 1
+        self.agent.user_said(text)
+        self.agent._validate_reply_if_possible()
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+# --- harness ---------------------------------------------------------------------------
+
+def write_material(path: str, sections: int):
+    """ A copy of the real summary if there is one, else a synthetic one, cut to `sections`, plus its retrieval index """
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "summary.md")
+    if os.path.exists(source):
+        with open(source, "r", encoding="utf-8") as f:
+            parts = main.split_summary_into_sections(f.read())
+    else:
+        parts = []
+    while len(parts) < sections:
+        i = len(parts) + 1
+        parts.append(
+            f"Section {i}: Confucius and the cultivation of virtue, part {i}. Keywords: ren, li, junzi. "
+            "People: Confucius, Mencius, Xunzi. Virtue is practiced in ritual, family and government, "
+            "and the sage rules by example rather than by punishment."
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# Summary" + "".join(f"\n\n#### Section\n\n{part}" for part in parts[:sections]))
+    # the summary stands in for the raw paragraphs, it's the retrieval work that matters here
+    build_index(parts[:sections], HashingEmbedder(), os.path.join(os.path.dirname(path), "index"))
+    build_outline(parts[:sections]).save(os.path.join(os.path.dirname(path), OUTLINE_FILE))
+
+
+class LoopLagSampler:
+    def __init__(self, histograms: HistogramSet, interval: float = 0.01):
+        self.histograms = histograms
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="loop-lag")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.histograms.add("loop_lag", max(0.0, time.perf_counter() - started - self.interval) * 1000)
+
+
+def patch_main():
+    # the plugins come from the FakeResourcePool, only the agent itself is swapped here
+    main.VoicePipelineAgent = FakeAgent
+
+
+async def _leave(room: FakeRoom, ctx: FakeJobContext, reason: str):
+    if room.agent is not None:
+        await room.agent.aclose()
+    await ctx.shutdown(reason)
+
+
+async def _reached_section(room: FakeRoom, ctx: FakeJobContext, section: int):
+    while not room.completed.is_set() and ctx.proc.userdata["tutor"].current_section < section:
+        await asyncio.sleep(0.05)
+
+
+async def _start_job(ctx: FakeJobContext):
+    # as the worker does, plugins may look the job up through get_current_job_context()
+    _JobContextVar.set(ctx)
+    await main.entrypoint(ctx)
+
+
+async def run_session(index: int, config: LoadConfig, stats: Stats, userdata: dict, timeout: float) -> dict:
+    mode = config.modes[index % len(config.modes)]
+    room = FakeRoom(f"{MODES[mode]}-load-{index}", mode, config, stats)
+    ctx = FakeJobContext(room, dict(userdata)) # one job per process in production, "tutor" must not be shared
+    started = time.perf_counter()
+    result = {"room": room.name, "mode": mode, "completed": False}
+    disconnect = random.random() < config.disconnect_rate
+
+    try:
+        await _start_job(ctx)
+        stats.histograms.add("session_start", (time.perf_counter() - started) * 1000)
+        if disconnect:
+            # halfway through the student drops out, the job ends, and they come back to a new one
+            await asyncio.wait_for(_reached_section(room, ctx, max(1, config.sections // 2)), timeout)
+            await _leave(room, ctx, "participant disconnected")
+            room = FakeRoom(room.name, mode, config, stats)
+            ctx = FakeJobContext(room, dict(userdata))
+            rejoined = time.perf_counter()
+            await _start_job(ctx)
+            stats.histograms.add("session_resume", (time.perf_counter() - rejoined) * 1000)
+            result["resumed_at"] = ctx.proc.userdata["tutor"].current_section
+        await asyncio.wait_for(room.completed.wait(), timeout)
+        await asyncio.wait_for(room.agent.idle(), timeout)
+        result["completed"] = True
+    except asyncio.TimeoutError:
+        logger.warning(f"{room.name} did not finish within {timeout:.0f}s")
+    except Exception as e:
+        result["error"] = repr(e)
+    finally:
+        tutor = ctx.proc.userdata.get("tutor")
+        result["sections"] = getattr(tutor, "current_section", 0)
+        stats.sections += result["sections"]
+        result["seconds"] = round(time.perf_counter() - started, 2)
+        await _leave(room, ctx, "loadtest finished")
+        if getattr(tutor, "prefetcher", None) is not None:
+            result["prefetch"] = tutor.prefetcher.stats()
+    return result
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # peak, in KiB on Linux
+
+
+async def run(config: LoadConfig, ramp: float, timeout: float, trace: bool) -> dict:
+    stats = Stats()
+    patch_main()
+    userdata = {
+        "resources": FakeResourcePool(config),
+        "latency": main.WorkerLatency(main.LATENCY_LOG_PATH),
+        "materials": main.MaterialRegistry(),
+        "snapshots": main.SnapshotStore(),
+        "health": main.WorkerHealth(main.HEALTH_LOG_PATH),
+    }
+    userdata["resources"].prewarm()
+    userdata["materials"].preload()
+    main.load_encoding() # as main.prewarm does, before the loop lag is measured
+
+    sampler = LoopLagSampler(stats.histograms)
+    sampler.start()
+    rss_before = rss_mb()
+    if trace:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(config.rooms):
+        tasks.append(asyncio.create_task(run_session(i, config, stats, userdata, timeout)))
+        await asyncio.sleep(ramp)
+
+    # every room is live here (the first ones aren't done yet unless the run is tiny)
+    rss_peak = rss_mb()
+    traced = tracemalloc.get_traced_memory()[0] if trace else None
+    sessions = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    if trace:
+        tracemalloc.stop()
+    sampler.stop()
+
+    completed = [s for s in sessions if s["completed"]]
+    return {
+        "rooms": config.rooms,
+        "completed": len(completed),
+        "elapsed_s": round(elapsed, 2),
+        "throughput": {
+            "replies_per_s": round(stats.replies / elapsed, 2),
+            "user_turns_per_s": round(stats.user_turns / elapsed, 2),
+            "sections_per_s": round(stats.sections / elapsed, 2),
+            "sessions_per_min": round(len(completed) / elapsed * 60, 2),
+        },
+        "memory": {
+            "rss_before_mb": round(rss_before, 1),
+            "rss_peak_mb": round(rss_peak, 1),
+            "rss_per_session_mb": round((rss_peak - rss_before) / config.rooms, 3),
+            "traced_per_session_kb": round(traced / 1024 / config.rooms, 1) if traced is not None else None,
+        },
+        "packets": {"in": stats.packets_in, "out": stats.packets_out, "lossy_out": stats.lossy_packets_out},
+        "resources": userdata["resources"].stats(),
+        "snapshots": userdata["snapshots"].stats(),
+        "prompt_cache": userdata["resources"].prompt_cache.stats(),
+        "prefetch": userdata["latency"].prefetch_summary(),
+        "health": userdata["health"].summary(),
+        "latency_ms": stats.histograms.summary(),
+        "worker_latency_ms": userdata["latency"].histograms.summary(),
+        "sessions": sessions,
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run N simulated tutor sessions against fake STT/LLM/TTS")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--modes", default="user_led,agent_led,hand_raise", help="comma separated, assigned round-robin")
+    parser.add_argument("--sections", type=int, default=6, help="sections per material")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="end of speech to final transcript, seconds")
+    parser.add_argument("--llm-ttft", type=float, default=0.5, help="LLM time to first token, seconds")
+    parser.add_argument("--llm-tps", type=float, default=80.0, help="LLM tokens per second")
+    parser.add_argument("--llm-prefill", type=float, default=0.05, help="extra time to first token per 1000 uncached prompt tokens, seconds")
+    parser.add_argument("--tts-ttfb", type=float, default=0.25, help="TTS time to first byte, seconds")
+    parser.add_argument("--playback-speed", type=float, default=0.02, help="fraction of real time speech takes to play")
+    parser.add_argument("--think-time", type=float, default=0.3, help="student pause before answering, seconds")
+    parser.add_argument("--interrupt-rate", type=float, default=0.1)
+    parser.add_argument("--hand-raise-rate", type=float, default=0.2)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="fraction of students who drop out halfway and rejoin")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative standard deviation of every latency")
+    parser.add_argument("--ramp", type=float, default=0.05, help="seconds between room starts")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-session limit, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="also measure Python heap per session (slower)")
+    parser.add_argument("--json", help="write the full report here")
+    parser.add_argument("--verbose", action="store_true")
+    return parser
+
+
+def main_cli():
+    args = build_parser().parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    logger.setLevel(logging.INFO if args.verbose else logging.WARNING) # main sets INFO on import
+    random.seed(args.seed)
+    config = LoadConfig(args)
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix="tutor-loadtest-")
+    cwd = os.getcwd()
+    os.chdir(workdir) # transcripts, metrics, snapshots and tts_cache land here
+    try:
+        write_material("summary.md", config.sections)
+        report = asyncio.run(run(config, args.ramp, args.timeout, args.tracemalloc))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sessions = report.pop("sessions")
+    print(json.dumps(report, indent=2))
+    if report["completed"] < report["rooms"]:
+        print(f"{report['rooms'] - report['completed']} sessions did not finish: "
+              f"{[s['room'] for s in sessions if not s['completed']]}", file=sys.stderr)
+    if json_path:
+        os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({**report, "sessions": sessions}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,26 +1,38 @@
 import os
 import datetime
 import logging
-import pickle
 import time
 from enum import Enum
-from typing import List, Optional, Tuple, Dict
+from typing import Awaitable, Callable, List, Optional, Tuple, Dict
 import re
 
 
-from livekit.agents import AutoSubscribe, JobContext, JobProcess, WorkerOptions, cli, llm, stt, transcription
+from livekit.agents import AutoSubscribe, JobContext, JobExecutorType, JobProcess, WorkerOptions, cli, llm, metrics, stt, transcription
 from livekit.agents.pipeline import VoicePipelineAgent
-from livekit.plugins import deepgram, openai, rag, silero, turn_detector
-from livekit.rtc.room import DataPacket
-from openai import OpenAI
 
 from typing import Annotated
 
-from livekit.agents import llm
-from livekit.agents.pipeline import VoicePipelineAgent
 import asyncio
 
-from openai import OpenAI
+# the plugins (and the openai SDK behind them) are imported in prewarm / resources.py, so a
+# spawned job process doesn't pay for them before it's even asked to prewarm
+
+from materials import MaterialRegistry, get_material_from_roomname, material_fingerprint, split_summary_into_sections
+from transcripts import TranscriptWriter
+from compaction import ContextCompactor, build_rolling_summary
+from understanding import UnderstandingTracker, PhraseEvaluator, LLMEvaluator
+from prefetch import CONTINUE_MARKER, SectionPrefetcher, PrefetchedLLMStream
+from scheduler import ContinuationScheduler
+from tts_cache import tts_cache_key
+from resources import SessionResources, get_resource_pool
+from telemetry import LatencyRecorder, WorkerLatency, LATENCY_LOG
+from retrieval import retrieve
+from tokens import load_encoding, message_text
+from prompts import PromptUsage, chat_template
+from supervisor import LoopLagMonitor, TaskSupervisor, WorkerHealth, HEALTH_LOG
+from outline import MentionTracker
+from protocol import DataChannel
+from snapshots import SessionSnapshot, SessionSnapshotter, SnapshotStore, SNAPSHOT_DIR, recent_messages
 
 CHECK_UNDERSTANDING_MSG = """Then, after explaining this section, ask verbatim: 'What is the most important thing you've learned so far?' It is CRITICAL you ask this verbatim.
 
@@ -37,12 +49,37 @@ AGAIN, IF THE USER UNDERSTOOD THE SECTION SAY TO THEM VERBATIM** "You seem to un
 
 If the user does not understand, answer any questions they might have or elaborate on parts of what you said and then ask the question 'What is the most important thing you've learned so far?' again until they do— telling them their previous response wasn't detailed enough."""
 
-
-# oops lol
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OPENAI_API_KEY environment variable not set")
-client = OpenAI(api_key=api_key)
+WELCOME_CASES = {
+    "user_led": "I'll be teaching you philosophy in a continuous lecture format without pauses. So, it's incumbent on you to interrupt me to ask questions or for clarification. Let's begin.",
+    "agent_led": "I'll be teaching you philosophy concepts assuming no prior knowledge. You can interrupt me with questions anytime. I will also give you reflection questions, and you need to provide a thoughtful response before we continue. Shall we begin?",
+    "hand_raise": "I'll be teaching you philosophy. Feel free to raise your hand when you have a question so that I may call on you. Shall we begin?"
+}
+ONE_THIRD_MSG = "You're a third of the way through the material! Keep up the great work."
+TWO_THIRDS_MSG = "You're two-thirds of the way through the material! Keep up the great work."
+HAND_RAISED_MSG = "I see you've raised your hand. What's your question?"
+COMPLETION_MSG = "Congratulations on completing all the material! Your code is strawberry."
+WELCOME_BACK_MSG = "Welcome back! Let's pick up where we left off."
+
+# lines said word for word, their audio is cached (see tts_cache.py)
+FIXED_UTTERANCES = [f"Welcome! I'm your philosophy tutor. {case}" for case in WELCOME_CASES.values()] + [
+    ONE_THIRD_MSG,
+    TWO_THIRDS_MSG,
+    HAND_RAISED_MSG,
+    COMPLETION_MSG,
+    WELCOME_BACK_MSG,
+]
+
+
+TRANSCRIPT_FORMAT = os.environ.get("TRANSCRIPT_FORMAT", "text") # text, jsonl or both
+TRANSCRIPT_FSYNC = os.environ.get("TRANSCRIPT_FSYNC", "close") # never, batch or close
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "4000"))
+UNDERSTANDING_EVALUATOR = os.environ.get("UNDERSTANDING_EVALUATOR", "phrase") # phrase or llm
+LATENCY_LOG_PATH = os.environ.get("LATENCY_LOG", LATENCY_LOG)
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_DIR", SNAPSHOT_DIR)
+HEALTH_LOG_PATH = os.environ.get("HEALTH_LOG", HEALTH_LOG)
+SLOW_CALLBACK_MS = float(os.environ.get("SLOW_CALLBACK_MS", "100")) # callbacks holding the loop longer than this are logged
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "3")) # 0 turns retrieval off
+JOB_EXECUTOR = os.environ.get("JOB_EXECUTOR", "process") # thread runs several jobs per process, sharing the resource pool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -55,61 +92,83 @@ async def entrypoint(ctx: JobContext):
 
         room_name = ctx.room.name
 
+        materials = ctx.proc.userdata.get("materials") or MaterialRegistry()
+        material_id = materials.resolve(get_material_from_roomname(room_name))
+
         #if "tutor" not in ctx.proc.userdata: # to avoid cacheing?
-        ctx.proc.userdata["tutor"] = PhilosophyTutor(get_mode_from_roomname(room_name), ctx)
+        ctx.proc.userdata["tutor"] = PhilosophyTutor(get_mode_from_roomname(room_name), ctx, materials.get(material_id), material_id, materials.outline(material_id))
         tutor = ctx.proc.userdata["tutor"]
         logger.info(f"Using mode from room name: {tutor.mode.value}")
+        logger.info(f"Using material from room name: {material_id}")
+        material_index = materials.index(material_id) if RETRIEVAL_TOP_K > 0 else None
+
+        # owns the session's background tasks and times its callbacks (see supervisor.py)
+        health = ctx.proc.userdata.get("health") or WorkerHealth(HEALTH_LOG_PATH)
+        tasks = TaskSupervisor(room_name, health)
+        monitor = LoopLagMonitor(room_name, health, threshold=SLOW_CALLBACK_MS / 1000)
+        monitor.start()
+        tutor.tasks = tasks
+        # progress, speaking state and hand raises to and from the frontend (see protocol.py)
+        channel = DataChannel(ctx.room, room_name, health, spawn=tasks.spawn)
+        tutor.channel = channel
+        ctx.add_shutdown_callback(lambda: channel.aclose())
+
+        # shutdown callbacks run concurrently, what has to happen in order is awaited in turn here:
+        # transcript and telemetry flushed, the last snapshot written, the session's tasks cancelled,
+        # and only then the lease's connection pools released
+        closers: List[Callable[[], Awaitable[None]]] = []
+        lease: Optional[SessionResources] = None
+
+        async def close_session():
+            for close in closers:
+                try:
+                    await close()
+                except Exception:
+                    logger.exception("Failed to close session resource")
+            if tutor.snapshots is not None:
+                # a student who left before the lesson started gets the first-time welcome next time
+                resumable = tutor.started and tutor.current_section < len(tutor.sections)
+                await tutor.snapshots.aclose(tutor.snapshot() if resumable else None)
+            await health.close_session(room_name, tasks, monitor)
+            if lease is not None:
+                await lease.release()
+        ctx.add_shutdown_callback(close_session)
 
         transcript_file = get_transcript_path(room_name)
-        initialize_transcript(transcript_file, room_name, tutor.mode.value)
+        transcript = TranscriptWriter(transcript_file, room_name, tutor.mode.value, fmt=TRANSCRIPT_FORMAT, fsync=TRANSCRIPT_FSYNC)
+        await transcript.start()
+        tutor.transcript = transcript
+        closers.append(transcript.aclose)
         logger.info(f"Transcript will be saved to: {transcript_file}")
 
-
-        mode_specific_default = ""
-        mode_specific_critical = ""
-        if tutor.mode == TeachingMode.USER_LED:
-            mode_specific_default = "- Present information in an engaging and witty way while maintaining a natural flow\n- NEVER ask if the user has questions or wait for user responses\n- Keep talking continuously until interrupted"
-            mode_specific_critical = "- CRITICAL: NEVER ask if the user has questions, is following along, or pause for user input. NEVER end a response with a question. NEVER use phrases like 'Let me know if...' or 'Are you ready to...'. Always continue to the next point automatically."
-        elif tutor.mode == TeachingMode.AGENT_LED:
-            # avoid mention of prior knowledge, [prompting] is a bad way to solve this
-            mode_specific_default = "- Begin teaching immediately with the provided content\n- Assume no prior knowledge from the student"
-
-        initial_ctx = llm.ChatContext().append(
-            role="system",
-            text=(
-                "You are a philosophy podcaster engaging in voice-based teaching. You are given a podcast outline to teach a textbook chapter."
-                f"Teaching in {tutor.mode.value} mode with core principles:\n"
-                "- Focus exclusively on the content provided in the Teaching Context - never introduce external concepts\n"
-                "- Maintain a natural, conversational tone as if discussing with a colleague, try not to sound like a textbook\n"
-                "- Use disfluencies like 'uh' 'uhm' and 'like' to sound more human\n"
-                f"{mode_specific_default}"
-                "- Keep explanations concise and high-level while ensuring understanding. It is important to stay concise.\n\n"
-                "- INJECT HUMOR AND ENTERTAINMENT INTO YOUR PODCAST.\n"
-                "- DO NOT READ OFF THE OUTLINE, BUT USE IT TO GUIDE YOUR PODCAST SCRIPT.\n"
-                "Your teaching approach:\n"
-                "- Use short, relevant examples when clarifying points\n"
-                "- Keep responses short, crisp, and targeted to maintain engagement\n\n"
-                "Interaction guidelines:\n"
-                "- Maintain a brisk but comprehensible pace\n"
-                "- Do not ask the user about their opinion, ever\n"
-                "- For off-topic questions, acknowledge briefly then guide back to the current topic\n"
-                "- Keep the conversation flowing naturally without sounding like you're reading from a text\n"
-                "- If a topic isn't in your teaching materials, acknowledge the user's question but steer them back to related concepts within your content instead of saying you don't know\n"
-                "- When checking understanding, focus on content comprehension not personal opinions\n"
-                "- CRITICAL: Do NOT speak about ethics, AI safety, or make up content before you receive actual teaching material\n"
-                "- CRITICAL: Wait for teaching content to be provided before beginning the lesson\n"
-                "- CRITICAL: Do not introduce any theories or concepts until explicit content is provided\n"
-
-                #"- CRITICAL: When the user reaches a certain percentage of the material covered, let them know for every 33%% of progress they make.\n"
-                #"- CRITICAL: When the user is done with the whole material. Tell them the code is 'strawberry'\n"
-                "- CRITICAL: MENTION EACH EXAMPLE/KEYWORD GIVEN TO YOU THE USER MUST HEAR ALL OF THEM\n"
-                "- CRITICAL: IF IT MENTIONS A PERSON, YOU MUST MENTION THAT PERSON.\n"
-                f"{mode_specific_critical}"
-            ),
-        )
+        # the same student back in the same room resumes where they left off (see snapshots.py)
+        participant = await ctx.wait_for_participant()
+        snapshots = ctx.proc.userdata.get("snapshots") or SnapshotStore(SNAPSHOT_PATH)
+        restore_started = time.perf_counter()
+        snapshot = await snapshots.load(room_name, participant.identity, tutor.fingerprint)
+        if snapshot is not None and snapshot.current_section < len(tutor.sections):
+            tutor.restore(snapshot)
+            transcript.write("System", f"Resumed at section {tutor.current_section + 1}/{len(tutor.sections)}")
+        else:
+            snapshot = None
+        tutor.snapshots = SessionSnapshotter(snapshots, room_name, participant.identity, spawn=tasks.spawn)
+
+
+        # the per-mode template, everything session specific goes after it (see prompts.py)
+        initial_ctx = chat_template(tutor.mode.value)
+        prompt_usage = PromptUsage(room_name)
+        prompt_usage.bind()
         
         # Queue up the first section immediately
-        if tutor.current_section < len(tutor.sections): 
+        if snapshot is not None:
+            # rebuilt rather than replayed: the last few turns, then the section they were on
+            initial_ctx.messages.extend(snapshot.recent_chat_messages())
+            initial_ctx.messages.append(llm.ChatMessage.create(text=f"Teaching Context: The student reconnected. Pick this topic up where you left off, briefly, without starting the lesson over: {tutor.sections[tutor.current_section]}", role="system"))
+            if tutor.mode != TeachingMode.USER_LED:
+                initial_ctx.messages.append(llm.ChatMessage.create(text=CHECK_UNDERSTANDING_MSG, role="system"))
+            snapshots.record_restore(time.perf_counter() - restore_started)
+            logger.info(f"Resumed {room_name}/{participant.identity} at section {tutor.current_section} in {(time.perf_counter() - restore_started) * 1000:.1f}ms")
+        elif tutor.current_section < len(tutor.sections): 
             intro_context_msg = llm.ChatMessage.create(text=f"Teaching Context: Begin discussing this topic now. Follow this podcast outline. Do not read off this, but use it to guide your podcast: {tutor.sections[tutor.current_section]}", role="system")
             initial_ctx.messages.append(intro_context_msg)
 
@@ -117,40 +176,124 @@ async def entrypoint(ctx: JobContext):
                 question_p = llm.ChatMessage.create(text=CHECK_UNDERSTANDING_MSG, role="system")
                 initial_ctx.messages.append(question_p)
 
+        compactor = ContextCompactor(max_tokens=CONTEXT_TOKEN_BUDGET)
+
+        # shared weights and connection pools, per-session plugin objects (see resources.py)
+        resources = ctx.proc.userdata.get("resources") or get_resource_pool()
+        lease = await resources.acquire(room_name, ctx.inference_executor)
+        tutor_llm = lease.llm
+
+        def build_opening_context(section: int) -> llm.ChatContext:
+            # what the reply at a transition to `section` roughly sees, minus the conversation
+            opening_ctx = llm.ChatContext()
+            opening_ctx.messages.append(initial_ctx.messages[0])
+            opening_ctx.messages.append(llm.ChatMessage.create(text=f"Teaching Context: Begin discussing this topic now: {tutor.sections[section]}", role="system"))
+            if tutor.mode != TeachingMode.USER_LED:
+                opening_ctx.messages.append(llm.ChatMessage.create(text=CHECK_UNDERSTANDING_MSG, role="system"))
+            # last, where the compactor puts it
+            summary = build_rolling_summary(tutor.sections, section)
+            if summary:
+                opening_ctx.messages.append(llm.ChatMessage.create(text=summary, role="system"))
+            # only served when the student's turn was no more than this (see prefetch.is_go_ahead)
+            opening_ctx.messages.append(llm.ChatMessage.create(text=CONTINUE_MARKER, role="user"))
+            return opening_ctx
+
+        tutor_tts = lease.tts
+        # read from disk once per process in prewarm, sessions only check what's in memory
+        if tutor_tts.missing_pinned(FIXED_UTTERANCES):
+            # first session on a cold cache, later sessions (and processes) get them from the cache
+            tasks.spawn(tutor_tts.prime(FIXED_UTTERANCES, pinned=True), "prime-fixed-lines")
+
+        prefetcher = SectionPrefetcher(tutor_llm, build_opening_context, presynthesize=lambda text: tutor_tts.prime([text]), spawn=tasks.spawn)
+        tutor.prefetcher = prefetcher
+
+        latency = LatencyRecorder(room_name, ctx.proc.userdata.get("latency") or WorkerLatency(LATENCY_LOG_PATH))
+        prompt_usage.on_reply = latency.record_prompt_usage
+        closers.append(prompt_usage.aclose)
+
+        async def close_latency():
+            # the prefetcher's last discard has to be in the record
+            await prefetcher.aclose()
+            await latency.aclose(prefetcher.stats())
+        closers.append(close_latency)
+
+        teaching_enrichment = monitor.timed("_teaching_enrichment", _teaching_enrichment)
+
+        async def before_llm(agent: VoicePipelineAgent, chat_ctx: llm.ChatContext):
+            latency.on_llm_started()
+            turn_text = message_text(chat_ctx.messages[-1]) # the pipeline's user turn, before enrichment appends to it
+            enrichment_started = time.perf_counter()
+            await teaching_enrichment(agent, chat_ctx, tutor, ctx)
+            latency.record_enrichment(time.perf_counter() - enrichment_started)
+            compactor.compact(chat_ctx, tutor.sections, tutor.current_section)
+
+            prefetched = await prefetcher.take(tutor.current_section, turn_text)
+            if prefetched:
+                return PrefetchedLLMStream(agent.llm, chat_ctx=chat_ctx, text=prefetched)
+
+            # what the section's outline names that the tutor hasn't said yet (see outline.py), this reply only
+            reminder = tutor.mentions.reminder(tutor.current_section)
+            if reminder:
+                chat_ctx.messages.insert(len(chat_ctx.messages) - 1, llm.ChatMessage.create(text=reminder, role="system"))
+
+            user_msg = chat_ctx.messages[-1]
+            if user_msg.role == "user":
+                retrieval_started = time.perf_counter()
+                grounding = await retrieve(material_index, message_text(user_msg), k=RETRIEVAL_TOP_K)
+                latency.record_retrieval(time.perf_counter() - retrieval_started)
+                if grounding:
+                    # only in this reply's copy of the context, it's never committed to agent.chat_ctx
+                    chat_ctx.messages.insert(len(chat_ctx.messages) - 1, llm.ChatMessage.create(text=grounding, role="system"))
+
         agent = VoicePipelineAgent(
             chat_ctx=initial_ctx,
-            vad=ctx.proc.userdata.get("vad") or silero.VAD.load(),
-            stt=deepgram.STT(),
-            llm=openai.LLM(model="gpt-4o-mini"),
-            tts=openai.TTS(),
-            before_llm_cb=lambda a, c: _teaching_enrichment(a, c, tutor, ctx),
-            turn_detector=turn_detector.EOUModel(),
+            vad=lease.vad,
+            stt=lease.stt,
+            llm=tutor_llm,
+            tts=tutor_tts,
+            before_llm_cb=monitor.timed("before_llm", before_llm),
+            turn_detector=lease.turn_detector,
             allow_interruptions=True,
             fnc_ctx=AssistantFnc()
         )
 
         setattr(agent, "transcript_file", transcript_file)
+        tutor.agent = agent
+        scheduler = ContinuationScheduler(min_pause=agent._opts.min_endpointing_delay, spawn=tasks.spawn)
+        ctx.add_shutdown_callback(lambda: scheduler.aclose())
+
+        def on_hand(data: dict):
+            if data.get("raised"):
+                transcript.write("System", "User raised hand")
+                tutor.raise_hand()
+            else:
+                tutor.lower_hand()
+            channel.send("hand", raised=tutor.hand_raised)
 
-        def on_data_received(packet: DataPacket):
-            if packet.topic == "command":
-                command = packet.data.decode('utf-8').strip().upper()
-                if command == "HAND_RAISED":
-                    tutor = ctx.proc.userdata.get("tutor")
-                    save_to_transcript(transcript_file, "System", "User raised hand")
-                    if tutor:
-                        tutor.raise_hand()
+        def send_speaking():
+            channel.send("speaking", agent=tutor.speaking, user=tutor.user_speaking)
 
         def on_transcription_received(msg):
-            save_to_transcript(transcript_file, "Agent", msg.content)
+            transcript.write("Agent", msg.content)
+            tutor.understanding.on_agent_speech(msg)
+            tutor.mentions.on_agent_speech(message_text(msg), tutor.current_section)
 
 
         def on_agent_started_speaking():
             logger.info("Agent started speaking, any user speech is an interruption")
             tutor.is_interruption = True
             tutor.speaking = True
+            send_speaking()
+            speech = agent._playing_speech
+            transition = prefetcher.on_agent_started_speaking(speech is not None and speech.is_reply)
+            if transition is not None:
+                latency.record_section_transition(transition)
+            latency.on_agent_started_speaking()
+            prefetcher.start(tutor.current_section + 1, len(tutor.sections))
 
         def on_agent_stopped_speaking():
             tutor.speaking = False
+            send_speaking()
             # Podcast behaviour
             # like the end of the thing and not a fake end :/
             logger.info("Agent stopped speaking...")
@@ -158,68 +301,72 @@ async def entrypoint(ctx: JobContext):
                 tutor.is_interruption = False
                 async def delayed_action():
                     logger.info("Delayed continue initiated")
-                    try:
-                        await asyncio.sleep(2)
-                        if agent._human_input is not None and not agent._human_input.speaking and not tutor.speaking:
-                            if tutor.mode == TeachingMode.USER_LED:
-                                if agent.chat_ctx.messages[-1].role == "assistant":
-
-                                    # Agent was told "Please Do Continue." in USER_LED mode. Obviously not an interruption.
-                                    logger.info("Moving on to the next section in USER_LED mode..")
-                                    tutor.next_section()
-                                    await progress_check(agent, tutor)
-                                    if tutor.current_section < len(tutor.sections):
-                                        new_context_msg = llm.ChatMessage.create(text=f"Teaching Context: Begin discussing this topic now: {tutor.sections[tutor.current_section]}", role="system")
-                                        agent.chat_ctx.messages.append(new_context_msg)
-                                        #agent.say("Moving on, ")
-                                        agent._validate_reply_if_possible() # ^r->vl
-                                    else:
-                                        strawberry_notice(agent.chat_ctx, ctx)
-
-                                    # logger.info("In user led mode, last msg from agent: Please Continue")
-                                    # agent.chat_ctx.messages.append(llm.ChatMessage.create(text=SPOOF_CONTINUE, role="user"))
-                                    # logger.info("PDC message sent out")
-                                    # agent._validate_reply_if_possible()
-                            #else:
-                                #tutor.is_interruption = False
-
-
-                    except asyncio.CancelledError:
-                        logger.info("Delayed continue task cancelled")
-                
-                asyncio.create_task(delayed_action())
+                    if agent._human_input is not None and not agent._human_input.speaking and not tutor.speaking:
+                        if agent.chat_ctx.messages[-1].role == "assistant":
+
+                            # Agent was told "Please Do Continue." in USER_LED mode. Obviously not an interruption.
+                            logger.info("Moving on to the next section in USER_LED mode..")
+                            tutor.next_section()
+                            await progress_check(agent, tutor)
+                            if tutor.current_section < len(tutor.sections):
+                                new_context_msg = llm.ChatMessage.create(text=f"Teaching Context: Begin discussing this topic now: {tutor.sections[tutor.current_section]}", role="system")
+                                agent.chat_ctx.messages.append(new_context_msg)
+                                #agent.say("Moving on, ")
+                                agent._validate_reply_if_possible() # ^r->vl
+                            else:
+                                strawberry_notice(agent.chat_ctx, ctx)
+
+                            # logger.info("In user led mode, last msg from agent: Please Continue")
+                            # agent.chat_ctx.messages.append(llm.ChatMessage.create(text=SPOOF_CONTINUE, role="user"))
+                            # logger.info("PDC message sent out")
+                            # agent._validate_reply_if_possible()
+
+                # only user led mode continues on its own
+                if tutor.mode == TeachingMode.USER_LED:
+                    scheduler.schedule(monitor.timed("delayed_action", delayed_action))
             
 
         def on_user_started_speaking():
             logger.info("User started speaking...")
             tutor.user_speaking = True
+            send_speaking()
+            scheduler.on_user_started_speaking()
             #tutor.is_interruption = True
         
         def on_user_stopped_speaking():
             tutor.user_speaking = False
+            send_speaking()
+            scheduler.on_user_stopped_speaking()
+            latency.on_user_stopped_speaking()
+
+        def on_metrics_collected(m):
+            latency.on_metrics(m)
+            if isinstance(m, metrics.PipelineEOUMetrics):
+                scheduler.on_eou_delay(m.end_of_utterance_delay)
         
 
-        ctx.room.on("data_received", on_data_received)
-        agent.on("agent_speech_committed", on_transcription_received)
-
-        agent.on("agent_started_speaking", on_agent_started_speaking)
-        agent.on("agent_stopped_speaking", on_agent_stopped_speaking)
-        agent.on("user_started_speaking", on_user_started_speaking)
-
-        agent.on("user_stopped_speaking", on_user_stopped_speaking)
+        channel.on("hand", on_hand)
+        ctx.room.on("data_received", monitor.timed("on_data_received", channel.on_data_received))
+        agent.on("agent_speech_committed", monitor.timed("on_transcription_received", on_transcription_received))
+        agent.on("agent_speech_interrupted", tutor.understanding.on_agent_speech) # the old scan saw these too
+        agent.on("user_speech_committed", tutor.understanding.on_user_speech)
+        agent.on("agent_speech_interrupted", lambda msg: tutor.mentions.on_agent_speech(message_text(msg), tutor.current_section))
+        agent.on("agent_speech_interrupted", lambda msg: prefetcher.discard("user interrupted"))
+        agent.on("agent_speech_interrupted", lambda msg: scheduler.on_interruption())
+        agent.on("metrics_collected", monitor.timed("on_metrics_collected", on_metrics_collected))
+
+        agent.on("agent_started_speaking", monitor.timed("on_agent_started_speaking", on_agent_started_speaking))
+        agent.on("agent_stopped_speaking", monitor.timed("on_agent_stopped_speaking", on_agent_stopped_speaking))
+        agent.on("user_started_speaking", monitor.timed("on_user_started_speaking", on_user_started_speaking))
+
+        agent.on("user_stopped_speaking", monitor.timed("on_user_stopped_speaking", on_user_stopped_speaking))
         #agent.on("", on_user_started_speaking)
 
-        agent.start(ctx.room)
+        agent.start(ctx.room, participant)
+        channel.send("progress", section=tutor.current_section, total=len(tutor.sections))
         logger.info("Agent started successfully")
 
-        cases = {
-            "user_led": "I'll be teaching you philosophy in a continuous lecture format without pauses. So, it's incumbent on you to interrupt me to ask questions or for clarification. Let's begin.",
-            "agent_led": "I'll be teaching you philosophy concepts assuming no prior knowledge. You can interrupt me with questions anytime. I will also give you reflection questions, and you need to provide a thoughtful response before we continue. Shall we begin?",
-            "hand_raise": "I'll be teaching you philosophy. Feel free to raise your hand when you have a question so that I may call on you. Shall we begin?"
-        }
-
-
-        welcome_message = f"Welcome! I'm your philosophy tutor. {cases[tutor.mode.value]}"
+        welcome_message = WELCOME_BACK_MSG if snapshot is not None else f"Welcome! I'm your philosophy tutor. {WELCOME_CASES[tutor.mode.value]}"
         await agent.say(welcome_message, allow_interruptions=True)        
         agent._validate_reply_if_possible()
     
@@ -248,15 +395,25 @@ class AssistantFnc(llm.FunctionContext):
 
 
 class PhilosophyTutor:
-    def __init__(self, mode: TeachingMode, ctx: JobContext):
+    def __init__(self, mode: TeachingMode, ctx: JobContext, sections: Tuple[str, ...], material_id: str = "", outline=None):
         self.ctx = ctx
         self.mode = mode
+        self.material_id = material_id
 
         self.current_section = 0
-        self.sections = split_summary_into_sections(open("summary.md", "r", encoding="utf-8").read()) # holy moly
+        self.sections = sections # shared and immutable, owned by the MaterialRegistry
+        self.fingerprint = material_fingerprint(sections)
         self.hand_raised = False
 
         self.pending_check = True
+        self.understanding = UnderstandingTracker(LLMEvaluator() if UNDERSTANDING_EVALUATOR == "llm" else PhraseEvaluator())
+        self.mentions = MentionTracker(outline)
+        self.prefetcher: Optional[SectionPrefetcher] = None
+        self.agent: Optional[VoicePipelineAgent] = None
+        self.transcript: Optional[TranscriptWriter] = None
+        self.snapshots: Optional[SessionSnapshotter] = None
+        self.tasks: Optional[TaskSupervisor] = None
+        self.channel: Optional[DataChannel] = None
 
         self.is_interruption = False
         self.speaking = False
@@ -266,14 +423,59 @@ class PhilosophyTutor:
     
     def next_section(self):
         logger.info("Phasing to next section.")
+        self.mentions.finish(self.current_section)
         self.current_section += 1
         self.pending_check = True
+        self.understanding.mark_section_boundary()
+        if self.prefetcher is not None and self.current_section < len(self.sections):
+            self.prefetcher.mark_transition(self.current_section)
+        if self.channel is not None:
+            self.channel.send("progress", section=self.current_section, total=len(self.sections))
+        if self.transcript is not None:
+            # analytics.py splits sessions into sections on these lines
+            if self.current_section < len(self.sections):
+                self.transcript.write("System", f"Section {self.current_section + 1}/{len(self.sections)} started")
+            else:
+                self.transcript.write("System", "Material completed")
+        if self.snapshots is not None:
+            if self.current_section < len(self.sections):
+                self.snapshots.save(self.snapshot())
+            else:
+                self.snapshots.discard()
+
+    @property
+    def started(self) -> bool:
+        """ A section finished or the student said something, worth resuming rather than starting over """
+        return self.current_section > 0 or self.understanding.user_turns > 0
+
+    def snapshot(self) -> SessionSnapshot:
+        return SessionSnapshot(
+            room=self.ctx.room.name,
+            participant=self.snapshots.participant if self.snapshots is not None else "",
+            mode=self.mode.value,
+            material_id=self.material_id,
+            fingerprint=self.fingerprint,
+            current_section=self.current_section,
+            pending_check=self.pending_check,
+            hand_raised=self.hand_raised,
+            confirmed=self.understanding.confirmed,
+            recent=recent_messages(self.agent.chat_ctx) if self.agent is not None else [],
+        )
+
+    def restore(self, snapshot: SessionSnapshot):
+        self.current_section = snapshot.current_section
+        self.pending_check = snapshot.pending_check
+        # not the hand: the reply it asked for went with the old connection, and a raised
+        # hand would block raising it again until the frontend sends a "lower"
+        self.hand_raised = False
+        self.understanding.confirmed = snapshot.confirmed
 
     def raise_hand(self):
         if self.mode == TeachingMode.HAND_RAISE and not self.hand_raised:
             self.hand_raised = True
             logger.info("Hand raised initiating...")
-            asyncio.create_task(self.ctx.agent.say("I see you've raised your hand. What's your question?", allow_interruptions = True))
+            # ctx.agent is the local participant, it can't speak
+            self.tasks.spawn(self.agent.say(HAND_RAISED_MSG, allow_interruptions = True), "hand-raised-reply")
 
     def lower_hand(self):
         self.hand_raised = False
@@ -284,29 +486,27 @@ class PhilosophyTutor:
 async def progress_check(agent: VoicePipelineAgent, tutor: PhilosophyTutor):
     logger.info("running progress check...")
     if tutor.current_section == len(tutor.sections) // 3:
-        await agent.say("You're a third of the way through the material! Keep up the great work.")
+        await agent.say(ONE_THIRD_MSG)
         logger.info("(User) is 1/3rd done the material.")
     #if tutor.current_section == len(tutor.sections) // 2:
     #    await agent.say("You're halfway through the material! Keep up the great work.")
     #    logger.info("(User) is halfway done the material.")
     if tutor.current_section == (2 * len(tutor.sections)) // 3: # FIXME: this is broken lol
-        await agent.say("You're two-thirds of the way through the material! Keep up the great work.")
+        await agent.say(TWO_THIRDS_MSG)
         logger.info("(User) is 2/3rd done the material.")
 
 def strawberry_notice(chat_ctx: llm.ChatContext, ctx: JobContext):
     # Ensure strawberry code is explicitly mentioned when content is completed
     completion_msg = llm.ChatMessage.create(
-        text="CRITICAL: The user has completed the material! Make sure to tell them: 'Congratulations on completing all the material! Your code is strawberry.' This is extremely important.",
+        text=f"CRITICAL: The user has completed the material! Make sure to tell them: '{COMPLETION_MSG}' This is extremely important.",
         role="system",
     )
     chat_ctx.messages.append(completion_msg)
     
     # Send data to frontend
-    asyncio.create_task(ctx.room.local_participant.publish_data(
-                payload="strawberry",
-                reliable=True,
-                topic="command"
-    ))
+    channel = ctx.proc.userdata["tutor"].channel
+    channel.send("completed", code="strawberry")
+    channel.send_legacy("strawberry") # frontends from before protocol.py
     logger.info("Added strawberry code message for 100% completion")
 
 async def _teaching_enrichment(agent: VoicePipelineAgent, chat_ctx: llm.ChatContext, tutor: PhilosophyTutor, ctx: JobContext):
@@ -316,7 +516,7 @@ async def _teaching_enrichment(agent: VoicePipelineAgent, chat_ctx: llm.ChatCont
             logger.info("User message detected, running _teaching_enrichment")
             if tutor.mode != TeachingMode.USER_LED and user_msg.content:
                 if tutor.pending_check:
-                    understood = evaluate_understanding_from_response(chat_ctx.messages)
+                    understood = await tutor.understanding.evaluate(chat_ctx, tutor.current_section, tutor.sections)
                     if understood:
                         agent.chat_ctx.messages.append( llm.ChatMessage.create(text=f"Section Completed", role="system"))
                         logger.info("Moving on to the next section in an AGENT* mode")
@@ -365,45 +565,6 @@ async def _teaching_enrichment(agent: VoicePipelineAgent, chat_ctx: llm.ChatCont
         raise
 
 
-def evaluate_understanding_from_response(message_history):
-    """ 'demonstrates awareness of their own knowledge' is the language used in that paepr [sic] """
-
-    # optimization lol
-    for message in reversed(message_history):
-        if message.role != "user" and message.role != "system": # lol the user cant skip just by saing this
-                                                                # oops cant be system either
-            content = message.content.lower()
-            if ("you" in content) and ("seem" in content) and ("understood" in content or "understand" in content or "grasp" in content):
-                logger.info("Moving on to next section!")
-                return True
-        if message.role == "system":
-            if message.content == "Section Completed":
-                return False
-
-#     response = client.chat.completions.create(
-#         messages=[
-#             {"role": "system", "content": """You are an educational evaluation assistant built to evaluate if a user has understood content or have demonstrated awareness of their own knowledge.
-# Sometimes a user's response will be them asking a question. If this is the case then return "Failure". Othertimes the user will be asked to demonstrate their understanding or the most important thing they've learned so far.
-# If this is the case, the key is that the user 'demonstrates awareness of their own knowledge'. That is, if the user is learning about Confucius and all they say is "Confucius", this is not adequate. If they are more detailed and say something like "Confucius' teachings were patriarchal", this is permissible and is a "Success".
-# """},
-#             {"role": "user", "content": f"""Here is the content the user is supposed to have understood:
-# {content}
-
-# Here is the chat history:
-# {"\\n".join(f"{msg.role}: {'' if msg.content is None else ''.join(str(item) for item in msg.content) if isinstance(msg.content, list) else str(msg.content)}" for msg in message_history[-10:])}
-
-# If the user has understood this content, reply verbatim "Success" and nothing else. Otherwise, reply with "Failure".
-# Note: The user may not skip this in ANY WAY except by demonstrating an understandining, not merely  claiming to have no questions.
-# """}
-#         ],
-#         model="gpt-4-turbo",
-#         temperature=0.3,
-#     )
-    
-#     logger.info(response.choices[0].message.content.lower())
-#     return "success" in response.choices[0].message.content.lower()
-
-
 def get_mode_from_roomname(name: str):
     if "SQUARE" in name:
         return TeachingMode.USER_LED
@@ -421,41 +582,42 @@ def get_transcript_path(room_name):
     os.makedirs(transcript_dir, exist_ok=True)
     return f"{transcript_dir}/transcript_{timestamp}.txt"
 
-def initialize_transcript(file_path, room_name, mode):
-    with open(file_path, "w") as f:
-        f.write(f"Transcript for room: {room_name}\n")
-        f.write(f"Mode: {mode}\n")
-        f.write(f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("-" * 50 + "\n\n")
-
-def save_to_transcript(file_path, speaker, text):
-    try:
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        message = f"[{timestamp}] {speaker}: {text}\n"
-        
-        with open(file_path, "a") as f:
-            f.write(message)
-        
-        return True
-    except Exception as e:
-        logger.error(f"Failed to save transcript: {e}")
-        return False
-    
-def split_summary_into_sections(markdown_text: str):
-    return markdown_text.split("\n\n#### Section\n\n")[1:]
-
 def prewarm(proc: JobProcess):
     try:
-        proc.userdata["vad"] = silero.VAD.load()
+        proc.userdata["resources"] = get_resource_pool()
+        proc.userdata["resources"].prewarm()
         logger.info("VAD prewarm completed")
+
+        if load_encoding():
+            logger.info("Tokenizer prewarm completed")
+        else:
+            logger.warning("tiktoken unavailable, token counts are estimated from characters")
+
+        proc.userdata["latency"] = WorkerLatency(LATENCY_LOG_PATH)
+        proc.userdata["snapshots"] = SnapshotStore(SNAPSHOT_PATH)
+        proc.userdata["health"] = WorkerHealth(HEALTH_LOG_PATH)
+
+        from livekit.plugins import openai
+        audio_cache = proc.userdata["resources"].audio_cache
+        missing = audio_cache.load_pinned(tts_cache_key(openai.TTS()), FIXED_UTTERANCES)
+        logger.info(f"TTS cache prewarm completed: {audio_cache.stats()}, {len(missing)} fixed sentences not cached yet")
+
+        proc.userdata["materials"] = MaterialRegistry()
+        proc.userdata["materials"].preload()
+        logger.info(f"Material prewarm completed: {proc.userdata['materials'].stats()}")
     except Exception as e:
         logger.error(f"Failed to prewarm: {e}")
         raise
 
 if __name__ == "__main__":
+    # plugins register themselves on import, which has to happen on the main thread of the
+    # main process for download-files and for the thread executor
+    from livekit.plugins import deepgram, openai, silero, turn_detector # noqa: F401
+
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
             prewarm_fnc=prewarm,
+            job_executor_type=JobExecutorType(JOB_EXECUTOR),
         ),
     )
\ No newline at end of file
@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("philosophy-tutor")
+
+DEFAULT_MATERIAL = "default"
+MATERIALS_DIR = "materials"
+
+# words as retrieval.py and outline.py count them, no livekit imports here: distill.py uses them offline
+# function words swamp short questions ("what did he say about ..."), they carry no topic
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have he her his how i if in into is it its
+me my of on or our she so than that the their them then there these they this those to too us was we were what when
+where which who whom why will with would you your about just also more most some such not no yes let lets tell explain
+""".split())
+
+
+def stem_word(word: str) -> str:
+    for suffix in ("ing", "es", "ed", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def material_fingerprint(sections: Sequence[str]) -> str:
+    """ Snapshots and outlines only apply to the exact sections they were made from """
+    return hashlib.blake2b("\x1e".join(sections).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def split_summary_into_sections(markdown_text: str):
+    return markdown_text.split("\n\n#### Section\n\n")[1:]
+
+
+def get_material_from_roomname(name: str):
+    # e.g. "CIRCLE-MATERIAL-chapter2-1234" teaches materials/chapter2/summary.md
+    match = re.search(r"MATERIAL-([A-Za-z0-9_]+)", name)
+    if match:
+        return match.group(1)
+    return DEFAULT_MATERIAL
+
+
+def get_material_path(material_id: str):
+    if material_id == DEFAULT_MATERIAL:
+        return "summary.md" # the original single-chapter layout
+    return os.path.join(MATERIALS_DIR, material_id, "summary.md")
+
+
+def get_index_path(material_id: str):
+    """ Retrieval index distill.py builds next to the summary (see retrieval.py) """
+    return os.path.join(os.path.dirname(get_material_path(material_id)), "index")
+
+
+def get_outline_path(material_id: str):
+    """ Section outline distill.py writes next to the summary (see outline.py) """
+    return os.path.join(os.path.dirname(get_material_path(material_id)), "outline.json")
+
+
+class _Index:
+    def __init__(self, index, mtime_ns: Optional[int]):
+        self.index = index # None if there's no (readable) index for the material
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.monotonic()
+
+
+class _Material:
+    def __init__(self, sections: Tuple[str, ...], mtime_ns: int):
+        self.sections = sections
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.monotonic()
+
+
+class MaterialRegistry:
+    """
+    Process-wide cache of parsed summaries, keyed by material ID. Lives in proc.userdata
+    so sessions get an immutable tuple of sections without touching the disk. Files are
+    re-stat'ed at most every `check_interval` seconds and re-parsed when their mtime moves.
+    """
+
+    def __init__(self, max_materials: int = 8, check_interval: float = 5.0):
+        self.max_materials = max_materials
+        self.check_interval = check_interval
+        self._materials: "OrderedDict[str, _Material]" = OrderedDict()
+        self._indices: Dict[str, _Index] = {}
+        self._outlines: Dict[str, _Index] = {}
+
+    def resolve(self, material_id: str) -> str:
+        """ `material_id` if it has a summary, else the default material; the ID comes from the room name, i.e. the client """
+        if material_id == DEFAULT_MATERIAL:
+            return material_id
+        try:
+            self.get(material_id)
+        except FileNotFoundError:
+            logger.warning(f"No material {material_id!r} (no {get_material_path(material_id)}), teaching {DEFAULT_MATERIAL} instead")
+            return DEFAULT_MATERIAL
+        return material_id
+
+    def get(self, material_id: str) -> Tuple[str, ...]:
+        material = self._materials.get(material_id)
+        if material is None:
+            return self._load(material_id).sections
+
+        self._materials.move_to_end(material_id) # LRU
+        now = time.monotonic()
+        if now - material.checked_at < self.check_interval:
+            return material.sections
+
+        material.checked_at = now
+        try:
+            mtime_ns = os.stat(get_material_path(material_id)).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Could not stat material {material_id}, serving cached copy: {e}")
+            return material.sections
+
+        if mtime_ns != material.mtime_ns:
+            logger.info(f"Material {material_id} changed on disk, reloading")
+            return self._load(material_id).sections
+        return material.sections
+
+    def index(self, material_id: str):
+        """ The material's retrieval index, or None if distill.py didn't build one """
+        cached = self._indices.get(material_id)
+        now = time.monotonic()
+        if cached is not None and now - cached.checked_at < self.check_interval:
+            return cached.index
+
+        from retrieval import MANIFEST_FILE, MaterialIndex
+
+        path = get_index_path(material_id)
+        try:
+            mtime_ns = os.stat(os.path.join(path, MANIFEST_FILE)).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if cached is not None and cached.mtime_ns == mtime_ns:
+            cached.checked_at = now
+            return cached.index
+
+        index = None
+        if mtime_ns is not None:
+            try:
+                index = MaterialIndex.load(path)
+                logger.info(f"Loaded retrieval index for {material_id} ({index.size} chunks, {index.manifest['embedder']['name']} embeddings)")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Could not load retrieval index for {material_id}: {e}")
+        else:
+            logger.info(f"No retrieval index for {material_id}, questions are answered without one")
+        self._indices[material_id] = _Index(index, mtime_ns)
+        return index
+
+    def outline(self, material_id: str):
+        """ The material's section outline, or None if there's none that matches its current sections """
+        sections = self.get(material_id)
+        cached = self._outlines.get(material_id)
+        now = time.monotonic()
+        if cached is not None and now - cached.checked_at < self.check_interval:
+            return cached.index
+
+        from outline import MaterialOutline
+
+        path = get_outline_path(material_id)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if cached is not None and cached.mtime_ns == mtime_ns and (cached.index is None or cached.index.matches(sections)):
+            cached.checked_at = now
+            return cached.index
+
+        outline = None
+        if mtime_ns is not None:
+            try:
+                outline = MaterialOutline.load(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Could not load outline for {material_id}: {e}")
+            if outline is not None and not outline.matches(sections):
+                logger.warning(f"Outline of {material_id} is out of date with its summary, rerun distill.py --outline-only")
+                outline = None
+            elif outline is not None:
+                low, high = outline.token_range()
+                logger.info(f"Loaded outline for {material_id} ({low}-{high} tokens per section)")
+        else:
+            logger.info(f"No outline for {material_id}, the tutor won't be reminded of unmentioned terms")
+        self._outlines[material_id] = _Index(outline, mtime_ns)
+        return outline
+
+    def preload(self, material_ids: Optional[List[str]] = None):
+        if material_ids is None:
+            material_ids = [DEFAULT_MATERIAL]
+            if os.path.isdir(MATERIALS_DIR):
+                material_ids += sorted(
+                    name for name in os.listdir(MATERIALS_DIR)
+                    if os.path.exists(get_material_path(name))
+                )
+        for material_id in material_ids[:self.max_materials]:
+            try:
+                self.get(material_id)
+                self.index(material_id)
+                self.outline(material_id)
+            except OSError as e:
+                logger.warning(f"Could not preload material {material_id}: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {material_id: len(material.sections) for material_id, material in self._materials.items()}
+
+    def _load(self, material_id: str) -> _Material:
+        path = get_material_path(material_id)
+        with open(path, "r", encoding="utf-8") as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            sections = tuple(split_summary_into_sections(f.read()))
+
+        material = _Material(sections, mtime_ns)
+        self._materials[material_id] = material
+        self._materials.move_to_end(material_id)
+        while len(self._materials) > self.max_materials:
+            evicted, _ = self._materials.popitem(last=False)
+            logger.info(f"Evicted material {evicted} from registry")
+
+        logger.info(f"Loaded material {material_id} from {path} ({len(sections)} sections)")
+        return material
@@ -0,0 +1,326 @@
+"""
+Sidecar index of the summary's sections (outline.json next to summary.md), written by
+distill.py: per section its token count, keywords and the names it mentions, and whether
+it was compressed to fit a per-section token budget.
+
+The runtime uses it to hold the tutor to "mention every example and person" without
+asking a model: MentionTracker matches the tutor's committed speech against the current
+section's names, and once the tutor has said something in a section, every reply gets a
+short "still to mention" reminder until it has covered them.
+
+Extraction is local and deterministic (no key needed, same output every run):
+- keywords are the section's highest tf-idf content words across the material, stemmed
+  like the hashing embedder does (retrieval.py), said at least twice in the section and in
+  at most a quarter of the sections
+- names are runs of capitalized words, seen mid-sentence at least twice, that the material
+  never writes lowercase (stemmed), that aren't demonyms and aren't part of a title. That's
+  people mostly, places too; a regex can't tell them apart and they need mentioning as much
+Only names get reminders. Keywords go into the outline and the compression prompt: a
+content word "still to mention" would be pushed into replies about something else entirely.
+"""
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from materials import STOPWORDS, material_fingerprint, stem_word
+from tokens import estimate_tokens
+
+logger = logging.getLogger("philosophy-tutor")
+
+OUTLINE_FILE = "outline.json"
+OUTLINE_VERSION = 3 # corpus-based keywords and names, rebuild older outlines
+KEYWORDS_PER_SECTION = 5
+MAX_REMINDER_TERMS = 6
+MIN_NAME_MENTIONS = 2
+MIN_KEYWORD_COUNT = 2
+MAX_KEYWORD_DF = 0.25 # fraction of the sections
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_TOKEN = re.compile(r"[^\W\d_][\w'\-]*|[^\s\w]") # words (accented too, "Laërtius") and punctuation
+_UNICODE_WORD = re.compile(r"[^\W_]+")
+# capitalized but not names, or not names of anyone/anywhere worth a reminder
+_NOT_NAMES = frozenset("""
+I Greek Greeks Roman Romans Latin English French German Western Eastern Ancient Modern Classical God Gods
+Monday Tuesday Wednesday Thursday Friday Saturday Sunday January February March April May June July August
+September October November December Section Chapter Figure Table Keywords People Wikimedia Commons Domain
+""".split())
+# connectives inside a multi-word name: "Thales of Miletus", "Laozi the sage" stops at "the"
+_NAME_JOINERS = frozenset(("of", "de", "da", "van", "von"))
+
+
+def _is_word(token: str, lowercase: set) -> bool:
+    """ An ordinary word that happens to be capitalized, not part of a name: the material writes it (or its stem) lowercase somewhere """
+    word = token.lower()
+    return word in STOPWORDS or word in lowercase or stem_word(word) in lowercase
+
+
+def _is_demonym(name: str, words: set) -> bool:
+    """ "Confucian", "Socratic", "Africans"; "Pythagorean" next to "Pythagoras" but not "Japan" """
+    if name.endswith(("ian", "ians", "ans", "ic", "ese", "ish")):
+        return True
+    if " " in name or not name.endswith("an"):
+        return False
+    root = name[:-2].rstrip("ei")
+    return name + "s" in words or (len(root) >= 4 and any(word != name and word.startswith(root) for word in words))
+
+
+def _names_in(text: str, lowercase: set, known: set = frozenset()) -> List[str]:
+    """ Runs of capitalized words; at the start of a sentence only words already `known` as part of a name """
+    names = []
+    for sentence in _SENTENCE_END.split(" ".join(text.split())):
+        tokens = [re.sub(r"'s?$", "", token) for token in _TOKEN.findall(sentence)]
+        run: List[str] = []
+        for i, token in enumerate(tokens + [""]):
+            capitalized = token[:1].isupper() and (i > 0 or token in known) and token not in _NOT_NAMES and not _is_word(token, lowercase)
+            if capitalized or (run and token in _NAME_JOINERS):
+                run.append(token)
+                continue
+            while run and run[-1] in _NAME_JOINERS:
+                run.pop()
+            # a capitalized ordinary word right after it makes it part of a title ("Opinions of Eminent Philosophers")
+            if run and not (token[:1].isupper() and token.lower() not in STOPWORDS and _is_word(token, lowercase)):
+                names.append(" ".join(run))
+            run = []
+    return names
+
+
+def extract_names(sections: Sequence[str], min_mentions: int = MIN_NAME_MENTIONS) -> List[List[str]]:
+    """
+    Per section, the proper names it mentions, in order of first mention. A name has to turn
+    up mid-sentence at least `min_mentions` times across the material, and a shorter name
+    counts as the longer one containing it ("Thales" is "Thales of Miletus").
+    """
+    lowercase = {form for section in sections for word in _TOKEN.findall(section) if word.islower() for form in (word, stem_word(word))}
+    mid_sentence = [_names_in(section, lowercase) for section in sections]
+    known = {part for names in mid_sentence for name in names for part in name.split()}
+    found = [_names_in(section, lowercase, known) for section in sections]
+
+    mentions = Counter(name for names in mid_sentence for name in names)
+    candidates = {name for names in found + mid_sentence for name in names}
+    words = {part for name in candidates for part in name.split()}
+    full = {}
+    for name in candidates:
+        padded = f" {name} "
+        longer = [other for other in candidates if padded in f" {other} "]
+        # the longest spelling, the more common one of those, then alphabetically for reruns
+        full[name] = min(longer, key=lambda other: (-len(other.split()), -mentions[other], other))
+    total = Counter()
+    for name, count in mentions.items():
+        total[full[name]] += count
+
+    result = []
+    for names in found:
+        seen = []
+        for name in names:
+            name = full[name]
+            # initials and abbreviations ("St", "BCE")
+            if total[name] < min_mentions or _is_demonym(name, words) or len(name) < 3 or name.isupper() or name in seen:
+                continue
+            seen.append(name)
+        result.append(seen)
+    return result
+
+
+def extract_keywords(sections: Sequence[str], names: Sequence[Sequence[str]], k: int = KEYWORDS_PER_SECTION) -> List[List[str]]:
+    """
+    Per section, up to k content words (most common spelling of the stem) that set it apart
+    from the others: said at least MIN_KEYWORD_COUNT times in the section, and in at most
+    MAX_KEYWORD_DF of the sections, so words every section uses don't count
+    """
+    stemmed = []
+    for section in sections:
+        words = [word for word in _UNICODE_WORD.findall(section.lower()) if word not in STOPWORDS and len(word) > 3 and not word.isdigit()]
+        stemmed.append([(stem_word(word), word) for word in words])
+    df = Counter(stem for words in stemmed for stem in {stem for stem, _ in words})
+    max_df = max(1, int(MAX_KEYWORD_DF * len(sections)))
+
+    result = []
+    for words, section_names in zip(stemmed, names):
+        name_stems = {stem_word(part.lower()) for name in section_names for part in name.split()}
+        counts = Counter(stem for stem, _ in words)
+        spellings: Dict[str, Counter] = {}
+        for stem, word in words:
+            spellings.setdefault(stem, Counter())[word] += 1
+        scored = [
+            (count * math.log((1 + len(sections)) / df[stem]), stem)
+            for stem, count in counts.items() if stem not in name_stems and count >= MIN_KEYWORD_COUNT and df[stem] <= max_df
+        ]
+        # ties go to the alphabetically first stem, so reruns give the same outline
+        top = sorted(scored, key=lambda item: (-item[0], item[1]))[:k]
+        result.append([spellings[stem].most_common(1)[0][0] for _, stem in top])
+    return result
+
+
+def compress_extractive(text: str, budget: int, terms: Sequence[str] = ()) -> str:
+    """
+    Keeps whole sentences, the first one and then those naming the most of `terms`,
+    in their original order, until `budget` tokens. The fallback when distill.py has no
+    model to rewrite the section with.
+    """
+    sentences = [s for s in _SENTENCE_END.split(" ".join(text.split())) if s]
+    if not sentences:
+        return text
+    lowered = [s.lower() for s in sentences]
+    score = [sum(term.lower() in sentence for term in terms) for sentence in lowered]
+    order = [0] + sorted(range(1, len(sentences)), key=lambda i: (-score[i], i))
+
+    kept, used = set(), 0
+    for i in order:
+        cost = estimate_tokens(sentences[i]) + 1
+        if used + cost > budget and kept:
+            continue
+        kept.add(i)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+class SectionInfo:
+    def __init__(self, tokens: int, keywords: List[str], names: List[str],
+                 original_tokens: Optional[int] = None, compressed: bool = False):
+        self.tokens = tokens
+        self.keywords = keywords
+        self.names = names
+        self.original_tokens = original_tokens if original_tokens is not None else tokens
+        self.compressed = compressed
+
+    @property
+    def terms(self) -> List[str]:
+        return self.names + self.keywords
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SectionInfo":
+        return cls(**data)
+
+
+class MaterialOutline:
+    """ The outline of one summary; only applies to the exact sections it was built from """
+
+    def __init__(self, sections: List[SectionInfo], fingerprint: str, budget: Optional[int] = None, version: int = OUTLINE_VERSION):
+        self.sections = sections
+        self.fingerprint = fingerprint
+        self.budget = budget
+        self.version = version
+
+    def matches(self, sections: Sequence[str]) -> bool:
+        return self.version == OUTLINE_VERSION and self.fingerprint == material_fingerprint(sections)
+
+    def token_range(self) -> Tuple[int, int]:
+        tokens = [info.tokens for info in self.sections] or [0]
+        return min(tokens), max(tokens)
+
+    def save(self, path: str):
+        data = {
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "budget": self.budget,
+            "sections": [info.to_dict() for info in self.sections],
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MaterialOutline":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls([SectionInfo.from_dict(info) for info in data["sections"]], data["fingerprint"], data.get("budget"), data["version"])
+
+
+def build_outline(sections: Sequence[str], originals: Optional[Sequence[str]] = None, budget: Optional[int] = None) -> MaterialOutline:
+    """
+    The outline of `sections` as the tutor will be given them. If some were compressed,
+    `originals` are the uncompressed ones: the terms come from those, so whatever the
+    compression dropped still gets a reminder.
+    """
+    originals = originals if originals is not None else sections
+    names = extract_names(originals)
+    keywords = extract_keywords(originals, names)
+    infos = []
+    for text, original, section_names, section_keywords in zip(sections, originals, names, keywords):
+        infos.append(SectionInfo(
+            tokens=estimate_tokens(text),
+            keywords=section_keywords,
+            names=section_names,
+            original_tokens=estimate_tokens(original),
+            compressed=text.strip() != original.strip(),
+        ))
+    return MaterialOutline(infos, material_fingerprint(sections), budget)
+
+
+def _name_keys(name: str) -> List[str]:
+    """ The lowercased words that count as saying the name, any part of it will do: "Gautama" for "Siddhartha Gautama" """
+    parts = [part.lower() for part in name.split() if len(part) > 2 and part not in _NAME_JOINERS]
+    return parts or [name.lower()]
+
+
+class MentionTracker:
+    """
+    Per session. Which of each section's names the tutor has actually said, fed from
+    agent_speech_committed. A committed message is split into words once and each word
+    looked up in the section's table of name parts.
+    """
+
+    def __init__(self, outline: Optional[MaterialOutline] = None, max_terms: int = MAX_REMINDER_TERMS):
+        self.outline = outline
+        self.max_terms = max_terms
+        self._lookups: Dict[int, Tuple[List[str], Dict[str, List[str]]]] = {}
+        self._mentioned: Dict[int, set] = {}
+        self._spoken: Counter = Counter()
+        self.missed = 0 # names never said before the section ended
+
+    def _section_names(self, section: int) -> Tuple[List[str], Dict[str, List[str]]]:
+        lookup = self._lookups.get(section)
+        if lookup is None:
+            info = self.outline.sections[section]
+            table = {}
+            for name in info.names:
+                for key in _name_keys(name):
+                    table.setdefault(key, []).append(name) # "Thales" says both "Thales" and "Thales of Miletus"
+            lookup = self._lookups[section] = (info.names, table)
+        return lookup
+
+    def _applies(self, section: int) -> bool:
+        return self.outline is not None and 0 <= section < len(self.outline.sections)
+
+    def on_agent_speech(self, text: str, section: int):
+        if not self._applies(section) or not text:
+            return
+        self._spoken[section] += 1
+        mentioned = self._mentioned.setdefault(section, set())
+        names, table = self._section_names(section)
+        if len(mentioned) >= len(names):
+            return
+        for word in _UNICODE_WORD.findall(text.lower()):
+            terms = table.get(word)
+            if terms:
+                mentioned.update(terms)
+
+    def outstanding(self, section: int) -> List[str]:
+        if not self._applies(section):
+            return []
+        mentioned = self._mentioned.get(section, ())
+        return [term for term in self._section_names(section)[0] if term not in mentioned]
+
+    def reminder(self, section: int) -> Optional[str]:
+        """ The ephemeral system message for this reply, once the tutor has started on the section """
+        if not self._spoken[section]:
+            return None # the Teaching Context has just been given, everything is still to come
+        outstanding = self.outstanding(section)
+        if not outstanding:
+            return None
+        return f"Still to mention in this section (weave them in naturally, don't list them): {', '.join(outstanding[:self.max_terms])}"
+
+    def finish(self, section: int):
+        outstanding = self.outstanding(section)
+        if outstanding:
+            self.missed += len(outstanding)
+            logger.info(f"Section {section + 1} ended without mentioning: {outstanding}")
+        self._lookups.pop(section, None)
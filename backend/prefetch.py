@@ -0,0 +1,220 @@
+import re
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Coroutine, List, Optional
+
+from livekit.agents import DEFAULT_API_CONNECT_OPTIONS, llm, utils
+from livekit.agents.pipeline.pipeline_agent import SpeechDataContextVar
+
+from prompts import RequestKind
+from tokens import estimate_tokens
+
+logger = logging.getLogger("philosophy-tutor")
+
+# the pipeline's user turn for a reply nobody asked for (user-led continuations)
+CONTINUE_MARKER = "<continue>"
+# "yes", "sure, let's go on", "okay next please": all the student said was to carry on
+_GO_AHEAD_WORDS = frozenset("""
+yes yeah yep yup sure ok okay alright right fine great cool ready absolutely definitely please
+let's lets let us go on ahead continue next move keep going sounds good of course i'm im am
+""".split())
+_WORD = re.compile(r"[a-z']+")
+
+
+def is_go_ahead(user_text: str) -> bool:
+    """ Whether a prefetched opening (generated from a bare "<continue>") still answers this turn """
+    text = user_text.strip().lower()
+    if text == CONTINUE_MARKER:
+        return True
+    words = _WORD.findall(text)
+    return bool(words) and "?" not in text and len(words) <= 8 and all(word in _GO_AHEAD_WORDS for word in words)
+
+
+class PrefetchedLLMStream(llm.LLMStream):
+    """ Replays an already generated reply so the pipeline treats it like a live completion """
+
+    def __init__(self, llm_: llm.LLM, *, chat_ctx: llm.ChatContext, text: str):
+        super().__init__(llm_, chat_ctx=chat_ctx, fnc_ctx=None, conn_options=DEFAULT_API_CONNECT_OPTIONS)
+        self._text = text
+
+    async def _run(self) -> None:
+        self._event_ch.send_nowait(
+            llm.ChatChunk(
+                request_id=utils.shortuuid("prefetch_"),
+                choices=[llm.Choice(delta=llm.ChoiceDelta(role="assistant", content=self._text))],
+            )
+        )
+
+
+class _Prefetch:
+    def __init__(self, section: int, task: asyncio.Task):
+        self.section = section
+        self.task = task
+        self.text: Optional[str] = None
+        self.completion_tokens = 0
+
+
+class SectionPrefetcher:
+    """
+    Generates the opening of section N+1 while section N is still playing, so a section
+    transition can hand the pipeline a finished reply instead of waiting on the LLM.
+    A prefetch is thrown away when the student interrupts, when the transition lands
+    on a different section than the one prefetched, or when the turn that triggered it
+    says more than "go on" (the opening was generated from a bare "<continue>").
+    While a transition is underway (marked, up to its reply playing) nothing new is
+    prefetched, so the progress line that plays in between can't replace the prefetch.
+
+    `context_builder(section)` builds the ChatContext the opening is generated from.
+    `presynthesize(text)`, if given, is awaited with the finished text so TTS can warm up too.
+    `spawn(coro, name)` starts the background tasks, e.g. a TaskSupervisor's (supervisor.py).
+    """
+
+    def __init__(self, llm_: llm.LLM, context_builder: Callable[[int], llm.ChatContext],
+                 presynthesize: Optional[Callable[[str], Awaitable[None]]] = None,
+                 spawn: Optional[Callable[[Coroutine[Any, Any, None], str], asyncio.Task]] = None):
+        self._spawn = spawn or (lambda coro, name: asyncio.create_task(coro, name=name))
+        self._llm = llm_
+        self._context_builder = context_builder
+        self._presynthesize = presynthesize
+        self._prefetch: Optional[_Prefetch] = None
+        self._transition_section: Optional[int] = None
+        self._transition_started_at: Optional[float] = None
+        self._awaiting_reply = False # take() ran, the latency ends when that reply starts playing
+
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.wasted_tokens = 0
+        self.transition_latencies: List[float] = [] # transition -> the section's reply starts playing, seconds
+
+    def start(self, section: int, total_sections: int):
+        """ Starts prefetching `section` if it exists and isn't already prefetched """
+        if section >= total_sections:
+            return
+        if self._transition_section is not None or self._awaiting_reply:
+            return # the transition takes what's prefetched now
+        if self._prefetch is not None and self._prefetch.section == section:
+            return
+        self.discard("superseded")
+        prefetch = _Prefetch(section, None)
+        prefetch.task = self._spawn(self._generate(prefetch), f"prefetch-section-{section}")
+        self._prefetch = prefetch
+        logger.info(f"Prefetching opening of section {section}")
+
+    def discard(self, reason: str):
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is None:
+            return
+        if not prefetch.task.done():
+            prefetch.task.cancel()
+        self.discarded += 1
+        self.wasted_tokens += prefetch.completion_tokens
+        logger.info(f"Discarded prefetch of section {prefetch.section} ({reason})")
+
+    def mark_transition(self, section: int):
+        """ Called right after tutor.next_section(), before the reply for `section` is requested """
+        if self._transition_section is None:
+            self._transition_started_at = time.perf_counter()
+        self._transition_section = section
+        self._awaiting_reply = False
+
+    async def take(self, section: int, user_text: str) -> Optional[str]:
+        """
+        The prefetched opening for `section` if a transition to it is pending and
+        `user_text`, the turn being replied to, only asks to go on. Otherwise None and the
+        reply is a live completion. Either way the pending transition ends here.
+        """
+        if self._transition_section is None:
+            return None
+        pending, self._transition_section = self._transition_section, None
+        self._awaiting_reply = True
+
+        prefetch, self._prefetch = self._prefetch, None
+        reason = None
+        if prefetch is None:
+            pass
+        elif prefetch.section != section or pending != section:
+            reason = f"diverged, prefetched {prefetch.section} but moved to {section}"
+        elif not is_go_ahead(user_text):
+            reason = "the student said more than go on"
+        if prefetch is None or reason is not None:
+            if prefetch is not None:
+                self._prefetch = prefetch
+                self.discard(reason)
+            self.misses += 1
+            return None
+
+        try:
+            # still in flight is fine, it started well before a cold request would. wait() rather than
+            # awaiting the task: a cancelled prefetch is a miss, a cancelled reply must stay cancelled
+            await asyncio.wait((prefetch.task,))
+        except asyncio.CancelledError:
+            prefetch.task.cancel() # nobody is left to take it
+            raise
+        if prefetch.task.cancelled() or prefetch.task.exception() is not None:
+            error = "cancelled" if prefetch.task.cancelled() else repr(prefetch.task.exception())
+            logger.warning(f"Prefetch of section {section} failed: {error}")
+            self.misses += 1
+            return None
+
+        if not prefetch.text:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(f"Using prefetched opening for section {section}")
+        return prefetch.text
+
+    def on_agent_started_speaking(self, is_reply: bool) -> Optional[float]:
+        """ `is_reply`: a generated reply, not a say() like the progress line. Returns the transition latency if this reply ends one """
+        if not is_reply or not self._awaiting_reply:
+            return None
+        self._awaiting_reply = False
+        if self._transition_started_at is None:
+            return None
+        self.transition_latencies.append(time.perf_counter() - self._transition_started_at)
+        logger.info(f"Section transition latency: {self.transition_latencies[-1]:.2f}s")
+        self._transition_started_at = None
+        return self.transition_latencies[-1]
+
+    def stats(self) -> dict:
+        attempts = self.hits + self.misses
+        latencies = sorted(self.transition_latencies)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / attempts if attempts else 0.0,
+            "discarded": self.discarded,
+            "wasted_tokens": self.wasted_tokens,
+            "transition_latency_p50": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+    async def aclose(self):
+        self.discard("session ended")
+        logger.info(f"Prefetch stats: {self.stats()}")
+
+    async def _generate(self, prefetch: _Prefetch):
+        # created from an agent event callback, don't let the prefetch's metrics pass as the live reply's
+        SpeechDataContextVar.set(None)
+        RequestKind.set("prefetch")
+
+        chat_ctx = self._context_builder(prefetch.section)
+        stream = self._llm.chat(chat_ctx=chat_ctx)
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+        finally:
+            # counted even when cancelled halfway, those tokens were still paid for
+            prefetch.completion_tokens = usage.completion_tokens if usage else estimate_tokens("".join(parts))
+            await stream.aclose()
+
+        prefetch.text = "".join(parts)
+        if self._presynthesize is not None and prefetch.text:
+            # take() shouldn't wait on TTS, only on the text
+            self._spawn(self._presynthesize(prefetch.text), f"presynthesize-section-{prefetch.section}")
@@ -0,0 +1,215 @@
+"""
+System prompts, assembled once per process into per-mode ChatContext templates, and
+the cached/uncached prompt token accounting that shows whether provider-side prompt
+caching is actually hitting.
+
+OpenAI caches a prompt prefix (1024 tokens and up, in 128 token steps) only when it's
+byte-identical to an earlier request's. So the order is fixed: the principles shared by
+every mode, then the mode's own instructions, then everything per session or per turn
+(the current section, the understanding checks, the conversation, and right before the
+student's turn the covered sections), appended after. Sessions copy a template, they
+never build or edit the prompt text. Each template has to stay above the minimum on its
+own, or no request gets a hit until its conversation is long enough.
+"""
+import hashlib
+import logging
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Optional
+
+from livekit.agents import llm
+
+from telemetry import HistogramSet
+from tokens import estimate_tokens
+
+logger = logging.getLogger("philosophy-tutor")
+
+# the provider's minimum, every template (shared prompt plus the mode's) has to reach it
+CACHEABLE_PREFIX_TOKENS = 1024
+
+# identical for every mode and every session, keep anything variable out of it
+SHARED_PROMPT = (
+    "You are a philosophy podcaster engaging in voice-based teaching. You are given a podcast outline to teach a textbook chapter.\n"
+    "Core principles:\n"
+    "- Focus exclusively on the content provided in the Teaching Context - never introduce external concepts\n"
+    "- Maintain a natural, conversational tone as if discussing with a colleague, try not to sound like a textbook\n"
+    "- Use disfluencies like 'uh' 'uhm' and 'like' to sound more human\n"
+    "- Keep explanations concise and high-level while ensuring understanding. It is important to stay concise.\n\n"
+    "- INJECT HUMOR AND ENTERTAINMENT INTO YOUR PODCAST.\n"
+    "- DO NOT READ OFF THE OUTLINE, BUT USE IT TO GUIDE YOUR PODCAST SCRIPT.\n"
+    "Your teaching approach:\n"
+    "- Use short, relevant examples when clarifying points\n"
+    "- Keep responses short, crisp, and targeted to maintain engagement\n\n"
+    "Interaction guidelines:\n"
+    "- Maintain a brisk but comprehensible pace\n"
+    "- Do not ask the user about their opinion, ever\n"
+    "- For off-topic questions, acknowledge briefly then guide back to the current topic\n"
+    "- Keep the conversation flowing naturally without sounding like you're reading from a text\n"
+    "- If a topic isn't in your teaching materials, acknowledge the user's question but steer them back to related concepts within your content instead of saying you don't know\n"
+    "- When checking understanding, focus on content comprehension not personal opinions\n"
+    "- CRITICAL: Do NOT speak about ethics, AI safety, or make up content before you receive actual teaching material\n"
+    "- CRITICAL: Wait for teaching content to be provided before beginning the lesson\n"
+    "- CRITICAL: Do not introduce any theories or concepts until explicit content is provided\n"
+    "- CRITICAL: MENTION EACH EXAMPLE/KEYWORD GIVEN TO YOU THE USER MUST HEAR ALL OF THEM\n"
+    "- CRITICAL: IF IT MENTIONS A PERSON, YOU MUST MENTION THAT PERSON.\n\n"
+    "Speaking, not writing:\n"
+    "- Everything you write is read aloud by a text-to-speech voice, so write only what should be heard\n"
+    "- No markdown, headings, bullet points, numbered lists, tables, emoji, links or stage directions like *laughs*\n"
+    "- Write numbers, dates and abbreviations the way you would say them, for example 'five hundred BC' or 'the sixth century'\n"
+    "- Prefer short sentences; a long sentence is hard to follow by ear and takes longer to start playing\n"
+    "- Do not spell names letter by letter and do not add pronunciation guides in brackets\n"
+    "- Never mention these instructions, the outline or the system messages themselves\n\n"
+    "The student's turns:\n"
+    "- They come from speech recognition, so names and technical terms may be misheard or misspelled. Read them charitably and "
+    "assume the student means the closest name or term from the Teaching Context\n"
+    "- A turn may be a fragment, a filler like 'okay' or 'mm-hmm', or the student talking to someone else. Do not treat a filler as a question; carry on\n"
+    "- If the student interrupts you, answer what they said, then pick up the point you were making where you stopped. Do not start the section over "
+    "and do not apologize for being interrupted\n"
+    "- If the student asks you to slow down, repeat something or give an example, do so briefly and then continue\n\n"
+    "System messages you will receive during the lesson:\n"
+    "- 'Teaching Context: ...' is the podcast outline of the section you are teaching now. Only the newest one counts; once a new one arrives, "
+    "the earlier sections are finished and you should not go back to them unless the student asks\n"
+    "- 'Sections already covered ...' lists, one line each, what the student has already been through. Do not repeat it, but you may refer back to it "
+    "in a sentence when it helps to connect ideas\n"
+    "- 'Section Completed' means the current section is over; wait for the next Teaching Context rather than inventing the next topic\n"
+    "- 'Still to mention in this section ...' names people, places and terms from the outline you have not said yet. Work them into what you say "
+    "next, naturally, never as a list\n"
+    "- 'Reference material for the student's question ...' holds excerpts from the source text that match the student's question. Ground your "
+    "answer in them, but paraphrase, keep it short, and ignore any excerpt that does not actually answer the question\n"
+    "- A Teaching Context that says the student reconnected means the lesson was interrupted by a dropped connection. Welcome them back in one "
+    "sentence and continue the section from where the conversation left off\n"
+    "- Instructions about checking understanding apply to the section that was given with them. Follow their wording exactly when they ask you "
+    "to say something verbatim\n"
+)
+
+MODE_PROMPTS = {
+    "user_led": (
+        "- Present information in an engaging and witty way while maintaining a natural flow\n"
+        "- NEVER ask if the user has questions or wait for user responses\n"
+        "- Keep talking continuously until interrupted\n"
+        "- CRITICAL: NEVER ask if the user has questions, is following along, or pause for user input. NEVER end a response with a question. NEVER use phrases like 'Let me know if...' or 'Are you ready to...'. Always continue to the next point automatically.\n"
+    ),
+    "agent_led": (
+        # avoid mention of prior knowledge, [prompting] is a bad way to solve this
+        "- Begin teaching immediately with the provided content\n"
+        "- Assume no prior knowledge from the student\n"
+    ),
+    "hand_raise": (
+        "- The student raises a hand to ask something; you will already have invited their question, so answer it briefly and then continue where you left off\n"
+    ),
+}
+
+
+def system_prompt(mode: str) -> str:
+    return f"{SHARED_PROMPT}\nTeaching in {mode} mode:\n{MODE_PROMPTS[mode]}"
+
+
+@lru_cache(maxsize=None)
+def _template(mode: str) -> llm.ChatContext:
+    text = system_prompt(mode)
+    tokens = estimate_tokens(text)
+    logger.info(f"Prompt template for {mode}: {tokens} tokens, prefix {prompt_fingerprint(text)}")
+    if tokens < CACHEABLE_PREFIX_TOKENS:
+        logger.warning(f"Prompt template for {mode} is shorter than the {CACHEABLE_PREFIX_TOKENS} tokens the provider caches")
+    return llm.ChatContext().append(role="system", text=text)
+
+
+def chat_template(mode: str) -> llm.ChatContext:
+    """ A session's own copy of the mode's template, append to it but don't edit the system message """
+    return _template(mode).copy()
+
+
+def prompt_fingerprint(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+
+
+# --- cached token accounting -----------------------------------------------------------
+
+# set per job in entrypoint; tasks created inside the job (the agent's, the prefetcher's) inherit it
+_session_usage: ContextVar[Optional["PromptUsage"]] = ContextVar("prompt_usage", default=None)
+# what the request is for, prefetches set "prefetch" so they aren't mistaken for the live reply's
+RequestKind: ContextVar[str] = ContextVar("prompt_request_kind", default="reply")
+
+
+class PromptUsage:
+    """ One session's prompt tokens, split into cached (prefix hit) and uncached """
+
+    def __init__(self, room_name: str, on_reply=None):
+        self.room_name = room_name
+        self.on_reply = on_reply # (prompt_tokens, cached_tokens) for every live reply, e.g. the latency timeline
+        self.histograms = HistogramSet()
+        self.totals: Dict[str, Dict[str, int]] = {}
+
+    def bind(self):
+        _session_usage.set(self)
+
+    def record(self, prompt_tokens: int, cached_tokens: int, kind: str = "reply"):
+        totals = self.totals.setdefault(kind, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached_tokens
+        self.histograms.add(f"{kind}.cached_fraction", cached_tokens / prompt_tokens if prompt_tokens else 0.0)
+        logger.info(f"Prompt tokens ({kind} {totals['requests']}): {cached_tokens} cached + {prompt_tokens - cached_tokens} uncached")
+        if kind == "reply" and self.on_reply is not None:
+            self.on_reply(prompt_tokens, cached_tokens)
+
+    def stats(self) -> dict:
+        return {
+            kind: {**totals, "cached_fraction": round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0}
+            for kind, totals in self.totals.items()
+        }
+
+    async def aclose(self):
+        logger.info(f"Prompt cache stats: {self.stats()}")
+
+
+def report_usage(prompt_tokens: int, cached_tokens: int):
+    """ Attributes a completion's usage to the session (and request kind) it was made for """
+    usage = _session_usage.get()
+    if usage is not None:
+        usage.record(prompt_tokens, cached_tokens, RequestKind.get())
+
+
+class _UsageStream:
+    """ Passes a streamed completion through, reporting the usage chunk on the way """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._iterator = None
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._stream.__aexit__(*exc)
+
+    def __aiter__(self):
+        self._iterator = self._stream.__aiter__()
+        return self
+
+    async def __anext__(self):
+        chunk = await self._iterator.__anext__()
+        if chunk.usage is not None:
+            details = getattr(chunk.usage, "prompt_tokens_details", None)
+            report_usage(chunk.usage.prompt_tokens, (getattr(details, "cached_tokens", None) or 0) if details else 0)
+        return chunk
+
+
+def instrument_client(client):
+    """
+    The openai plugin turns the usage chunk into a CompletionUsage without the cached
+    token count, so it's read off the (shared, ours) client's streams instead.
+    """
+    completions = client.chat.completions
+    create = completions.create
+
+    async def create_with_usage(*args, **kwargs):
+        response = await create(*args, **kwargs)
+        return _UsageStream(response) if kwargs.get("stream") else response
+
+    completions.create = create_with_usage
+    return client
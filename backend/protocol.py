@@ -0,0 +1,249 @@
+"""
+The data channel between the tutor and the frontend.
+
+Messages are versioned JSON envelopes on the "tutor" topic, as many per packet as are due:
+
+    {"v": 1, "m": [["progress", {"section": 2, "total": 6}], ["speaking", {"agent": true, "user": false}]]}
+
+Server to client, every type in MESSAGE_TYPES says how it's delivered: reliable for what
+the UI must not miss, lossy for state the next update supersedes anyway; whether a newer
+message replaces one that hasn't gone out yet; and how often the type may go out at most.
+Sends are batched per event loop tick, so a burst of callbacks costs one packet.
+
+    progress   {"section": i, "total": n}         reliable, latest wins, 4/s
+    speaking   {"agent": bool, "user": bool}      lossy, latest wins, 10/s
+    hand       {"raised": bool}                   reliable, latest wins (the ack of a hand message)
+    completed  {"code": str}                      reliable
+
+Client to server, handlers are registered per type and looked up in a table:
+
+    hand       {"raised": bool}
+
+The free-text packets of the first frontend are still understood ("HAND_RAISED" on the
+"command" topic goes to the hand handler) and "strawberry" is still sent to it, until
+every client speaks the protocol.
+"""
+import json
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("philosophy-tutor")
+
+PROTOCOL_VERSION = 1
+TOPIC = "tutor"
+LEGACY_TOPIC = "command"
+# lossy packets should fit in one datagram, reliable ones are limited by the SFU
+MAX_LOSSY_BYTES = 1300
+MAX_RELIABLE_BYTES = 15000
+
+
+class MessageType:
+    def __init__(self, reliable: bool, coalesce: bool = False, min_interval: float = 0.0):
+        self.reliable = reliable
+        self.coalesce = coalesce # a newer message replaces the pending one
+        self.min_interval = min_interval # seconds between two packets carrying this type
+
+
+MESSAGE_TYPES: Dict[str, MessageType] = {
+    "progress": MessageType(reliable=True, coalesce=True, min_interval=0.25),
+    "speaking": MessageType(reliable=False, coalesce=True, min_interval=0.1),
+    "hand": MessageType(reliable=True, coalesce=True),
+    "completed": MessageType(reliable=True),
+}
+
+# first frontend's commands -> (type, data) of the same message in the protocol
+LEGACY_COMMANDS: Dict[str, Tuple[str, dict]] = {
+    "HAND_RAISED": ("hand", {"raised": True}),
+}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode(messages: List[Tuple[str, dict]]) -> bytes:
+    return json.dumps({"v": PROTOCOL_VERSION, "m": [[kind, data] for kind, data in messages]}, separators=(",", ":")).encode("utf-8")
+
+
+def decode(payload: bytes) -> List[Tuple[str, dict]]:
+    try:
+        envelope = json.loads(payload)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ProtocolError(f"not JSON: {e}") from e
+    if not isinstance(envelope, dict) or not isinstance(envelope.get("m"), list):
+        raise ProtocolError("not an envelope")
+    if envelope.get("v") != PROTOCOL_VERSION:
+        raise ProtocolError(f"unsupported version {envelope.get('v')!r}")
+    messages = []
+    for message in envelope["m"]:
+        if not (isinstance(message, list) and len(message) == 2 and isinstance(message[0], str) and isinstance(message[1], dict)):
+            raise ProtocolError(f"malformed message {message!r}")
+        messages.append((message[0], message[1]))
+    return messages
+
+
+class DataChannel:
+    """
+    One session's end of the channel. send() only queues; a timer on the loop flushes
+    whatever is due (per type rate limits) as one packet per delivery mode. Incoming
+    packets go through on_data_received (the room's data_received handler).
+    `spawn(coro, name)` starts the publishes, e.g. a TaskSupervisor's (supervisor.py).
+    """
+
+    def __init__(self, room, session: str, health=None, spawn: Optional[Callable] = None,
+                 types: Dict[str, MessageType] = MESSAGE_TYPES):
+        self.room = room
+        self.session = session
+        self.health = health
+        self.spawn = spawn or (lambda coro, name: asyncio.create_task(coro, name=name))
+        self.types = types
+        self._handlers: Dict[str, Callable[[dict], None]] = {}
+        self._pending: Dict[str, List[dict]] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._closed = False
+
+        self.packets_out = {"reliable": 0, "lossy": 0}
+        self.bytes_out = 0
+        self.messages_out: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+        self.packets_in = 0
+        self.messages_in: Dict[str, int] = {}
+        self.rejected = 0
+
+    # --- client to server ---
+
+    def on(self, kind: str, handler: Callable[[dict], None]):
+        self._handlers[kind] = handler
+
+    def on_data_received(self, packet):
+        self.packets_in += 1
+        if packet.topic == TOPIC:
+            try:
+                messages = decode(packet.data)
+            except ProtocolError as e:
+                self._reject(f"Ignoring data packet from the client: {e}")
+                return
+        elif packet.topic == LEGACY_TOPIC:
+            command = packet.data.decode("utf-8", errors="replace").strip().upper()
+            if command not in LEGACY_COMMANDS:
+                self._reject(f"Ignoring unknown command {command!r}")
+                return
+            messages = [LEGACY_COMMANDS[command]]
+        else:
+            return
+
+        for kind, data in messages:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                self._reject(f"Ignoring {kind!r} message, no handler")
+                continue
+            self.messages_in[kind] = self.messages_in.get(kind, 0) + 1
+            handler(data)
+
+    def _reject(self, reason: str):
+        self.rejected += 1
+        logger.warning(f"{reason} ({self.session})")
+
+    # --- server to client ---
+
+    def send(self, kind: str, **data):
+        if self._closed:
+            return
+        pending = self._pending.setdefault(kind, [])
+        if pending and self.types[kind].coalesce:
+            pending[-1] = data
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + 1
+        else:
+            pending.append(data)
+        self._schedule()
+
+    def send_legacy(self, text: str):
+        """ For clients from before the protocol, a bare string on the command topic """
+        payload = text.encode("utf-8")
+        self.spawn(self._publish(payload, True, LEGACY_TOPIC), "data-packet")
+
+    def _due_at(self, kind: str) -> float:
+        last = self._last_sent.get(kind)
+        return last + self.types[kind].min_interval if last is not None else 0.0
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        due = max(loop.time(), min(self._due_at(kind) for kind, pending in self._pending.items() if pending))
+        if self._timer is not None:
+            if self._timer.when() <= due:
+                return
+            self._timer.cancel()
+        # one timer for everything pending, so whatever else is sent before it fires shares the packet
+        self._timer = loop.call_at(due, self._flush)
+
+    def _take_due(self, now: Optional[float]) -> Dict[bool, List[Tuple[str, dict]]]:
+        """ Pending messages whose type may go out at `now` (all of them if None), by reliability """
+        batches: Dict[bool, List[Tuple[str, dict]]] = {True: [], False: []}
+        for kind, pending in self._pending.items():
+            if not pending or (now is not None and self._due_at(kind) > now):
+                continue
+            batches[self.types[kind].reliable].extend((kind, data) for data in pending)
+            self.messages_out[kind] = self.messages_out.get(kind, 0) + len(pending)
+            self._pending[kind] = []
+            if now is not None:
+                self._last_sent[kind] = now
+        return batches
+
+    def _packets(self, batches: Dict[bool, List[Tuple[str, dict]]]) -> List[Tuple[bytes, bool]]:
+        packets = []
+        for reliable, messages in batches.items():
+            limit = MAX_RELIABLE_BYTES if reliable else MAX_LOSSY_BYTES
+            batch: List[Tuple[str, dict]] = []
+            for message in messages:
+                if batch and len(encode(batch + [message])) > limit:
+                    packets.append((encode(batch), reliable))
+                    batch = []
+                batch.append(message)
+            if batch:
+                packets.append((encode(batch), reliable))
+        return packets
+
+    def _flush(self):
+        self._timer = None
+        for payload, reliable in self._packets(self._take_due(asyncio.get_running_loop().time())):
+            self.spawn(self._publish(payload, reliable, TOPIC), "data-packet")
+        if any(self._pending.values()):
+            self._schedule()
+
+    async def _publish(self, payload: bytes, reliable: bool, topic: str):
+        delivery = "reliable" if reliable else "lossy"
+        self.packets_out[delivery] += 1
+        self.bytes_out += len(payload)
+        if self.health is not None:
+            self.health.count(f"packets_out.{delivery}")
+        try:
+            await self.room.local_participant.publish_data(payload, reliable=reliable, topic=topic)
+        except Exception as e:
+            # the room is going away, or already gone; nothing to retry
+            logger.warning(f"Could not publish {delivery} data packet ({self.session}): {e!r}")
+            if self.health is not None:
+                self.health.count("packets_failed")
+
+    def stats(self) -> dict:
+        return {
+            "packets_out": dict(self.packets_out),
+            "bytes_out": self.bytes_out,
+            "messages_out": dict(self.messages_out),
+            "coalesced": dict(self.coalesced),
+            "packets_in": self.packets_in,
+            "messages_in": dict(self.messages_in),
+            "rejected": self.rejected,
+        }
+
+    async def aclose(self):
+        """ Sends what's still pending right away, rate limits or not, then stops sending """
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # awaited here rather than spawned, the session's tasks may already be cancelled
+        for payload, reliable in self._packets(self._take_due(None)):
+            await self._publish(payload, reliable, TOPIC)
+        logger.info(f"Data channel stats: {self.stats()}")
@@ -0,0 +1,243 @@
+"""
+Per-process pool of what every session needs but shouldn't build from scratch: the
+silero weights and the synthesized audio cache. Sessions lease lightweight plugin objects
+built around the shared pieces.
+
+The plugin objects themselves stay per session on purpose. VoicePipelineAgent hooks
+"metrics_collected" on its STT/LLM/TTS/VAD and never unhooks, so a shared instance
+would leak handlers and report every session's metrics to every other session.
+
+aiohttp/httpx pools are bound to the event loop that created them, so they're kept per
+loop and closed when the last session on that loop releases its lease. Every job runs on
+its own loop, so in practice each session gets pools of its own, built in acquire(); only
+the weights and the audio cache are shared between sessions, which also covers the thread
+job executor (several jobs, one process, one loop each). The turn detector is per lease
+too: it's a client of the job's inference executor, which goes away with the job.
+"""
+import time
+import asyncio
+import logging
+import resource
+import threading
+from typing import Dict, Optional
+
+import aiohttp
+from livekit.agents import llm, stt, tts, vad
+
+from prompts import instrument_client
+from tts_cache import AudioCache, CachedTTS
+
+logger = logging.getLogger("philosophy-tutor")
+
+LLM_MODEL = "gpt-4o-mini"
+
+
+def rss_mb() -> float:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        # peak rather than current, but it only ever grows in a worker anyway (KiB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _LoopClients:
+    """ Connection pools for one event loop """
+
+    def __init__(self, http_session: aiohttp.ClientSession, openai_client):
+        self.http_session = http_session
+        self.openai_client = openai_client
+        self.refs = 0
+
+    async def aclose(self):
+        await self.http_session.close()
+        await self.openai_client.close()
+
+
+class SessionResources:
+    """ One session's lease on the pool, give it back with release() when the session ends """
+
+    def __init__(self, pool: "ResourcePool", session_id: str, clients: _LoopClients, *, vad: vad.VAD, stt: stt.STT,
+                 llm: llm.LLM, tts: CachedTTS, turn_detector):
+        self.pool = pool
+        self.session_id = session_id
+        self.clients = clients
+        self.vad = vad
+        self.stt = stt
+        self.llm = llm
+        self.tts = tts
+        self.turn_detector = turn_detector
+        self.released = False
+
+    @property
+    def openai_client(self):
+        return self.clients.openai_client
+
+    async def release(self):
+        await self.pool.release(self)
+
+
+class ResourcePool:
+    """
+    Reference-counted, per-process. Build it (and load the weights) in prewarm, then
+    acquire() a lease per session. The factory methods are the seams for other plugin
+    setups (and for loadtest.py's fakes).
+    """
+
+    def __init__(self, audio_cache: Optional[AudioCache] = None, llm_model: str = LLM_MODEL):
+        self.audio_cache = audio_cache or AudioCache()
+        self.llm_model = llm_model
+
+        self._lock = threading.Lock() # jobs on the thread executor share the pool
+        self._vad: Optional[vad.VAD] = None
+        self._clients: Dict[asyncio.AbstractEventLoop, _LoopClients] = {}
+        self._leases: Dict[int, SessionResources] = {}
+
+        self.acquired = 0
+        self.released = 0
+        self.peak_sessions = 0
+        self.baseline_rss_mb: Optional[float] = None
+        self.acquire_ms = []
+
+    # --- factories -------------------------------------------------------------------
+
+    def _load_vad(self) -> vad.VAD:
+        from livekit.plugins import silero
+        return silero.VAD.load()
+
+    def _session_vad(self, shared: vad.VAD) -> vad.VAD:
+        from livekit.plugins import silero
+        # a thin wrapper around the already loaded onnx session
+        return silero.VAD(session=shared._onnx_session, opts=shared._opts)
+
+    def _make_turn_detector(self, inference_executor):
+        from livekit.plugins import turn_detector
+        # the weights live in the worker's inference process, this is just the client side
+        return turn_detector.EOUModel(inference_executor=inference_executor)
+
+    def _make_clients(self) -> _LoopClients:
+        import httpx
+        import openai
+        # same settings the openai plugin uses for the client it would otherwise build per instance
+        openai_client = instrument_client(openai.AsyncClient(
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                timeout=httpx.Timeout(connect=15.0, read=5.0, write=5.0, pool=5.0),
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=50, keepalive_expiry=120),
+            ),
+        )) # cached prompt tokens, see prompts.py
+        return _LoopClients(aiohttp.ClientSession(), openai_client)
+
+    def _make_stt(self, clients: _LoopClients) -> stt.STT:
+        from livekit.plugins import deepgram
+        return deepgram.STT(http_session=clients.http_session)
+
+    def _make_llm(self, clients: _LoopClients) -> llm.LLM:
+        from livekit.plugins import openai
+        return openai.LLM(model=self.llm_model, client=clients.openai_client)
+
+    def _make_tts(self, clients: _LoopClients) -> tts.TTS:
+        from livekit.plugins import openai
+        return openai.TTS(client=clients.openai_client)
+
+    # --- lifecycle -------------------------------------------------------------------
+
+    def prewarm(self):
+        """ Loads the process-wide models, safe to call from every job's prewarm """
+        # imported by _make_clients, but that runs on the first session's event loop
+        import httpx, openai # noqa: F401
+        with self._lock:
+            if self._vad is None:
+                self._vad = self._load_vad()
+            if self.baseline_rss_mb is None:
+                self.baseline_rss_mb = rss_mb()
+        logger.info(f"Resource pool prewarmed: {self.stats()}")
+
+    async def acquire(self, session_id: str, inference_executor=None) -> SessionResources:
+        started = time.perf_counter()
+        if self._vad is None:
+            self.prewarm()
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.get(loop)
+            if clients is None:
+                clients = self._clients[loop] = self._make_clients()
+            clients.refs += 1
+
+        lease = SessionResources(
+            self,
+            session_id,
+            clients,
+            vad=self._session_vad(self._vad),
+            stt=self._make_stt(clients),
+            llm=self._make_llm(clients),
+            tts=CachedTTS(self._make_tts(clients), self.audio_cache),
+            turn_detector=self._make_turn_detector(inference_executor) if inference_executor is not None else None,
+        )
+
+        with self._lock:
+            self._leases[id(lease)] = lease
+            self.acquired += 1
+            self.peak_sessions = max(self.peak_sessions, len(self._leases))
+            self.acquire_ms.append((time.perf_counter() - started) * 1000)
+            del self.acquire_ms[:-256]
+        logger.info(f"Session {session_id} resources ready in {self.acquire_ms[-1]:.1f}ms: {self.stats()}")
+        return lease
+
+    async def release(self, lease: SessionResources):
+        if lease.released:
+            return
+        lease.released = True
+
+        to_close = None
+        with self._lock:
+            self._leases.pop(id(lease), None)
+            self.released += 1
+            lease.clients.refs -= 1
+            if lease.clients.refs == 0:
+                # the loop these pools belong to is going away with its last session
+                for loop, clients in list(self._clients.items()):
+                    if clients is lease.clients:
+                        del self._clients[loop]
+                to_close = lease.clients
+
+        if to_close is not None:
+            await to_close.aclose()
+        logger.info(f"Session {lease.session_id} released its resources: {self.stats()}")
+
+    def stats(self) -> dict:
+        sessions = len(self._leases)
+        rss = rss_mb()
+        acquire_ms = sorted(self.acquire_ms)
+        return {
+            "sessions": sessions,
+            "peak_sessions": self.peak_sessions,
+            "acquired": self.acquired,
+            "released": self.released,
+            "loops": len(self._clients),
+            "rss_mb": round(rss, 1),
+            "rss_per_session_mb": round((rss - self.baseline_rss_mb) / sessions, 2) if sessions and self.baseline_rss_mb is not None else None,
+            "acquire_ms_p50": round(acquire_ms[len(acquire_ms) // 2], 2) if acquire_ms else None,
+            "tts_cache": self.audio_cache.stats(),
+        }
+
+    async def aclose(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for c in clients:
+            await c.aclose()
+
+
+_pool: Optional[ResourcePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_resource_pool() -> ResourcePool:
+    """ The process's pool; every job's proc.userdata points at the same one """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ResourcePool()
+        return _pool
@@ -0,0 +1,244 @@
+"""
+Vector index over the raw paragraphs of the material (material.md), so questions can be
+answered from the source text instead of whatever happens to be in the chat context.
+
+distill.py builds it next to the summary: every raw paragraph is distilled into exactly
+one summary section, so a chunk of paragraph N belongs to section N. The index is a
+livekit-plugins-rag annoy index plus an index.json manifest naming the embedder, which
+has to be the same at query time.
+
+Embedders are pluggable. "openai" uses the embeddings API, "hashing" is a local feature
+hashing embedder for offline use (bag of words and bigrams, no model, no network).
+"""
+import os
+import re
+import json
+import asyncio
+import hashlib
+import logging
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from materials import STOPWORDS, stem_word
+
+logger = logging.getLogger("philosophy-tutor")
+
+INDEX_DIR = "index"
+MANIFEST_FILE = "index.json"
+CHUNK_CHARS = 600
+CHUNK_OVERLAP = 100
+
+_WORD = re.compile(r"[a-z0-9]+")
+_QUESTION_START = re.compile(r"^\s*(what|why|how|who|whom|when|where|which|is|are|was|were|do|does|did|can|could|would|should|will|explain|tell me|what's)\b", re.I)
+
+
+class Embedder:
+    name = ""
+    dim = 0
+
+    # angular distance above which a chunk isn't considered related, depends on the embedding space
+    max_distance = 1.25
+    # content words a chunk has to share with the query on top of that, for embedders whose distances alone don't separate topics
+    min_shared_terms = 0
+
+    def fit(self, texts: Sequence[str]):
+        """ Called with the whole corpus before it's embedded, for embedders that learn from it """
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: Sequence[str]) -> List[List[float]]:
+        return self.embed(texts)
+
+    def config(self) -> dict:
+        return {"name": self.name, "dim": self.dim}
+
+
+class HashingEmbedder(Embedder):
+    """
+    Signed feature hashing of content words (crudely stemmed) and their bigrams, log-scaled,
+    weighted by the inverse document frequency of their bucket in the indexed chunks (kept
+    in the manifest so queries are weighted the same way) and L2-normalized.
+    """
+
+    name = "hashing"
+    max_distance = 1.33 # coarse, related and unrelated questions land closer together than with real embeddings
+    min_shared_terms = 1 # so off-topic questions ("the weather in Paris") still get nothing
+
+    def __init__(self, dim: int = 512, idf: Optional[Sequence[float]] = None):
+        self.dim = dim
+        self.idf = np.asarray(idf, dtype=np.float32) if idf is not None else np.ones(self.dim, dtype=np.float32)
+
+    def _features(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = [stem_word(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+        for feature, weight in [(word, 1.0) for word in words] + [(f"{a} {b}", 0.5) for a, b in zip(words, words[1:])]:
+            bucket, sign = self._bucket(feature)
+            vector[bucket] += sign * weight
+        return vector
+
+    def fit(self, texts: Sequence[str]):
+        df = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            df += self._features(text) != 0
+        self.idf = np.log((1 + len(texts)) / (1 + df)) + 1
+
+    def _bucket(self, feature: str):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        vectors = np.stack([self._features(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors)) * self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms == 0, 1, norms)).tolist()
+
+    def config(self) -> dict:
+        return {"name": self.name, "dim": self.dim, "idf": [round(float(w), 3) for w in self.idf]}
+
+
+class OpenAIEmbedder(Embedder):
+    name = "openai"
+    max_distance = 1.25
+
+    def __init__(self, model: str = "text-embedding-3-small", dim: int = 512, client=None, aclient=None):
+        self.model = model
+        self.dim = dim
+        self._client = client
+        self._aclient = aclient
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI()
+        response = self._client.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        return [item.embedding for item in response.data]
+
+    async def aembed(self, texts: Sequence[str]) -> List[List[float]]:
+        if self._aclient is None:
+            from openai import AsyncOpenAI
+            self._aclient = AsyncOpenAI()
+        response = await self._aclient.embeddings.create(model=self.model, input=list(texts), dimensions=self.dim)
+        return [item.embedding for item in response.data]
+
+    def config(self) -> dict:
+        return {"name": self.name, "dim": self.dim, "model": self.model}
+
+
+def get_embedder(config: dict, **kwargs) -> Embedder:
+    if config["name"] == "openai":
+        return OpenAIEmbedder(model=config.get("model", "text-embedding-3-small"), dim=config["dim"], **kwargs)
+    if config["name"] == "hashing":
+        return HashingEmbedder(dim=config["dim"], idf=config.get("idf"))
+    raise ValueError(f"Unknown embedder {config['name']}")
+
+
+def chunk_paragraphs(paragraphs: Sequence[str]) -> List[dict]:
+    """ Splits every paragraph into overlapping sentence-aligned chunks, keeping the section number """
+    from livekit.plugins.rag import SentenceChunker
+
+    chunker = SentenceChunker(max_chunk_size=CHUNK_CHARS, chunk_overlap=CHUNK_OVERLAP)
+    chunks = []
+    for section, paragraph in enumerate(paragraphs):
+        for text in chunker.chunk(text=paragraph):
+            chunks.append({"section": section, "text": text.strip()})
+    return chunks
+
+
+def build_index(paragraphs: Sequence[str], embedder: Embedder, index_dir: str = INDEX_DIR, batch_size: int = 64) -> int:
+    """ Embeds the chunks of `paragraphs` into index_dir, returns the number of chunks """
+    from livekit.plugins.rag import annoy
+
+    chunks = chunk_paragraphs(paragraphs)
+    embedder.fit([chunk["text"] for chunk in chunks])
+    builder = annoy.IndexBuilder(f=embedder.dim, metric="angular")
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        for chunk, vector in zip(batch, embedder.embed([chunk["text"] for chunk in batch])):
+            builder.add_item(vector, chunk)
+    builder.build(trees=10)
+    builder.save(index_dir)
+
+    manifest = {"embedder": embedder.config(), "chunks": len(chunks), "sections": len(paragraphs)}
+    tmp_path = os.path.join(index_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(index_dir, MANIFEST_FILE))
+    return len(chunks)
+
+
+def content_terms(text: str) -> set:
+    """ Stemmed words that say what `text` is about """
+    return {stem_word(word) for word in _WORD.findall(text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+
+def looks_like_question(text: str) -> bool:
+    return "?" in text or _QUESTION_START.match(text) is not None
+
+
+class Snippet:
+    def __init__(self, section: int, text: str, distance: float):
+        self.section = section
+        self.text = text
+        self.distance = distance
+
+
+class MaterialIndex:
+    """ A loaded index, shared by every session teaching the same material """
+
+    def __init__(self, index, manifest: dict, embedder: Embedder):
+        self._index = index
+        self.manifest = manifest
+        self.embedder = embedder
+
+    @classmethod
+    def load(cls, index_dir: str, **embedder_kwargs) -> "MaterialIndex":
+        from livekit.plugins.rag import annoy
+
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return cls(annoy.AnnoyIndex.load(index_dir), manifest, get_embedder(manifest["embedder"], **embedder_kwargs))
+
+    @property
+    def size(self) -> int:
+        return self._index.size
+
+    async def search(self, query: str, k: int = 3, max_distance: Optional[float] = None) -> List[Snippet]:
+        """ Top-k chunks for `query`; angular distance runs 0 (same direction) to 2 (opposite) """
+        if max_distance is None:
+            max_distance = self.embedder.max_distance
+        vector = (await self.embedder.aembed([query]))[0]
+        # annoy is C++ and sub-millisecond at this size, no need to leave the loop
+        results = [r for r in self._index.query(vector, k) if r.distance <= max_distance]
+        if self.embedder.min_shared_terms:
+            terms = content_terms(query)
+            results = [r for r in results if len(terms & content_terms(r.userdata["text"])) >= self.embedder.min_shared_terms]
+        return [Snippet(r.userdata["section"], r.userdata["text"], r.distance) for r in results]
+
+
+def format_snippets(snippets: Sequence[Snippet]) -> str:
+    return (
+        "Reference material for the student's question, from the source text. Ground your answer in it, "
+        "but keep it conversational and don't read it out:\n"
+        + "\n".join(f"- (section {snippet.section + 1}) {snippet.text}" for snippet in snippets)
+    )
+
+
+async def retrieve(index: Optional[MaterialIndex], query: str, k: int = 3, timeout: float = 0.5) -> Optional[str]:
+    """ The ephemeral system message for `query`, or None (no index, not a question, nothing close, too slow) """
+    if index is None or not query or not looks_like_question(query):
+        return None
+    try:
+        snippets = await asyncio.wait_for(index.search(query, k), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"Retrieval took longer than {timeout}s, answering without it")
+        return None
+    except Exception as e:
+        logger.warning(f"Retrieval failed, answering without it: {e!r}")
+        return None
+    if not snippets:
+        return None
+    logger.info(f"Retrieved {len(snippets)} snippets from sections {sorted({s.section + 1 for s in snippets})}")
+    return format_snippets(snippets)
@@ -0,0 +1,102 @@
+import time
+import asyncio
+import logging
+import statistics
+from collections import deque
+from typing import Any, Awaitable, Callable, Coroutine, List, Optional
+
+logger = logging.getLogger("philosophy-tutor")
+
+
+class ContinuationScheduler:
+    """
+    Holds at most one pending "keep lecturing" continuation for user-led mode. Scheduling
+    replaces whatever was pending, and user speech (VAD start of speech) cancels it on the
+    spot. The pause before continuing is derived from live signals instead of a constant:
+
+    - base: the student's recent end-of-utterance delays (how long the EOU/endpointing
+      takes to decide they're done), never below `min_pause`
+    - recency: if the student stopped talking only a moment ago they may be mid-thought,
+      so up to `max_pause` right after their speech, decaying over `recent_window` seconds
+    - interruptions: students who keep cutting in get `interrupt_step` more per recent
+      interruption, so we leave room for them
+
+    `spawn(coro, name)` starts the pending task, e.g. a TaskSupervisor's (supervisor.py).
+    """
+
+    def __init__(self, min_pause: float = 0.5, max_pause: float = 2.0, recent_window: float = 8.0,
+                 interrupt_step: float = 0.25, interrupt_window: float = 120.0,
+                 spawn: Optional[Callable[[Coroutine[Any, Any, None], str], asyncio.Task]] = None):
+        self.spawn = spawn or (lambda coro, name: asyncio.create_task(coro, name=name))
+        self.min_pause = min_pause
+        self.max_pause = max_pause
+        self.recent_window = recent_window
+        self.interrupt_step = interrupt_step
+        self.interrupt_window = interrupt_window
+
+        self._task: Optional[asyncio.Task] = None
+        self._last_user_speech_end: Optional[float] = None
+        self._interruptions: "deque[float]" = deque(maxlen=16)
+        self._eou_delays: "deque[float]" = deque(maxlen=16)
+
+        self.pauses: List[float] = []
+        self.cancelled = 0
+
+    def on_user_started_speaking(self):
+        self.cancel("user started speaking")
+
+    def on_user_stopped_speaking(self):
+        self._last_user_speech_end = time.monotonic()
+
+    def on_interruption(self):
+        self._interruptions.append(time.monotonic())
+
+    def on_eou_delay(self, delay: float):
+        self._eou_delays.append(delay)
+
+    def choose_pause(self) -> float:
+        now = time.monotonic()
+        base = max(self.min_pause, statistics.median(self._eou_delays)) if self._eou_delays else self.min_pause
+
+        recency = 0.0
+        if self._last_user_speech_end is not None:
+            elapsed = now - self._last_user_speech_end
+            if elapsed < self.recent_window:
+                recency = max(0.0, self.max_pause - base) * (1 - elapsed / self.recent_window)
+
+        recent_interruptions = sum(1 for t in self._interruptions if now - t < self.interrupt_window)
+        pause = min(self.max_pause, base + recency + self.interrupt_step * recent_interruptions)
+        logger.info(f"Continuation pause {pause:.2f}s (base {base:.2f}s, recency {recency:.2f}s, {recent_interruptions} recent interruptions)")
+        return pause
+
+    def schedule(self, callback: Callable[[], Awaitable[None]]):
+        self.cancel("rescheduled")
+        pause = self.choose_pause()
+        self.pauses.append(pause)
+        self._task = self.spawn(self._run(pause, callback), "continuation")
+
+    def cancel(self, reason: str):
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            self.cancelled += 1
+            logger.info(f"Pending continuation cancelled ({reason})")
+
+    async def aclose(self):
+        self.cancel("session ended")
+        if self.pauses:
+            logger.info(f"Continuation pauses: median {statistics.median(self.pauses):.2f}s over {len(self.pauses)}, {self.cancelled} cancelled")
+
+    @property
+    def pending(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _run(self, pause: float, callback: Callable[[], Awaitable[None]]):
+        try:
+            await asyncio.sleep(pause)
+        except asyncio.CancelledError:
+            logger.info("Delayed continue task cancelled")
+            raise
+        # past this point the continuation is committed, it isn't cancelled halfway through a transition
+        self._task = None
+        await callback()
@@ -0,0 +1,220 @@
+"""
+Session snapshots, so a student whose connection drops (or whose job restarts) picks up
+where they were instead of at the welcome message and section 0.
+
+A snapshot is the tutor's state plus the last few turns of the conversation, as one small
+JSON file per (room, participant). It's written on every section transition and once
+more at shutdown, and deleted when the material is completed. On restore the chat
+context is rebuilt from it (system prompt, the recent turns, the current section) rather
+than replayed, the compactor adds the summary of finished sections as it always does.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, List, Optional
+from urllib.parse import quote
+
+from livekit.agents import llm
+
+from telemetry import HistogramSet
+from tokens import message_text
+
+logger = logging.getLogger("philosophy-tutor")
+
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_VERSION = 1
+MAX_AGE = 6 * 3600 # older than this the student is better off starting over
+RECENT_MESSAGES = 6
+RECENT_CHARS = 600
+
+
+def recent_messages(chat_ctx: llm.ChatContext, limit: int = RECENT_MESSAGES, max_chars: int = RECENT_CHARS) -> List[dict]:
+    """ The last `limit` user/assistant turns with text, clipped """
+    recent = []
+    for msg in reversed(chat_ctx.messages):
+        if len(recent) >= limit:
+            break
+        if msg.role not in ("user", "assistant"):
+            continue
+        text = message_text(msg).strip()
+        if text:
+            recent.append({"role": msg.role, "text": text[:max_chars]})
+    return recent[::-1]
+
+
+class SessionSnapshot:
+    def __init__(self, room: str, participant: str, mode: str, material_id: str, fingerprint: str,
+                 current_section: int, pending_check: bool, hand_raised: bool, confirmed: bool,
+                 recent: List[dict], saved_at: Optional[float] = None, version: int = SNAPSHOT_VERSION):
+        self.room = room
+        self.participant = participant
+        self.mode = mode
+        self.material_id = material_id
+        self.fingerprint = fingerprint
+        self.current_section = current_section
+        self.pending_check = pending_check
+        self.hand_raised = hand_raised
+        self.confirmed = confirmed
+        self.recent = recent
+        self.saved_at = saved_at if saved_at is not None else time.time()
+        self.version = version
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionSnapshot":
+        return cls(**data)
+
+    def recent_chat_messages(self) -> List[llm.ChatMessage]:
+        return [llm.ChatMessage.create(text=m["text"], role=m["role"]) for m in self.recent]
+
+
+class SnapshotStore:
+    """ Process-wide, kept in proc.userdata. Files are small, reads and writes still go through a thread """
+
+    def __init__(self, root: str = SNAPSHOT_DIR, max_age: float = MAX_AGE):
+        self.root = root
+        self.max_age = max_age
+        self.histograms = HistogramSet()
+        self.saved = 0
+        self.restored = 0
+        self.rejected = 0
+        self.discarded = 0
+
+    def path(self, room: str, participant: str) -> str:
+        return os.path.join(self.root, quote(room, safe=""), f"{quote(participant, safe='')}.json")
+
+    def _write(self, snapshot: SessionSnapshot) -> int:
+        path = self.path(snapshot.room, snapshot.participant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(snapshot.to_dict(), separators=(",", ":")).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def _read(self, room: str, participant: str) -> Optional[bytes]:
+        try:
+            with open(self.path(room, participant), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, room: str, participant: str):
+        try:
+            os.remove(self.path(room, participant))
+        except FileNotFoundError:
+            pass
+
+    async def save(self, snapshot: SessionSnapshot):
+        started = time.perf_counter()
+        try:
+            size = await asyncio.to_thread(self._write, snapshot)
+        except OSError as e:
+            logger.error(f"Failed to save session snapshot: {e}")
+            return
+        self.saved += 1
+        self.histograms.add("snapshot_bytes", size)
+        self.histograms.add("write_ms", (time.perf_counter() - started) * 1000)
+        logger.info(f"Saved snapshot of {snapshot.room}/{snapshot.participant} at section {snapshot.current_section} ({size} bytes)")
+
+    async def load(self, room: str, participant: str, fingerprint: str) -> Optional[SessionSnapshot]:
+        """ The participant's snapshot for this room, if there's one that still applies """
+        try:
+            data = await asyncio.to_thread(self._read, room, participant)
+            if data is None:
+                return None
+            snapshot = SessionSnapshot.from_dict(json.loads(data))
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable snapshot for {room}/{participant}: {e!r}")
+            self.rejected += 1
+            return None
+
+        if snapshot.version != SNAPSHOT_VERSION or snapshot.fingerprint != fingerprint:
+            reason = "the material changed" if snapshot.fingerprint != fingerprint else "it's from another version"
+        elif time.time() - snapshot.saved_at > self.max_age:
+            reason = "it's too old"
+        else:
+            self.histograms.add("snapshot_bytes", len(data))
+            return snapshot
+        logger.info(f"Not resuming {room}/{participant} from its snapshot, {reason}")
+        self.rejected += 1
+        return None
+
+    def record_restore(self, seconds: float):
+        self.restored += 1
+        self.histograms.add("restore_ms", seconds * 1000)
+
+    async def discard(self, room: str, participant: str):
+        try:
+            await asyncio.to_thread(self._remove, room, participant)
+        except OSError as e:
+            logger.error(f"Failed to remove session snapshot: {e}")
+            return
+        self.discarded += 1
+
+    def stats(self) -> dict:
+        return {
+            "saved": self.saved,
+            "restored": self.restored,
+            "rejected": self.rejected,
+            "discarded": self.discarded,
+            **self.histograms.summary(),
+        }
+
+
+class SessionSnapshotter:
+    """
+    One session's writer. save() is sync so it can be called from the tutor's transitions;
+    writes happen in order in a background task, and only the newest pending snapshot is
+    written if they come faster than the disk.
+    `spawn(coro, name)` starts the background task, e.g. a TaskSupervisor's (supervisor.py).
+    """
+
+    def __init__(self, store: SnapshotStore, room: str, participant: str,
+                 spawn: Optional[Callable[[Coroutine[Any, Any, None], str], asyncio.Task]] = None):
+        self.store = store
+        self.room = room
+        self.participant = participant
+        self.spawn = spawn or (lambda coro, name: asyncio.create_task(coro, name=name))
+        self._latest: Optional[SessionSnapshot] = None
+        self._discard = False
+        self._removed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def save(self, snapshot: SessionSnapshot):
+        if self._discard:
+            return
+        self._latest = snapshot
+        self._kick()
+
+    def discard(self):
+        """ The lesson is over, the next join starts from the beginning """
+        self._discard = True
+        self._latest = None
+        self._kick()
+
+    def _kick(self):
+        if self._task is None or self._task.done():
+            self._task = self.spawn(self._run(), "snapshot")
+
+    async def _run(self):
+        while self._latest is not None:
+            snapshot, self._latest = self._latest, None
+            await self.store.save(snapshot)
+        if self._discard and not self._removed:
+            self._removed = True
+            await self.store.discard(self.room, self.participant)
+
+    async def aclose(self, final: Optional[SessionSnapshot] = None):
+        if self._task is not None:
+            # done or cancelled, either way the writes left are done here
+            await asyncio.wait((self._task,))
+        if final is not None and not self._discard:
+            self._latest = final
+        # awaited here rather than spawned, the session's tasks may already be cancelled
+        await self._run()
@@ -0,0 +1,70 @@
+"""
+Tiny local stand-in for the OpenAI chat completions endpoint, so distill.py can be
+timed without spending tokens:
+
+    python stub_openai.py --latency 1.5 --fail-rate 0.1 &
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python distill.py --serial
+    OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python distill.py --concurrency 16
+"""
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 1.0
+    fail_rate = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+
+        if random.random() < self.fail_rate:
+            return self._reply(503, {"error": {"message": "stub overloaded", "type": "server_error"}})
+
+        if not self.path.endswith("/chat/completions"):
+            return self._reply(404, {"error": {"message": f"no stub for {self.path}", "type": "invalid_request_error"}})
+
+        paragraph = body["messages"][-1]["content"]
+        return self._reply(200, {
+            "id": f"chatcmpl-stub-{random.getrandbits(32):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"(stub) {paragraph[:200]}"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": len(paragraph) // 4, "completion_tokens": 50, "total_tokens": len(paragraph) // 4 + 50},
+        })
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # quiet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI chat completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.fail_rate = args.fail_rate
+    print(f"Stub OpenAI listening on http://{args.host}:{args.port}/v1")
+    ThreadingHTTPServer((args.host, args.port), StubHandler).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Session task supervision and event loop health.
+
+TaskSupervisor owns a session's background tasks (the hand raise reply, the strawberry
+packet, continuations, prefetch TTS, ...): it keeps a reference to each, logs their
+exceptions instead of leaving them to "Task exception was never retrieved", and cancels
+whatever is still running when the session ends.
+
+LoopLagMonitor measures how late the event loop wakes up (one sampler per loop, shared
+by the sessions on it) and times the session's callbacks. For coroutines it times every
+step between two awaits, which is what actually holds the loop, not the wall time spent
+waiting on the network. Anything over the threshold is logged as slow.
+
+Both report into the process-wide WorkerHealth, which appends a record per session to
+metrics/health.jsonl like telemetry.py does for latency.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from telemetry import HistogramSet, append_jsonl
+
+logger = logging.getLogger("philosophy-tutor")
+
+HEALTH_LOG = "metrics/health.jsonl"
+
+
+class WorkerHealth:
+    """ Per-process aggregate of every session's tasks and callbacks, kept in proc.userdata """
+
+    def __init__(self, path: str = HEALTH_LOG):
+        self.path = path
+        self.histograms = HistogramSet() # milliseconds
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock() # jobs on the thread executor share it
+        self._samplers: Dict[asyncio.AbstractEventLoop, "_LagSampler"] = {}
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def acquire_sampler(self, interval: float, threshold: float) -> "_LagSampler":
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sampler = self._samplers.get(loop)
+            if sampler is None:
+                sampler = self._samplers[loop] = _LagSampler(self, interval, threshold)
+                sampler.start()
+            sampler.refs += 1
+            return sampler
+
+    def release_sampler(self, sampler: "_LagSampler"):
+        with self._lock:
+            sampler.refs -= 1
+            if sampler.refs == 0:
+                sampler.stop()
+                for loop, s in list(self._samplers.items()):
+                    if s is sampler:
+                        del self._samplers[loop]
+
+    def summary(self) -> dict:
+        return {"counters": dict(sorted(self.counters.items())), "histograms": self.histograms.summary()}
+
+    async def close_session(self, room_name: str, tasks: "TaskSupervisor", monitor: "LoopLagMonitor"):
+        """ Shutdown callback: cancels the session's leftovers and exports its record """
+        await tasks.aclose()
+        monitor.close()
+        record = {"type": "session_health", "room": room_name, "ts": time.time(), "tasks": tasks.stats(), **monitor.stats()}
+        logger.info(f"Session health: {record}")
+        try:
+            await asyncio.to_thread(append_jsonl, self.path, [record, {"type": "worker_health", "pid": os.getpid(), **self.summary()}])
+        except OSError as e:
+            logger.error(f"Failed to export health metrics: {e}")
+
+
+class TaskSupervisor:
+    def __init__(self, session: str, health: Optional[WorkerHealth] = None):
+        self.session = session
+        self.health = health or WorkerHealth()
+        self._tasks: Set[asyncio.Task] = set()
+        self._closed = False
+        self.started = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.cancelled_at_close = 0
+
+    def spawn(self, coro: Awaitable, name: str) -> asyncio.Task:
+        """ asyncio.create_task, but owned by the session """
+        task = asyncio.create_task(coro, name=f"{name}:{self.session}")
+        if self._closed:
+            # the session is going away, nothing new gets to outlive it
+            task.cancel()
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        self.started += 1
+        self.health.count("tasks_started")
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self.cancelled += 1
+            self.health.count("tasks_cancelled")
+            return
+        e = task.exception()
+        if e is not None:
+            self.failed += 1
+            self.health.count("tasks_failed")
+            logger.error(f"Task {task.get_name()} failed: {e!r}", exc_info=e)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def aclose(self, timeout: float = 2.0):
+        self._closed = True
+        tasks = [task for task in self._tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        self.cancelled_at_close = len(tasks)
+        if tasks:
+            logger.info(f"Cancelling {len(tasks)} tasks left by {self.session}: {[task.get_name() for task in tasks]}")
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                # swallowing the cancellation, the session is gone but these still hold the loop
+                self.health.count("tasks_leaked", len(pending))
+                logger.warning(f"{len(pending)} tasks of {self.session} ignored cancellation: {[task.get_name() for task in pending]}")
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "cancelled_at_close": self.cancelled_at_close,
+            "pending": self.pending,
+        }
+
+
+class _LagSampler:
+    """ Sleeps `interval` and measures how late it wakes up; one per event loop """
+
+    def __init__(self, health: WorkerHealth, interval: float, threshold: float):
+        self.health = health
+        self.interval = interval
+        self.threshold = threshold
+        self.refs = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="loop-lag")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.health.histograms.add("loop_lag", lag * 1000)
+            if lag > self.threshold:
+                self.health.count("loop_lag_over_threshold")
+                logger.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+
+
+class _TimedCoroutine:
+    """ Drives a coroutine, timing each step it runs on the loop between two awaits """
+
+    def __init__(self, coro, on_step: Callable[[float], None]):
+        self._coro = coro
+        self._on_step = on_step
+
+    def __await__(self):
+        coro = self._coro
+        send, error = None, None
+        while True:
+            started = time.perf_counter()
+            try:
+                yielded = coro.throw(error) if error is not None else coro.send(send)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self._on_step(time.perf_counter() - started)
+            try:
+                send, error = (yield yielded), None
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e: # cancellation included, the coroutine decides what to do with it
+                send, error = None, e
+
+
+class LoopLagMonitor:
+    """
+    Per session. timed(name, callback) wraps an event handler or a coroutine function so
+    its time on the loop goes to the `callback.<name>` histograms; the longest step of a
+    coroutine is what counts as its blocking time.
+    """
+
+    def __init__(self, session: str, health: Optional[WorkerHealth] = None, threshold: float = 0.1, interval: float = 0.05):
+        self.session = session
+        self.health = health or WorkerHealth()
+        self.threshold = threshold
+        self.interval = interval
+        self.histograms = HistogramSet() # this session's callbacks, milliseconds
+        self.slow: Dict[str, int] = {}
+        self._sampler: Optional[_LagSampler] = None
+
+    def start(self):
+        self._sampler = self.health.acquire_sampler(self.interval, self.threshold)
+
+    def record(self, name: str, seconds: float):
+        ms = seconds * 1000
+        self.histograms.add(name, ms)
+        self.health.histograms.add(f"callback.{name}", ms)
+        if seconds > self.threshold:
+            self.slow[name] = self.slow.get(name, 0) + 1
+            self.health.count("slow_callbacks")
+            logger.warning(f"{name} blocked the event loop for {ms:.0f}ms ({self.session})")
+
+    def timed(self, name: str, callback: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def timed_coroutine(*args, **kwargs):
+                longest = 0.0
+
+                def on_step(seconds: float):
+                    nonlocal longest
+                    longest = max(longest, seconds)
+
+                try:
+                    return await _TimedCoroutine(callback(*args, **kwargs), on_step)
+                finally:
+                    self.record(name, longest)
+            return timed_coroutine
+
+        # functools.wraps keeps the signature, EventEmitter passes as many args as it declares
+        @functools.wraps(callback)
+        def timed_callback(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - started)
+        return timed_callback
+
+    def close(self):
+        if self._sampler is not None:
+            self.health.release_sampler(self._sampler)
+            self._sampler = None
+
+    def stats(self) -> dict:
+        return {"callbacks_ms": self.histograms.summary(), "slow_callbacks": dict(self.slow)}
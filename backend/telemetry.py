@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("philosophy-tutor")
+
+LATENCY_LOG = "metrics/latency.jsonl"
+
+
+def _nearest_rank(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class Histogram:
+    """ Count/sum plus a bounded window of recent samples for percentiles """
+
+    def __init__(self, window: int = 4096):
+        self.count = 0
+        self.total = 0.0
+        self._samples: "deque[float]" = deque(maxlen=window)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        return _nearest_rank(sorted(self._samples), p)
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 2),
+            "p50": round(_nearest_rank(ordered, 50), 2),
+            "p95": round(_nearest_rank(ordered, 95), 2),
+            "p99": round(_nearest_rank(ordered, 99), 2),
+            "max": round(ordered[-1], 2),
+        }
+
+
+class HistogramSet:
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+
+    def add(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def summary(self) -> dict:
+        return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+
+def append_jsonl(path: str, records: List[dict]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+class WorkerLatency:
+    """ Per-process aggregate of every session's turns, kept in proc.userdata """
+
+    def __init__(self, path: str = LATENCY_LOG):
+        self.path = path
+        self.histograms = HistogramSet()
+        self.sessions = 0
+        self.prefetch: Dict[str, int] = {}
+
+    def add_prefetch(self, stats: dict):
+        for name in PREFETCH_COUNTERS:
+            self.prefetch[name] = self.prefetch.get(name, 0) + stats.get(name, 0)
+
+    def prefetch_summary(self) -> dict:
+        attempts = self.prefetch.get("hits", 0) + self.prefetch.get("misses", 0)
+        return {**self.prefetch, "hit_rate": self.prefetch.get("hits", 0) / attempts if attempts else 0.0}
+
+
+# summed over sessions, see prefetch.SectionPrefetcher.stats
+PREFETCH_COUNTERS = ("hits", "misses", "discarded", "wasted_tokens")
+# everything is in milliseconds except the token counts; the *_at fields are offsets from the start of the turn
+TURN_FIELDS = ("eou_delay", "enrichment", "retrieval", "llm_ttft", "tts_ttfb", "playback_start_at", "prompt_tokens", "cached_tokens")
+
+
+class TurnTimeline:
+    def __init__(self, index: int, trigger: str):
+        self.index = index
+        self.trigger = trigger # "user" (end of user speech) or "agent" (continuation, no user speech)
+        self.started = time.perf_counter()
+        self.values: Dict[str, float] = {}
+        self.llm_started = False
+
+    def set(self, name: str, value_ms: float):
+        self.values.setdefault(name, round(value_ms, 2))
+
+    def since_start_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    @property
+    def complete(self) -> bool:
+        return all(name in self.values for name in ("llm_ttft", "tts_ttfb", "playback_start_at"))
+
+
+class LatencyRecorder:
+    """
+    Per-session turn timeline, fed from the VoicePipelineAgent events entrypoint already
+    listens to plus the before_llm_cb wrapper:
+
+        user_stopped_speaking  -> turn starts
+        before_llm             -> enrichment and retrieval time
+        metrics_collected      -> EOU delay, LLM first token, TTS first byte
+        agent_started_speaking -> playback start, and a section transition's latency
+        prompts.PromptUsage    -> prompt tokens, and how many were a cache hit
+
+    Finished turns go to per-session and per-worker histograms and are appended to a
+    JSONL file (off the event loop) when the session ends, with the session's prefetch
+    stats in its summary record.
+    """
+
+    def __init__(self, room_name: str, worker: Optional[WorkerLatency] = None):
+        self.room_name = room_name
+        self.worker = worker or WorkerLatency()
+        self.histograms = HistogramSet()
+        self._turn: Optional[TurnTimeline] = None
+        self._turns = 0
+        self._records: List[dict] = []
+        self.worker.sessions += 1
+
+    def on_user_stopped_speaking(self):
+        # the student may pause and carry on, the last end of speech before the reply counts
+        if self._turn is not None and not self._turn.llm_started:
+            self._turn.started = time.perf_counter()
+            return
+        self._start_turn("user")
+
+    def on_llm_started(self):
+        if self._turn is None or self._turn.llm_started:
+            self._start_turn("agent")
+        self._turn.llm_started = True
+
+    def record_enrichment(self, seconds: float):
+        if self._turn is not None:
+            self._turn.set("enrichment", seconds * 1000)
+
+    def record_retrieval(self, seconds: float):
+        if self._turn is not None:
+            self._turn.set("retrieval", seconds * 1000)
+
+    def record_prompt_usage(self, prompt_tokens: int, cached_tokens: int):
+        """ Comes with the last chunk of the completion, usually after the turn was already finished """
+        values = {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+        if self._turn is not None and self._turn.llm_started:
+            self._turn.values.update(values)
+        elif self._records and self._records[-1]["prompt_tokens"] is None:
+            self._records[-1].update(values)
+            for name, value in values.items():
+                self.histograms.add(name, value)
+                self.worker.histograms.add(name, value)
+
+    def on_metrics(self, m):
+        # imported here so this module stays usable without livekit (e.g. for offline analysis)
+        from livekit.agents import metrics
+
+        if self._turn is None:
+            return
+        if isinstance(m, metrics.PipelineEOUMetrics):
+            self._turn.set("eou_delay", m.end_of_utterance_delay * 1000)
+        elif isinstance(m, metrics.PipelineLLMMetrics) and m.ttft >= 0:
+            self._turn.set("llm_ttft", m.ttft * 1000)
+        elif isinstance(m, metrics.PipelineTTSMetrics) and m.ttfb >= 0:
+            self._turn.set("tts_ttfb", m.ttfb * 1000)
+        self._maybe_finish()
+
+    def on_agent_started_speaking(self):
+        if self._turn is not None and self._turn.llm_started:
+            self._turn.set("playback_start_at", self._turn.since_start_ms())
+            self._maybe_finish()
+
+    def record_section_transition(self, seconds: float):
+        """ Section change to the first word of the new section's reply (see prefetch.py) """
+        self.histograms.add("section_transition", seconds * 1000)
+        self.worker.histograms.add("section_transition", seconds * 1000)
+
+    def summary(self) -> dict:
+        return self.histograms.summary()
+
+    async def aclose(self, prefetch: Optional[dict] = None):
+        self._finish()
+        summary = {"type": "session_summary", "room": self.room_name, "turns": self._turns, "histograms": self.summary()}
+        worker_summary = {"type": "worker_summary", "pid": os.getpid(), "sessions": self.worker.sessions, "histograms": self.worker.histograms.summary()}
+        if prefetch is not None:
+            self.worker.add_prefetch(prefetch)
+            summary["prefetch"] = prefetch
+            worker_summary["prefetch"] = self.worker.prefetch_summary()
+        logger.info(f"Session latency (ms): {summary['histograms']}")
+        try:
+            await asyncio.to_thread(append_jsonl, self.worker.path, self._records + [summary, worker_summary])
+        except OSError as e:
+            logger.error(f"Failed to export latency metrics: {e}")
+        self._records = []
+
+    def _start_turn(self, trigger: str):
+        self._finish()
+        self._turns += 1
+        self._turn = TurnTimeline(self._turns, trigger)
+
+    def _maybe_finish(self):
+        if self._turn is not None and self._turn.complete:
+            self._finish()
+
+    def _finish(self):
+        turn, self._turn = self._turn, None
+        if turn is None or not turn.llm_started:
+            return
+        for name, value in turn.values.items():
+            self.histograms.add(name, value)
+            self.worker.histograms.add(name, value)
+        self._records.append({
+            "type": "turn",
+            "room": self.room_name,
+            "turn": turn.index,
+            "trigger": turn.trigger,
+            "ts": time.time(),
+            **{name: turn.values.get(name) for name in TURN_FIELDS},
+        })
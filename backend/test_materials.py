@@ -0,0 +1,28 @@
+import os
+
+from materials import DEFAULT_MATERIAL, MATERIALS_DIR, MaterialRegistry, get_material_from_roomname
+
+
+def write_summary(path, sections):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# Summary" + "".join(f"\n\n#### Section\n\n{section}" for section in sections))
+
+
+def test_unknown_material_falls_back_to_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_summary("summary.md", ["Thales of Miletus.", "Pythagoras."])
+    registry = MaterialRegistry()
+
+    material_id = registry.resolve(get_material_from_roomname("CIRCLE-MATERIAL-nosuchchapter-1234"))
+
+    assert material_id == DEFAULT_MATERIAL
+    assert registry.get(material_id) == ("Thales of Miletus.", "Pythagoras.")
+
+
+def test_known_material_is_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_summary("summary.md", ["Thales of Miletus."])
+    write_summary(os.path.join(MATERIALS_DIR, "chapter2", "summary.md"), ["Wilfrid Sellars."])
+
+    assert MaterialRegistry().resolve("chapter2") == "chapter2"
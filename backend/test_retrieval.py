@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+from distill import get_raw_data
+from retrieval import HashingEmbedder, MaterialIndex, build_index, retrieve
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("index"))
+    build_index(get_raw_data("material.md"), HashingEmbedder(), index_dir)
+    return MaterialIndex.load(index_dir)
+
+
+def test_question_about_the_material_gets_snippets(index):
+    context = asyncio.run(retrieve(index, "What did Thales say about water?"))
+
+    assert context is not None
+    assert "(section 7)" in context
+
+
+@pytest.mark.parametrize("question", ["tell me about the weather in Paris", "how do I cook pasta?", "what's your favourite football team?"])
+def test_off_topic_question_gets_no_snippets(index, question):
+    assert asyncio.run(retrieve(index, question)) is None
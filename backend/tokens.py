@@ -0,0 +1,48 @@
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # not loaded at import, it's a few hundred ms (and a download on a cold cache); the worker loads it in prewarm
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception: # not installed (or no encoding files offline), fall back to the usual ~4 chars per token
+            _encoding = None
+    return _encoding
+
+
+def load_encoding() -> bool:
+    """ For prewarm: loads the encoding off the event loop, so the first before_llm doesn't. False when falling back """
+    return _get_encoding() is not None
+
+# per-message framing overhead in the chat format (role, separators)
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def message_text(message) -> str:
+    """ ChatMessage.content can be a string, a list of strings/images, or None """
+    content = message.content
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(item for item in content if isinstance(item, str))
+    return str(content)
+
+
+def message_tokens(message) -> int:
+    return estimate_tokens(message_text(message)) + MESSAGE_OVERHEAD
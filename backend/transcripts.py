@@ -0,0 +1,138 @@
+import json
+import time
+import asyncio
+import datetime
+import logging
+from typing import List, Optional
+
+from aiofile import async_open
+
+logger = logging.getLogger("philosophy-tutor")
+
+FSYNC_POLICIES = ("never", "batch", "close")
+FORMATS = ("text", "jsonl", "both")
+
+
+class TranscriptWriter:
+    """
+    Per-session transcript writer that keeps file I/O off the voice loop. write() only
+    queues a record; a background task flushes the queue through aiofile once it holds
+    `max_batch` records or `flush_interval` seconds have passed.
+
+    fsync: "never", "batch" (after every flush) or "close" (once, on shutdown).
+    fmt: "text" (the original transcript_*.txt layout), "jsonl" (a sibling .jsonl file
+    with monotonic timestamps), or "both".
+    """
+
+    def __init__(self, path: str, room_name: str, mode: str, *, fmt: str = "text",
+                 max_batch: int = 32, flush_interval: float = 1.0, fsync: str = "close"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Invalid transcript format: {fmt}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync}")
+
+        self.path = path
+        self.jsonl_path = path.rsplit(".", 1)[0] + ".jsonl"
+        self.room_name = room_name
+        self.mode = mode
+        self.fmt = fmt
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._pending: List[tuple] = []
+        self._wake = asyncio.Event()
+        self._closed = False
+        self._files = []
+        self._text_file = None
+        self._jsonl_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.monotonic()
+
+        self.records_written = 0
+        self.flushes = 0
+
+    async def start(self):
+        if self.fmt in ("text", "both"):
+            self._text_file = await self._open(self.path)
+        if self.fmt in ("jsonl", "both"):
+            self._jsonl_file = await self._open(self.jsonl_path)
+
+        now = datetime.datetime.now()
+        if self._text_file is not None:
+            await self._text_file.write(
+                f"Transcript for room: {self.room_name}\n"
+                f"Mode: {self.mode}\n"
+                f"Date: {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
+                + "-" * 50 + "\n\n"
+            )
+        if self._jsonl_file is not None:
+            await self._jsonl_file.write(json.dumps({
+                "type": "header", "room": self.room_name, "mode": self.mode, "date": now.isoformat(timespec="seconds"),
+            }) + "\n")
+
+        self._task = asyncio.create_task(self._run(), name=f"transcript-writer:{self.room_name}")
+
+    def write(self, speaker: str, text: str):
+        """ Never blocks, safe to call from any event callback """
+        if self._closed:
+            logger.warning(f"Transcript already closed, dropping line from {speaker}")
+            return
+        self._pending.append((time.monotonic() - self._started_at, datetime.datetime.now(), speaker, str(text)))
+        if len(self._pending) >= self.max_batch:
+            self._wake.set()
+
+    async def aclose(self):
+        """ Flushes everything still queued, registered as a job shutdown callback """
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+        await self._flush(fsync=self.fsync != "never")
+        for afp in self._files:
+            await afp.close()
+        logger.info(f"Transcript closed ({self.records_written} records in {self.flushes} flushes)")
+
+    async def _open(self, path):
+        afp = async_open(path, "a", encoding="utf-8")
+        await afp.file.open()
+        self._files.append(afp)
+        return afp
+
+    async def _run(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._closed and self._pending:
+                await self._flush(fsync=self.fsync == "batch")
+
+    async def _flush(self, fsync: bool = False):
+        """ Writes the queued records; an empty queue only fsyncs (the "close" policy at shutdown) """
+        if not self._pending and not fsync:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            if self._text_file is not None and batch:
+                await self._text_file.write("".join(
+                    f"[{wall.strftime('%H:%M:%S')}] {speaker}: {text}\n" for _, wall, speaker, text in batch
+                ))
+            if self._jsonl_file is not None and batch:
+                await self._jsonl_file.write("".join(
+                    json.dumps({"t": round(t, 3), "time": wall.isoformat(timespec="milliseconds"), "speaker": speaker, "text": text}) + "\n"
+                    for t, wall, speaker, text in batch
+                ))
+            if fsync:
+                for afp in self._files:
+                    await afp.file.fsync()
+            if batch:
+                self.records_written += len(batch)
+                self.flushes += 1
+        except Exception as e:
+            # back in front of whatever was written meanwhile, the next flush retries it
+            self._pending[:0] = batch
+            logger.error(f"Failed to save transcript, {len(batch)} records kept for the next flush: {e}")
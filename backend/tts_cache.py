@@ -0,0 +1,252 @@
+"""
+Synthesized audio cache for lines the agent says word for word (welcomes, progress
+lines, the hand-raise prompt, ...). Audio is cached per sentence, the same unit the
+pipeline's StreamAdapter hands to TTS.synthesize, so a cached welcome message replays
+without a single TTS request.
+
+    python tts_cache.py    # synthesize the fixed lines into tts_cache/ ahead of time
+"""
+import os
+import struct
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from livekit import rtc
+from livekit.agents import DEFAULT_API_CONNECT_OPTIONS, APIConnectOptions, tokenize, tts, utils
+
+logger = logging.getLogger("philosophy-tutor")
+
+CACHE_DIR = "tts_cache"
+_HEADER = struct.Struct("<II") # sample_rate, num_channels
+
+# the pipeline wraps non-streaming TTS in a StreamAdapter with this tokenizer
+_sentence_tokenizer = tokenize.basic.SentenceTokenizer()
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _sentence_tokenizer.tokenize(text) if sentence.strip()]
+
+
+def tts_cache_key(tts_: tts.TTS) -> str:
+    """ Voice and model of the wrapped TTS, part of every cache key """
+    opts = getattr(tts_, "_opts", None)
+    return f"{type(tts_).__module__}:{getattr(opts, 'model', '')}:{getattr(opts, 'voice', '')}:{getattr(opts, 'speed', '')}"
+
+
+class _Audio:
+    def __init__(self, data: bytes, sample_rate: int, num_channels: int):
+        self.data = data
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+
+
+class AudioCache:
+    """
+    Process-wide store of synthesized sentences. Fixed lines are pinned (and persisted to
+    `cache_dir`); everything else goes through a byte-bounded in-memory LRU.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = 32 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._pinned: Dict[str, _Audio] = {}
+        self._lru: "OrderedDict[str, _Audio]" = OrderedDict()
+        self._lru_bytes = 0
+        self._prime_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {} # shared by jobs on different loops
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(tts_key: str, sentence: str) -> str:
+        return hashlib.sha256(f"{tts_key}\0{sentence}".encode("utf-8")).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._pinned or key in self._lru
+
+    def get(self, key: str) -> Optional[_Audio]:
+        audio = self._pinned.get(key)
+        if audio is None:
+            audio = self._lru.get(key)
+            if audio is not None:
+                self._lru.move_to_end(key)
+        if audio is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return audio
+
+    def put(self, key: str, audio: _Audio, pinned: bool = False):
+        if pinned:
+            self._pinned[key] = audio
+            self._persist(key, audio)
+            return
+        if key in self._pinned:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._lru_bytes -= len(old.data)
+        self._lru[key] = audio
+        self._lru_bytes += len(audio.data)
+        while self._lru_bytes > self.max_bytes and self._lru:
+            _, evicted = self._lru.popitem(last=False)
+            self._lru_bytes -= len(evicted.data)
+
+    def load_pinned(self, tts_key: str, texts: Iterable[str]) -> List[str]:
+        """ Loads fixed lines from disk (once per process, in prewarm), returns the sentences that still need synthesizing """
+        missing = []
+        for text in texts:
+            for sentence in split_sentences(text):
+                key = self.key(tts_key, sentence)
+                if key in self._pinned:
+                    continue
+                path = os.path.join(self.cache_dir, f"{key}.pcm")
+                try:
+                    with open(path, "rb") as f:
+                        sample_rate, num_channels = _HEADER.unpack(f.read(_HEADER.size))
+                        self._pinned[key] = _Audio(f.read(), sample_rate, num_channels)
+                except (OSError, struct.error):
+                    missing.append(sentence)
+        return missing
+
+    def missing_pinned(self, tts_key: str, texts: Iterable[str]) -> List[str]:
+        """ The sentences of `texts` that aren't pinned yet, without touching the disk """
+        return [sentence for text in texts for sentence in split_sentences(text) if self.key(tts_key, sentence) not in self._pinned]
+
+    def prime_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._prime_locks.get(loop)
+        if lock is None:
+            lock = self._prime_locks[loop] = asyncio.Lock()
+        return lock
+
+    def stats(self) -> dict:
+        return {
+            "pinned": len(self._pinned),
+            "lru": len(self._lru),
+            "lru_bytes": self._lru_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _persist(self, key: str, audio: _Audio):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = os.path.join(self.cache_dir, f"{key}.pcm.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(audio.sample_rate, audio.num_channels))
+                f.write(audio.data)
+            os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.pcm"))
+        except OSError as e:
+            logger.warning(f"Could not persist cached TTS audio: {e}")
+
+
+class _CachedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: "CachedTTS", input_text: str, audio: _Audio, conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._audio = audio
+
+    async def _run(self):
+        request_id = utils.shortuuid("ttscache_")
+        bstream = utils.audio.AudioByteStream(
+            sample_rate=self._audio.sample_rate,
+            num_channels=self._audio.num_channels,
+            samples_per_channel=self._audio.sample_rate // 10, # 100ms frames
+        )
+        for frame in bstream.write(self._audio.data) + bstream.flush():
+            self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+
+
+class _RecordingChunkedStream(tts.ChunkedStream):
+    """ Passes the wrapped TTS's frames through and stores them once the sentence is complete """
+
+    def __init__(self, *, tts: "CachedTTS", input_text: str, inner: tts.ChunkedStream, key: str, pinned: bool,
+                 conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._inner = inner
+        self._key = key
+        self._pinned = pinned
+
+    async def _run(self):
+        frames: List[rtc.AudioFrame] = []
+        try:
+            async for ev in self._inner:
+                frames.append(ev.frame)
+                self._event_ch.send_nowait(ev)
+        finally:
+            await self._inner.aclose()
+
+        if frames:
+            frame = rtc.combine_audio_frames(frames)
+            self._tts.audio_cache.put(self._key, _Audio(bytes(frame.data), frame.sample_rate, frame.num_channels), pinned=self._pinned)
+
+
+class CachedTTS(tts.TTS):
+    """ Wraps a non-streaming TTS, serving sentences it has already synthesized from an AudioCache """
+
+    def __init__(self, wrapped: tts.TTS, audio_cache: AudioCache):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=wrapped.sample_rate,
+            num_channels=wrapped.num_channels,
+        )
+        self._wrapped = wrapped
+        self._tts_key = tts_cache_key(wrapped)
+        self.audio_cache = audio_cache
+
+    def synthesize(self, text: str, *, conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS, pinned: bool = False) -> tts.ChunkedStream:
+        sentence = text.strip()
+        key = self.audio_cache.key(self._tts_key, sentence)
+        audio = self.audio_cache.get(key)
+        if audio is not None:
+            return _CachedChunkedStream(tts=self, input_text=text, audio=audio, conn_options=conn_options)
+        inner = self._wrapped.synthesize(text, conn_options=conn_options)
+        return _RecordingChunkedStream(tts=self, input_text=text, inner=inner, key=key, pinned=pinned, conn_options=conn_options)
+
+    def load_pinned(self, texts: Iterable[str]) -> List[str]:
+        return self.audio_cache.load_pinned(self._tts_key, texts)
+
+    def missing_pinned(self, texts: Iterable[str]) -> List[str]:
+        return self.audio_cache.missing_pinned(self._tts_key, texts)
+
+    async def prime(self, texts: Iterable[str], pinned: bool = False):
+        """ Synthesizes every sentence of `texts` that isn't cached yet """
+        texts = list(texts)
+        async with self.audio_cache.prime_lock():
+            if pinned:
+                # another process may have synthesized them since this one's prewarm; off the loop, sessions are running
+                await asyncio.to_thread(self.audio_cache.load_pinned, self._tts_key, texts)
+            for text in texts:
+                for sentence in split_sentences(text):
+                    if self.audio_cache.key(self._tts_key, sentence) in self.audio_cache:
+                        continue
+                    stream = self.synthesize(sentence, pinned=pinned)
+                    try:
+                        async for _ in stream:
+                            pass
+                    finally:
+                        await stream.aclose()
+
+    async def aclose(self):
+        # the StreamAdapter closes its TTS after every reply, the wrapped one is long-lived
+        pass
+
+
+def main():
+    from livekit.plugins import openai
+    from main import FIXED_UTTERANCES
+
+    async def prime():
+        cached_tts = CachedTTS(openai.TTS(), AudioCache())
+        missing = cached_tts.load_pinned(FIXED_UTTERANCES)
+        logger.info(f"{len(missing)} fixed sentences to synthesize")
+        await cached_tts.prime(missing, pinned=True)
+        logger.info(f"TTS cache: {cached_tts.audio_cache.stats()}")
+
+    asyncio.run(prime())
+
+if __name__ == "__main__":
+    main()
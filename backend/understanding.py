@@ -0,0 +1,127 @@
+import re
+import logging
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from livekit.agents import llm
+
+from tokens import message_text
+
+logger = logging.getLogger("philosophy-tutor")
+
+# "You seem to understand this section, shall we continue?" -- same loose match as before,
+# any order, case-insensitive, but compiled once instead of lowercasing every message
+_YOU = re.compile("you", re.I)
+_SEEM = re.compile("seem", re.I)
+_UNDERSTAND = re.compile("understood|understand|grasp", re.I)
+
+
+def is_confirmation(text: str) -> bool:
+    return bool(text) and _YOU.search(text) is not None and _SEEM.search(text) is not None and _UNDERSTAND.search(text) is not None
+
+
+class UnderstandingEvaluator:
+    """ Decides whether the student has understood the current section, given the tracker state """
+
+    # verdicts of expensive evaluators are cached per user turn
+    cacheable = False
+
+    async def evaluate(self, tracker: "UnderstandingTracker", chat_ctx: llm.ChatContext, section: str) -> bool:
+        raise NotImplementedError
+
+
+class PhraseEvaluator(UnderstandingEvaluator):
+    """ The tutor LLM grades the student itself and says the confirmation phrase verbatim; we just listen for it """
+
+    async def evaluate(self, tracker, chat_ctx, section):
+        if tracker.confirmed:
+            return True
+        # a reply that is still playing is only in the copied context, it isn't committed yet
+        msgs = chat_ctx.messages
+        return len(msgs) >= 2 and msgs[-2].role == "assistant" and is_confirmation(message_text(msgs[-2]))
+
+
+class LLMEvaluator(UnderstandingEvaluator):
+    """ Separate grader model, the one that used to be commented out in main.py """
+
+    cacheable = True
+
+    def __init__(self, model: str = "gpt-4-turbo", history: int = 10, client=None):
+        self.model = model
+        self.history = history
+        self._client = client
+
+    async def evaluate(self, tracker, chat_ctx, section):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI()
+
+        history = "\n".join(f"{msg.role}: {message_text(msg)}" for msg in chat_ctx.messages[-self.history:])
+        response = await self._client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": """You are an educational evaluation assistant built to evaluate if a user has understood content or have demonstrated awareness of their own knowledge.
+Sometimes a user's response will be them asking a question. If this is the case then return "Failure". Othertimes the user will be asked to demonstrate their understanding or the most important thing they've learned so far.
+If this is the case, the key is that the user 'demonstrates awareness of their own knowledge'. That is, if the user is learning about Confucius and all they say is "Confucius", this is not adequate. If they are more detailed and say something like "Confucius' teachings were patriarchal", this is permissible and is a "Success".
+"""},
+                {"role": "user", "content": f"""Here is the content the user is supposed to have understood:
+{section}
+
+Here is the chat history:
+{history}
+
+If the user has understood this content, reply verbatim "Success" and nothing else. Otherwise, reply with "Failure".
+Note: The user may not skip this in ANY WAY except by demonstrating an understandining, not merely  claiming to have no questions.
+"""}
+            ],
+            model=self.model,
+            temperature=0.3,
+        )
+
+        verdict = response.choices[0].message.content.lower()
+        logger.info(verdict)
+        return "success" in verdict
+
+
+class UnderstandingTracker:
+    """
+    Per-session understanding state, updated incrementally from agent_speech_committed so
+    the check in before_llm_cb never rescans the chat history. Verdicts are cached per
+    user turn (section, committed user turns so far, the turn's text) so the same turn is
+    never graded twice, and a repeated "I don't know" later on is graded again.
+    """
+
+    def __init__(self, evaluator: Optional[UnderstandingEvaluator] = None, cache_size: int = 256):
+        self.evaluator = evaluator or PhraseEvaluator()
+        self.cache_size = cache_size
+        self.confirmed = False
+        self.user_turns = 0 # counted on user_speech_committed, after the turn's reply was requested
+        self._verdicts: "OrderedDict[tuple, bool]" = OrderedDict()
+
+    def on_agent_speech(self, msg: llm.ChatMessage):
+        if not self.confirmed and is_confirmation(message_text(msg)):
+            logger.info("Moving on to next section!")
+            self.confirmed = True
+
+    def on_user_speech(self, msg: llm.ChatMessage):
+        self.user_turns += 1
+
+    def mark_section_boundary(self):
+        self.confirmed = False
+
+    async def evaluate(self, chat_ctx: llm.ChatContext, current_section: int, sections: Sequence[str]) -> bool:
+        section = sections[current_section] if current_section < len(sections) else ""
+        if not self.evaluator.cacheable:
+            return await self.evaluator.evaluate(self, chat_ctx, section)
+
+        user_text = message_text(chat_ctx.messages[-1]) if chat_ctx.messages else ""
+        # a reply cancelled before it played isn't committed, its longer retry has a different text
+        key = (current_section, self.user_turns, user_text)
+        if key in self._verdicts:
+            self._verdicts.move_to_end(key)
+            return self._verdicts[key]
+
+        understood = await self.evaluator.evaluate(self, chat_ctx, section)
+        self._verdicts[key] = understood
+        while len(self._verdicts) > self.cache_size:
+            self._verdicts.popitem(last=False)
+        return understood
@@ -31,6 +31,23 @@ const VALID_CODES = {
   TRIANGLE: "User Raise Hand"
 };
 
+// Data channel protocol, see backend/protocol.py: {"v": 1, "m": [[type, data], ...]} on the "tutor" topic
+const PROTOCOL_VERSION = 1;
+const PROTOCOL_TOPIC = "tutor";
+
+function encodeMessage(type: string, data: object): Uint8Array {
+  return new TextEncoder().encode(JSON.stringify({ v: PROTOCOL_VERSION, m: [[type, data]] }));
+}
+
+function decodeMessages(payload: Uint8Array): [string, any][] {
+  try {
+    const envelope = JSON.parse(new TextDecoder().decode(payload));
+    return envelope?.v === PROTOCOL_VERSION && Array.isArray(envelope.m) ? envelope.m : [];
+  } catch {
+    return [];
+  }
+}
+
 export default function Page() {
   const [connectionDetails, updateConnectionDetails] = useState<ConnectionDetails | undefined>(undefined);
   const [agentState, setAgentState] = useState<AgentState>("disconnected");
@@ -144,6 +161,7 @@ export default function Page() {
             <SimpleVoiceAssistant 
               onStateChange={setAgentState} 
               isHandRaised={isHandRaised}
+              setIsHandRaised={setIsHandRaised}
               mode={mode}
             />
             <ControlBar
@@ -199,16 +217,36 @@ function StrawberryToast({ isVisible, onClose }) {
 function SimpleVoiceAssistant(props: {
   onStateChange: (state: AgentState) => void;
   isHandRaised: boolean;
+  setIsHandRaised: (raised: boolean) => void;
   mode: string;
 }) {
   const { state, audioTrack } = useVoiceAssistant();
-  const { localParticipant, microphoneTrack } = useLocalParticipant();
+  const { microphoneTrack } = useLocalParticipant();
   const [isStrawberryToastVisible, setIsStrawberryToastVisible] = useState(false);
+  const [progress, setProgress] = useState<{ section: number; total: number } | null>(null);
+  const [speaking, setSpeaking] = useState({ agent: false, user: false });
   const room = useRoomContext();
   
   // Add listener for data messages
   useEffect(() => {
-    const handleData = (payload: Uint8Array, participant?: RemoteParticipant) => {
+    const handleData = (payload: Uint8Array, participant?: RemoteParticipant, kind?: unknown, topic?: string) => {
+      if (topic === PROTOCOL_TOPIC) {
+        for (const [type, data] of decodeMessages(payload)) {
+          if (type === "progress") {
+            setProgress({ section: data.section, total: data.total });
+          } else if (type === "speaking") {
+            // lossy, a dropped update is replaced by the next one
+            setSpeaking({ agent: data.agent, user: data.user });
+          } else if (type === "hand") {
+            // the tutor's ack, the button shows the hand as the tutor has it
+            props.setIsHandRaised(data.raised);
+          } else if (type === "completed" && data.code === "strawberry") {
+            setIsStrawberryToastVisible(true);
+          }
+        }
+        return;
+      }
+      // agents from before the protocol send a bare string
       const decoder = new TextDecoder();
       const command = decoder.decode(payload);
       if (command == "strawberry") {
@@ -221,7 +259,7 @@ function SimpleVoiceAssistant(props: {
     return () => {
       room.off(RoomEvent.DataReceived, handleData);
     };
-  }, [room]);
+  }, [room, props.setIsHandRaised]);
 
   useEffect(() => {
     props.onStateChange(state);
@@ -239,21 +277,6 @@ function SimpleVoiceAssistant(props: {
     }
   }, [props.isHandRaised, props.mode, microphoneTrack]);
 
-  // Send hand raise status to agent via data channel
-  useEffect(() => {
-    if (props.mode === "User Raise Hand" && localParticipant) {
-      // Send hand-raise command to the backend
-      if (props.isHandRaised) {
-        localParticipant.publishData(
-          new TextEncoder().encode("HAND_RAISED"), 
-          { topic: "command", reliable: true }
-        ).then(data => {
-          console.log("Sent HAND_RAISED command");
-        })
-      }
-    }
-  }, [props.isHandRaised, props.mode, localParticipant]);
-
   // Auto-hide toast after 5 seconds
   // useEffect(() => {
   //   if (isStrawberryToastVisible) {
@@ -281,6 +304,16 @@ function SimpleVoiceAssistant(props: {
         className="agent-visualizer"
         options={{ minHeight: 24 }}
       />
+      {speaking.user && (
+        <p className="text-white/60 text-center text-sm">
+          {speaking.agent ? "The tutor hears you and will stop to listen" : "The tutor is listening"}
+        </p>
+      )}
+      {progress && (
+        <p className="text-white/60 text-center text-sm">
+          Section {Math.min(progress.section + 1, progress.total)} of {progress.total}
+        </p>
+      )}
     </div>
   );
 }
@@ -299,10 +332,17 @@ function ControlBar(props: {
     krisp.setNoiseFilterEnabled(true);
   }, []);
 
-  // Handle hand raise toggle
+  // Handle hand raise toggle; raising and lowering both go to the backend, so the tutor can be asked again
   const toggleHand = useCallback(() => {
-    props.setIsHandRaised(!props.isHandRaised);
-  }, [props.isHandRaised, props.setIsHandRaised]);
+    const raised = !props.isHandRaised;
+    props.setIsHandRaised(raised);
+    localParticipant.publishData(
+      encodeMessage("hand", { raised }),
+      { topic: PROTOCOL_TOPIC, reliable: true }
+    ).then(data => {
+      console.log(`Sent hand ${raised ? "raised" : "lowered"}`);
+    })
+  }, [props.isHandRaised, props.setIsHandRaised, localParticipant]);
 
   return (
     <div className="relative h-[100px]">